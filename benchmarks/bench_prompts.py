@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Сравнение шаблонов src/prompts.py с прежним
+форматированием промптов через += на больших наборах записей.
+
+    python benchmarks/bench_prompts.py --records 200000
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.prompts import PromptLibrary
+
+def legacy_record_prompt(item: dict) -> str:
+    """Прежний DataProcessor._create_prompt"""
+    prompt_parts = []
+    if item.get('system'):
+        prompt_parts.append(f"System: {item['system']}")
+    prompt_parts.append(f"Instruction: {item.get('instruction', '')}")
+    if item.get('input'):
+        prompt_parts.append(f"Input: {item.get('input', '')}")
+    return "\n".join(prompt_parts) + "\nResponse:"
+
+def legacy_eval_prompt(item: dict) -> str:
+    """Прежний APITrainer._create_prompt"""
+    prompt = f"Инструкция: {item.get('instruction', '')}\n"
+    if item.get('input'):
+        prompt += f"Входные данные: {item.get('input', '')}\n"
+    prompt += "Ответ:"
+    return prompt
+
+def legacy_training_prompt(examples: list, current_item: dict) -> str:
+    """Прежний APITrainer._create_training_prompt (без выбора примеров)"""
+    prompt = "Ты проходишь дообучение на следующих примерах:\n\n"
+    for j, example in enumerate(examples):
+        prompt += f"Пример {j + 1}:\n"
+        prompt += f"Инструкция: {example.get('instruction', '')}\n"
+        if example.get('input'):
+            prompt += f"Входные данные: {example.get('input', '')}\n"
+        prompt += f"Ожидаемый ответ: {example.get('output', '')}\n\n"
+    prompt += "Новый запрос для обучения:\n"
+    prompt += f"Инструкция: {current_item.get('instruction', '')}\n"
+    if current_item.get('input'):
+        prompt += f"Входные данные: {current_item.get('input', '')}\n"
+    prompt += "Твой ответ должен быть:"
+    return prompt
+
+def make_records(count: int, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    words = ["данные", "модель", "python", "класс", "функция", "ответ", "пример", "алгоритм"]
+
+    def text(n):
+        return ' '.join(rng.choice(words) for _ in range(n))
+
+    return [{
+        'system': text(10) if rng.random() < 0.5 else '',
+        'instruction': text(15),
+        'input': text(20) if rng.random() < 0.3 else '',
+        'output': text(60)
+    } for _ in range(count)]
+
+def timed(func):
+    start = time.perf_counter()
+    result = func()
+    return result, time.perf_counter() - start
+
+def run(num_records: int, num_examples: int = 2) -> dict:
+    """Замеры для всех видов промптов, проверяет совпадение результатов"""
+    records = make_records(num_records)
+    examples = records[:num_examples]
+    prompts = PromptLibrary()
+
+    cases = {
+        'record': (lambda: [legacy_record_prompt(r) for r in records],
+                   lambda: prompts.record.render_many(records)),
+        'eval': (lambda: [legacy_eval_prompt(r) for r in records],
+                 lambda: prompts.eval.render_many(records)),
+        'training': (lambda: [legacy_training_prompt(examples, r) for r in records],
+                     lambda: [prompts.training.render(examples, r) for r in records]),
+    }
+
+    report = {}
+    for name, (legacy, compiled) in cases.items():
+        legacy_result, legacy_time = timed(legacy)
+        compiled_result, compiled_time = timed(compiled)
+        if legacy_result != compiled_result:
+            raise AssertionError(f"Template '{name}' output differs from legacy formatting")
+        report[name] = {
+            'records': num_records,
+            'legacy_sec': legacy_time,
+            'template_sec': compiled_time,
+            'speedup': legacy_time / compiled_time if compiled_time else float('inf')
+        }
+    return report
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark prompt templates against legacy formatting')
+    parser.add_argument('--records', type=int, default=200000)
+    args = parser.parse_args()
+
+    for name, row in run(args.records).items():
+        print(f"{name:10s} legacy {row['legacy_sec']:.3f}s  template {row['template_sec']:.3f}s  "
+              f"x{row['speedup']:.2f}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
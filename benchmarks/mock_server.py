@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Локальная замена LM Studio для бенчмарков: OpenAI-совместимый
+/v1/chat/completions (обычный и потоковый режим) с настраиваемым
+распределением задержки, долей ошибок и скоростью генерации токенов.
+
+    python benchmarks/mock_server.py --port 1234 --latency lognormal --latency_mean 0.2 --error_rate 0.05
+
+Из кода:
+
+    with MockServer(latency_mean=0.02) as server:
+        config['api']['base_url'] = server.base_url
+"""
+
+import argparse
+import json
+import math
+import random
+import threading
+import os
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = ["модель", "данные", "ответ", "пример", "функция", "класс", "python", "алгоритм", "значение", "список"]
+
+class MockServer:
+    """
+    Сервер в фоновом потоке. Время ответа = задержка до первого токена
+    (распределение latency со средним latency_mean) + completion_tokens /
+    tokens_per_second. С вероятностью error_rate отвечает одним из
+    error_statuses (для 429 с заголовком Retry-After). С вероятностью
+    runaway_rate ответ «зацикливается» на runaway_tokens токенов и
+    обрывается только по max_tokens запроса. Стоп-последовательности
+    запроса (stop) обрезают ответ.
+
+    При prefill_tokens_per_second > 0 добавляется время обработки промпта
+    с кэшем префиксов как у llama.cpp: cache_slots последних промптов, общий
+    с ними префикс не пересчитывается и отдается в
+    usage.prompt_tokens_details.cached_tokens.
+
+    Параметр запроса n по умолчанию игнорируется (один вариант ответа, как
+    у LM Studio); при supports_n возвращается n вариантов, которые
+    генерируются параллельно после одной обработки промпта.
+    """
+
+    LATENCIES = ('fixed', 'uniform', 'exponential', 'lognormal')
+
+    def __init__(self, host: str = '127.0.0.1', port: int = 0, latency: str = 'lognormal',
+                 latency_mean: float = 0.02, latency_sigma: float = 0.5, error_rate: float = 0.0,
+                 error_statuses: tuple = (429, 503), retry_after: float = 0.0,
+                 tokens_per_second: float = 2000.0, completion_tokens: int = 32, seed: int = 0,
+                 prefill_tokens_per_second: float = 0.0, cache_slots: int = 4, supports_n: bool = False,
+                 runaway_rate: float = 0.0, runaway_tokens: int = 2000):
+        if latency not in self.LATENCIES:
+            raise ValueError(f"Unknown latency distribution: {latency}")
+        self.latency = latency
+        self.latency_mean = latency_mean
+        self.latency_sigma = latency_sigma
+        self.error_rate = error_rate
+        self.error_statuses = tuple(error_statuses)
+        self.retry_after = retry_after
+        self.tokens_per_second = tokens_per_second
+        self.completion_tokens = completion_tokens
+        self.prefill_tokens_per_second = prefill_tokens_per_second
+        self.cache_slots = max(1, cache_slots)
+        self.supports_n = supports_n
+        self.runaway_rate = runaway_rate
+        self.runaway_tokens = runaway_tokens
+        # Промпты в слотах кэша, от давно использованного к недавнему
+        self._slots = []
+        self.prompt_tokens = 0
+        self.cached_tokens = 0
+        self.requests = 0
+        self.errors = 0
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self):
+        self._thread = threading.Thread(target=self._server.serve_forever, name='mock-server', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def _sample(self):
+        """Задержка до первого токена, статус ошибки (или None) и число токенов ответа"""
+        with self._lock:
+            self.requests += 1
+            rng = self._rng
+            if self.latency == 'fixed':
+                delay = self.latency_mean
+            elif self.latency == 'uniform':
+                delay = rng.uniform(0, 2 * self.latency_mean)
+            elif self.latency == 'exponential':
+                delay = rng.expovariate(1 / self.latency_mean) if self.latency_mean > 0 else 0.0
+            else:
+                # Среднее логнормального распределения равно latency_mean
+                mu = math.log(self.latency_mean) - self.latency_sigma ** 2 / 2 if self.latency_mean > 0 else 0.0
+                delay = rng.lognormvariate(mu, self.latency_sigma) if self.latency_mean > 0 else 0.0
+
+            status = None
+            if self.error_statuses and rng.random() < self.error_rate:
+                status = rng.choice(self.error_statuses)
+                self.errors += 1
+
+        return delay, status, self._words()
+
+    def _words(self) -> list:
+        """Слова одного варианта ответа"""
+        with self._lock:
+            rng = self._rng
+            if self.runaway_rate and rng.random() < self.runaway_rate:
+                tokens = self.runaway_tokens
+            else:
+                tokens = max(1, int(rng.gauss(self.completion_tokens, self.completion_tokens / 4)))
+            return [rng.choice(WORDS) for _ in range(tokens)]
+
+    @staticmethod
+    def _finish(words: list, max_tokens: int, stop=None) -> tuple:
+        """Ответ, обрезанный по стоп-последовательности или max_tokens, и finish_reason"""
+        if isinstance(stop, str):
+            stop = [stop]
+        if stop:
+            text = ' '.join(words)
+            positions = [text.find(sequence) for sequence in stop if sequence]
+            positions = [position for position in positions if position >= 0]
+            if positions:
+                words = text[:min(positions)].split()
+        if len(words) > max_tokens:
+            return words[:max_tokens], 'length'
+        return words, 'stop'
+
+    def _prefill(self, text: str) -> tuple:
+        """Время обработки промпта и число токенов, взятых из кэша (4 символа на токен)"""
+        if self.prefill_tokens_per_second <= 0:
+            return 0.0, 0
+        with self._lock:
+            # Как в llama.cpp: слот, с которым общий префикс не короче половины
+            # промпта, иначе свободный слот, иначе самый давно использованный
+            lengths = [len(os.path.commonprefix([cached, text])) for cached in self._slots]
+            best = max(range(len(lengths)), key=lengths.__getitem__, default=None)
+            if best is None or lengths[best] * 2 < len(text):
+                best = 0 if len(self._slots) >= self.cache_slots else None
+            best_length = lengths[best] if best is not None else 0
+            if best is not None:
+                self._slots.pop(best)
+            self._slots.append(text)
+
+            tokens = len(text) // 4
+            cached = best_length // 4
+            self.prompt_tokens += tokens
+            self.cached_tokens += cached
+        return (tokens - cached) / self.prefill_tokens_per_second, cached
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            # Заголовки и тело уходят одной записью, иначе задержанный ACK
+            # клиента добавляет ~40 мс к каждому ответу
+            wbufsize = 65536
+            disable_nagle_algorithm = True
+
+            def log_message(self, format, *args):
+                pass
+
+            def _send_json(self, status: int, body: dict, headers: dict = None):
+                data = json.dumps(body, ensure_ascii=False).encode('utf-8')
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                for name, value in (headers or {}).items():
+                    self.send_header(name, value)
+                self.end_headers()
+                self.wfile.write(data)
+
+            def do_GET(self):
+                if self.path.rstrip('/') == '/v1/models':
+                    self._send_json(200, {"object": "list", "data": [{"id": "mock-model", "object": "model"}]})
+                else:
+                    self._send_json(404, {"error": {"message": "Not found"}})
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+                if self.path.rstrip('/') != '/v1/chat/completions':
+                    self._send_json(404, {"error": {"message": "Not found"}})
+                    return
+
+                request = json.loads(body or b'{}')
+                delay, status, words = server._sample()
+                max_tokens = request.get('max_tokens') or len(words)
+                words, finish_reason = server._finish(words, max_tokens, request.get('stop'))
+                text = ''.join(f"<{m.get('role')}>{m.get('content') or ''}" for m in request.get('messages', []))
+                prompt_tokens = len(text) // 4
+                prefill, cached_tokens = server._prefill(text)
+
+                time.sleep(delay + prefill)
+                if status is not None:
+                    headers = {'Retry-After': str(server.retry_after)} if status == 429 else None
+                    self._send_json(status, {"error": {"message": f"Mock error {status}"}}, headers)
+                    return
+
+                if request.get('stream'):
+                    self._stream(request, words, finish_reason, prompt_tokens, cached_tokens)
+                    return
+
+                samples = [(words, finish_reason)]
+                if server.supports_n:
+                    for _ in range(int(request.get('n') or 1) - 1):
+                        samples.append(server._finish(server._words(), max_tokens, request.get('stop')))
+                completion_tokens = sum(len(sample) for sample, _ in samples)
+
+                # Варианты декодируются одним батчем
+                time.sleep(max(len(sample) for sample, _ in samples) / server.tokens_per_second)
+                self._send_json(200, {
+                    "id": "chatcmpl-mock",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": request.get('model', 'mock-model'),
+                    "choices": [{
+                        "index": i,
+                        "message": {"role": "assistant", "content": ' '.join(sample)},
+                        "finish_reason": reason
+                    } for i, (sample, reason) in enumerate(samples)],
+                    "usage": {
+                        "prompt_tokens": prompt_tokens,
+                        "completion_tokens": completion_tokens,
+                        "total_tokens": prompt_tokens + completion_tokens,
+                        "prompt_tokens_details": {"cached_tokens": cached_tokens}
+                    }
+                })
+
+            def _stream(self, request: dict, words: list, finish_reason: str, prompt_tokens: int,
+                        cached_tokens: int = 0):
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/event-stream')
+                self.send_header('Transfer-Encoding', 'chunked')
+                self.end_headers()
+
+                def send(payload):
+                    data = f"data: {payload}\n\n".encode('utf-8')
+                    self.wfile.write(f"{len(data):x}\r\n".encode('ascii') + data + b"\r\n")
+                    self.wfile.flush()
+
+                def chunk(delta, finish=None, usage=None):
+                    event = {
+                        "id": "chatcmpl-mock",
+                        "object": "chat.completion.chunk",
+                        "model": request.get('model', 'mock-model'),
+                        "choices": [{"index": 0, "delta": delta, "finish_reason": finish}]
+                    }
+                    if usage is not None:
+                        event["usage"] = usage
+                    return json.dumps(event, ensure_ascii=False)
+
+                send(chunk({"role": "assistant"}))
+                for i, word in enumerate(words):
+                    time.sleep(1 / server.tokens_per_second)
+                    send(chunk({"content": word if i == 0 else ' ' + word}))
+                send(chunk({}, finish_reason, {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words),
+                    "prompt_tokens_details": {"cached_tokens": cached_tokens}
+                }))
+                send("[DONE]")
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+
+        return Handler
+
+def main():
+    parser = argparse.ArgumentParser(description='Mock OpenAI-compatible server for benchmarks')
+    parser.add_argument('--host', type=str, default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=1234)
+    parser.add_argument('--latency', type=str, default='lognormal', choices=MockServer.LATENCIES)
+    parser.add_argument('--latency_mean', type=float, default=0.2,
+                        help='Mean time to first token, seconds')
+    parser.add_argument('--latency_sigma', type=float, default=0.5,
+                        help='Sigma of the lognormal distribution')
+    parser.add_argument('--error_rate', type=float, default=0.0)
+    parser.add_argument('--error_statuses', type=int, nargs='+', default=[429, 503])
+    parser.add_argument('--retry_after', type=float, default=0.0)
+    parser.add_argument('--tokens_per_second', type=float, default=50.0)
+    parser.add_argument('--completion_tokens', type=int, default=64)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--prefill_tokens_per_second', type=float, default=0.0,
+                        help='Prompt processing speed with a prefix cache (0 - prompt processing is free)')
+    parser.add_argument('--cache_slots', type=int, default=4, help='Prompts kept in the prefix cache')
+    parser.add_argument('--runaway_rate', type=float, default=0.0,
+                        help='Share of completions that run until max_tokens')
+    parser.add_argument('--runaway_tokens', type=int, default=2000)
+    parser.add_argument('--supports_n', action='store_true',
+                        help='Return n completions per request instead of ignoring n')
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, args.latency, args.latency_mean, args.latency_sigma,
+                        args.error_rate, args.error_statuses, args.retry_after,
+                        args.tokens_per_second, args.completion_tokens, args.seed,
+                        args.prefill_tokens_per_second, args.cache_slots, args.supports_n,
+                        args.runaway_rate, args.runaway_tokens)
+    print(f"Mock server listening on {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server._server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,228 @@
+#!/usr/bin/env python3
+"""
+Бенчмарки клиентской части проекта на локальном mock-сервере
+(benchmarks/mock_server.py), без LM Studio и GPU:
+
+- data: DataProcessor (чтение, подготовка, разделение) на наборах разного размера
+- evaluate: LMStudioClient.evaluate при разной конкурентности
+- train: APITrainer.train (одна эпоха, с чекпоинтом) при разной конкурентности
+
+Результаты сохраняются в JSON и сравниваются с сохраненной базовой линией:
+
+    python benchmarks/run_benchmarks.py --output output/bench.json
+    python benchmarks/run_benchmarks.py --save_baseline      # обновить benchmarks/baseline.json
+
+Код выхода 1, если пропускная способность какого-либо случая упала больше
+чем на --tolerance относительно базовой линии.
+"""
+
+import argparse
+import copy
+import json
+import logging
+import os
+import platform
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.dirname(BENCH_DIR))
+
+from src.utils import load_config
+from src.jsonl import write_jsonl
+from src.data_loader import DataProcessor
+from src.model_utils import LMStudioClient
+from src.trainer import APITrainer
+from bench_prompts import make_records
+from mock_server import MockServer
+
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, 'baseline.json')
+# Допустимое относительное падение пропускной способности (--tolerance)
+DEFAULT_TOLERANCE = 0.25
+
+def bench_config(base_config: dict, base_url: str, output_dir: str, concurrency: int) -> dict:
+    """Конфиг для замеров: mock-сервер, без кэша и файла метрик, фиксированная конкурентность"""
+    config = copy.deepcopy(base_config)
+    config['api'].pop('endpoints', None)
+    config['api']['base_url'] = base_url
+    config['training'].update(
+        output_dir=output_dir,
+        num_train_epochs=1,
+        execution_mode='async',
+        max_concurrency=concurrency,
+        request_delay=0,
+        logging_steps=10 ** 9
+    )
+    config.setdefault('rate_limit', {}).update(
+        initial_concurrency=concurrency,
+        max_concurrency=concurrency,
+        backoff_base=0.01,
+        backoff_max=0.1
+    )
+    config.setdefault('cache', {})['enabled'] = False
+    config.setdefault('metrics', {})['enabled'] = False
+    return config
+
+def bench_data(config: dict, size: int, workdir: str) -> dict:
+    """Чтение, подготовка и разделение JSONL файла из size записей"""
+    path = os.path.join(workdir, f"data_{size}.jsonl")
+    write_jsonl(path, make_records(size))
+
+    config = copy.deepcopy(config)
+    config['data']['max_samples'] = None
+    processor = DataProcessor(config)
+
+    start = time.perf_counter()
+    dataset = processor.stream_dataset(path)
+    train_data, eval_data = processor.stream_train_test_split(dataset, config['data']['test_size'])
+    num_train = sum(1 for _ in train_data)
+    num_eval = sum(1 for _ in eval_data)
+    seconds = time.perf_counter() - start
+
+    return {"items": num_train + num_eval, "seconds": seconds, "throughput": size / seconds}
+
+def bench_evaluate(config: dict, size: int) -> dict:
+    records = make_records(size, seed=1)
+    with LMStudioClient(config) as client:
+        prompts = client.prompts.eval.render_many(records)
+        references = [r['output'] for r in records]
+        start = time.perf_counter()
+        results = client.evaluate(prompts, references)
+        seconds = time.perf_counter() - start
+
+    failed = sum(r['generated_response'] is None for r in results)
+    return {"items": size, "failed": failed, "seconds": seconds, "throughput": size / seconds}
+
+def bench_train(config: dict, size: int) -> dict:
+    processor = DataProcessor(config)
+    train_data = processor.prepare_training_data(make_records(size, seed=2))
+
+    trainer = APITrainer(config)
+    try:
+        start = time.perf_counter()
+        processed = trainer.train(train_data, return_results=False)
+        seconds = time.perf_counter() - start
+    finally:
+        trainer.client.close()
+
+    return {"items": processed, "seconds": seconds, "throughput": processed / seconds}
+
+def run(args) -> dict:
+    base_config = load_config(args.config)
+    results = {}
+
+    with tempfile.TemporaryDirectory() as workdir:
+        for size in args.data_sizes:
+            results[f"data/n={size}"] = bench_data(base_config, size, workdir)
+            print(f"data/n={size}: {results[f'data/n={size}']['throughput']:.0f} records/s")
+
+        server_options = dict(
+            latency=args.latency,
+            latency_mean=args.latency_mean,
+            error_rate=args.error_rate,
+            tokens_per_second=args.tokens_per_second,
+            completion_tokens=args.completion_tokens,
+            prefill_tokens_per_second=args.prefill_tokens_per_second,
+            cache_slots=args.cache_slots,
+            runaway_rate=args.runaway_rate
+        )
+        with MockServer(**server_options) as server:
+            for concurrency in args.concurrency:
+                for size in args.sizes:
+                    output_dir = os.path.join(workdir, f"train_c{concurrency}_n{size}")
+                    config = bench_config(base_config, server.base_url, output_dir, concurrency)
+
+                    for suite, func in (('evaluate', bench_evaluate), ('train', bench_train)):
+                        name = f"{suite}/c={concurrency}/n={size}"
+                        results[name] = func(config, size)
+                        print(f"{name}: {results[name]['throughput']:.1f} items/s")
+
+            server_stats = {"requests": server.requests, "errors": server.errors}
+
+    return {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "server": {**server_options, **server_stats},
+            "args": {k: v for k, v in vars(args).items() if k not in ('output', 'baseline')}
+        },
+        "results": results
+    }
+
+def compare(report: dict, baseline: dict, tolerance: float) -> list:
+    """Случаи, пропускная способность которых упала больше чем на tolerance"""
+    regressions = []
+    print(f"\n{'case':<28} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in report['results'].items():
+        reference = baseline['results'].get(name)
+        if reference is None:
+            print(f"{name:<28} {'-':>10} {current['throughput']:>10.1f}      new")
+            continue
+
+        change = current['throughput'] / reference['throughput'] - 1
+        marker = ''
+        if change < -tolerance:
+            regressions.append(name)
+            marker = '  REGRESSION'
+        print(f"{name:<28} {reference['throughput']:>10.1f} {current['throughput']:>10.1f} "
+              f"{change:>+7.1%}{marker}")
+    return regressions
+
+def main():
+    parser = argparse.ArgumentParser(description='Client-side benchmarks against a mock LM Studio server')
+    parser.add_argument('--config', type=str, default='config/training_config.yaml')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[50, 200],
+                        help='Number of prompts for evaluate/train cases')
+    parser.add_argument('--data_sizes', type=int, nargs='+', default=[1000, 10000, 100000],
+                        help='Number of records for DataProcessor cases')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--latency', type=str, default='lognormal', choices=MockServer.LATENCIES)
+    parser.add_argument('--latency_mean', type=float, default=0.02)
+    parser.add_argument('--error_rate', type=float, default=0.0)
+    parser.add_argument('--tokens_per_second', type=float, default=2000.0)
+    parser.add_argument('--completion_tokens', type=int, default=32)
+    parser.add_argument('--prefill_tokens_per_second', type=float, default=0.0,
+                        help='Simulated prompt processing speed with a prefix cache (0 - free)')
+    parser.add_argument('--cache_slots', type=int, default=4, help='Prompts kept in the simulated prefix cache')
+    parser.add_argument('--runaway_rate', type=float, default=0.0,
+                        help='Share of simulated completions that run until max_tokens')
+    parser.add_argument('--output', type=str, default=None, help='Where to save results (JSON)')
+    parser.add_argument('--baseline', type=str, default=DEFAULT_BASELINE)
+    parser.add_argument('--save_baseline', action='store_true',
+                        help='Store the results as the new baseline instead of comparing')
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE,
+                        help='Allowed relative throughput drop before a case counts as a regression')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING)
+    report = run(args)
+
+    if args.output:
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Baseline saved to {args.baseline}")
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"No baseline at {args.baseline}, run with --save_baseline to create it")
+        return
+
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    regressions = compare(report, baseline, args.tolerance)
+    if regressions:
+        print(f"\n{len(regressions)} regression(s): {', '.join(regressions)}")
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
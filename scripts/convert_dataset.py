@@ -1,62 +1,142 @@
-import json
 import argparse
+import multiprocessing
 import os
 import sys
+from collections import deque
 
 # Добавляем корневую директорию в путь Python
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
-def convert_dataset(input_file, output_file):
-    """Конвертирует ваш датасет в формат для обучения"""
+from src import jsonl
+from src.utils import load_config, iter_json_array
+from src.prompts import PromptLibrary
+from src.dedup import MinHashDeduplicator, save_dedup_report
+
+# Шаблон промпта процесса-обработчика (создается один раз в initializer пула)
+_record_template = None
+
+def _init_worker(config):
+    global _record_template
+    _record_template = PromptLibrary(config).record
+
+def convert_item(item, record_template):
+    """Запись в формате для обучения"""
+    # Создаем промпт в формате для обучения
+    prompt = record_template.render(item)
+    
+    return {
+        "instruction": item['instruction'],
+        "input": item.get('input', ''),
+        "output": item['output'],
+        "system": item.get('system', ''),
+        "prompt": prompt,
+        "full_text": f"{prompt}{item['output']}"
+    }
+
+def _convert_chunk(items):
+    """Блок записей -> готовые строки JSONL в UTF-8 (выполняется в процессе пула)"""
+    return b''.join(jsonl.dumps_bytes(convert_item(item, _record_template)) + b'\n' for item in items)
+
+def iter_chunks(items, chunk_size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def convert_dataset(input_file, output_file, config=None, dedup=None, dedup_report=None,
+                    workers=None, chunk_size=1000):
+    """
+    Конвертирует ваш датасет в формат для обучения.
+    Входной JSON-массив читается потоково, записи форматируются блоками по
+    chunk_size в workers процессах (по умолчанию по числу ядер) и пишутся в
+    JSONL в исходном порядке, так что в памяти не больше нескольких блоков.
+    dedup (MinHashDeduplicator) удаляет почти одинаковые записи (отдельный
+    проход по файлу), dedup_report - путь для отчета об удаленных записях.
+    Возвращает число записанных записей.
+    """
     
     # Проверяем существование входного файла
     if not os.path.exists(input_file):
         print(f"Input file not found: {input_file}")
         return
     
-    with open(input_file, 'r', encoding='utf-8') as f:
-        data = json.load(f)
-    
-    converted_data = []
-    
-    for item in data:
-        # Создаем промпт в формате для обучения
-        prompt_parts = []
-        
-        if item.get('system'):
-            prompt_parts.append(f"System: {item['system']}")
-        
-        prompt_parts.append(f"Instruction: {item['instruction']}")
-        
-        if item.get('input'):
-            prompt_parts.append(f"Input: {item['input']}")
-        
-        prompt = "\n".join(prompt_parts) + "\nResponse:"
-        
-        converted_data.append({
-            "instruction": item['instruction'],
-            "input": item.get('input', ''),
-            "output": item['output'],
-            "system": item.get('system', ''),
-            "prompt": prompt,
-            "full_text": f"{prompt}{item['output']}"
-        })
+    items = iter_json_array(input_file)
+    if dedup is not None:
+        num_items = 0
+        def counted():
+            nonlocal num_items
+            for item in iter_json_array(input_file):
+                num_items += 1
+                yield item
+        duplicates = dedup.find_duplicates(counted())
+        print(dedup.report(duplicates, num_items))
+        if dedup_report:
+            save_dedup_report(dedup_report, duplicates, iter_json_array(input_file))
+            print(f"Dedup report saved to {dedup_report}")
+        items = (item for i, item in enumerate(iter_json_array(input_file)) if i not in duplicates)
     
     # Создаем директорию если не существует
-    os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    directory = os.path.dirname(output_file)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
     
-    # Сохраняем в JSONL формат
-    with open(output_file, 'w', encoding='utf-8') as f:
-        for item in converted_data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    workers = workers or os.cpu_count() or 1
+    count = 0
+    # Сохраняем в JSONL формат крупными записями
+    with open(output_file, 'wb', buffering=1 << 20) as f:
+        if workers == 1:
+            _init_worker(config)
+            for chunk in iter_chunks(items, chunk_size):
+                f.write(_convert_chunk(chunk))
+                count += len(chunk)
+        else:
+            with multiprocessing.Pool(workers, initializer=_init_worker, initargs=(config,)) as pool:
+                # Не больше 2 * workers блоков в работе: чтение не обгоняет запись
+                pending = deque()
+                for chunk in iter_chunks(items, chunk_size):
+                    pending.append((pool.apply_async(_convert_chunk, (chunk,)), len(chunk)))
+                    if len(pending) >= 2 * workers:
+                        result, size = pending.popleft()
+                        f.write(result.get())
+                        count += size
+                while pending:
+                    result, size = pending.popleft()
+                    f.write(result.get())
+                    count += size
     
-    print(f"Converted {len(converted_data)} samples to {output_file}")
-    return converted_data
+    print(f"Converted {count} samples to {output_file}")
+    return count
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Convert dataset format')
     parser.add_argument('--input', type=str, required=True, help='Input JSON file')
     parser.add_argument('--output', type=str, default='data/train_dataset.jsonl', help='Output JSONL file')
+    parser.add_argument('--config', type=str, default=None,
+                       help='Config file with prompt templates (defaults are used if omitted)')
+    parser.add_argument('--dedup', action='store_true',
+                       help='Drop near-duplicate records (MinHash/LSH), also enabled by dedup.enabled in the config')
+    parser.add_argument('--threshold', type=float, default=None,
+                       help='Similarity threshold for --dedup (default 0.85 or dedup.threshold)')
+    parser.add_argument('--dedup_report', type=str, default=None,
+                       help='Where to save the list of dropped records (JSONL)')
+    parser.add_argument('--workers', type=int, default=None,
+                       help='Formatting processes (default: number of CPU cores)')
+    parser.add_argument('--chunk_size', type=int, default=1000,
+                       help='Records per chunk sent to a worker process')
     
     args = parser.parse_args()
-    convert_dataset(args.input, args.output)
\ No newline at end of file
+    config = load_config(args.config) if args.config else None
+    
+    dedup_config = dict((config or {}).get('dedup') or {})
+    if args.dedup:
+        dedup_config['enabled'] = True
+    if args.threshold is not None:
+        dedup_config['threshold'] = args.threshold
+    dedup = MinHashDeduplicator.from_config({'dedup': dedup_config})
+    
+    convert_dataset(args.input, args.output, config, dedup, args.dedup_report or dedup_config.get('report_path'),
+                    workers=args.workers, chunk_size=args.chunk_size)
\ No newline at end of file
@@ -0,0 +1,58 @@
+#!/usr/bin/env python3
+
+import argparse
+import json
+import os
+import signal
+import sys
+
+# Добавляем корневую директорию в путь Python
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import load_config, setup_logging
+from src.daemon import InferenceDaemon, DaemonClient, socket_path
+
+def main():
+    parser = argparse.ArgumentParser(description='Local inference daemon shared by train.py, test_model.py and inference.py')
+    parser.add_argument('--config', type=str, default='config/training_config.yaml')
+    parser.add_argument('--socket', type=str, default=None,
+                        help='Unix socket path (default: daemon.socket from the config)')
+    action = parser.add_mutually_exclusive_group()
+    action.add_argument('--status', action='store_true', help='Print the running daemon stats as JSON')
+    action.add_argument('--stop', action='store_true', help='Stop the running daemon')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.config):
+        print(f"Config file not found: {args.config}", file=sys.stderr)
+        print("Please make sure the config file exists or provide correct path with --config", file=sys.stderr)
+        sys.exit(1)
+
+    logger = setup_logging()
+    config = load_config(args.config)
+    path = args.socket or socket_path(config)
+
+    if args.status or args.stop:
+        try:
+            client = DaemonClient(config, path)
+        except OSError as e:
+            print(f"Inference daemon is not running at {path} ({e})", file=sys.stderr)
+            sys.exit(1)
+        with client:
+            if args.status:
+                print(json.dumps(client.stats(), ensure_ascii=False, indent=2))
+            else:
+                client.call({"op": "shutdown"})
+                print(f"Inference daemon at {path} is stopping")
+        return
+
+    daemon = InferenceDaemon(config, path)
+    # SIGTERM завершает демон так же, как Ctrl-C: сокет удаляется, метрики сохраняются
+    signal.signal(signal.SIGTERM, lambda signum, frame: daemon.shutdown())
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("Interrupted")
+
+if __name__ == "__main__":
+    main()
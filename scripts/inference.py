@@ -3,45 +3,260 @@
 import argparse
 import os
 import sys
+import time
 
 # Добавляем корневую директорию в путь Python
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.utils import load_config, setup_logging
-from src.model_utils import LMStudioClient
+from src.model_utils import GenerationClient
+from src.daemon import create_client
+from src.prompts import PromptLibrary
+from src.async_engine import AsyncGenerationEngine
+from src.jsonl import open_text, loads, dumps
+from src.profiling import add_profile_arguments, profiling, phase
 
 def main():
     parser = argparse.ArgumentParser(description='Inference with LM Studio API')
     parser.add_argument('--config', type=str, default='config/training_config.yaml')
-    parser.add_argument('--prompt', type=str, required=True)
-    parser.add_argument('--max_tokens', type=int, default=2048)
+    mode = parser.add_mutually_exclusive_group(required=True)
+    mode.add_argument('--prompt', type=str, help='Single prompt')
+    mode.add_argument('--input', type=str,
+                      help='Batch mode: file with prompts (JSONL or one prompt per line), "-" for stdin')
+    mode.add_argument('--interactive', action='store_true',
+                      help='REPL: read prompts one by one, keeping the client warm')
+    parser.add_argument('--output', type=str, default='-',
+                        help='Batch mode: JSONL results file (.gz/.zst compressed), "-" for stdout')
+    parser.add_argument('--input_format', type=str, default='auto', choices=['auto', 'jsonl', 'lines'],
+                        help='Batch mode: auto detects JSONL by the first non-empty line')
+    parser.add_argument('--concurrency', type=int, default=None,
+                        help='Batch mode: worker threads (default: the rate limiter ceiling, '
+                             'or training.max_concurrency without it)')
+    parser.add_argument('--max_tokens', type=int, default=None,
+                        help='Completion length limit (default: generation.max_tokens from the config)')
+    parser.add_argument('--stop', type=str, nargs='+', default=None,
+                        help='Stop sequences (default: generation.stop from the config)')
+    parser.add_argument('--no_stream', action='store_true',
+                       help='Wait for the full response instead of streaming tokens')
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
     
+    with profiling(args):
+        run(args)
+
+def run(args):
     # Проверяем существование конфига
     if not os.path.exists(args.config):
-        print(f"Config file not found: {args.config}")
-        print("Please make sure the config file exists or provide correct path with --config")
+        print(f"Config file not found: {args.config}", file=sys.stderr)
+        print("Please make sure the config file exists or provide correct path with --config", file=sys.stderr)
         return
     
     # Настройка
     logger = setup_logging()
-    config = load_config(args.config)
-    
-    # Клиент API
-    client = LMStudioClient(config)
+    with phase('config_load'):
+        config = load_config(args.config)
+    if args.stop is not None:
+        config.setdefault('generation', {})['stop'] = args.stop
     
-    # Генерация
+    # Клиент API: один на все промпты, соединения и кэш остаются прогретыми.
+    # С запущенным демоном (daemon.enabled) они прогреты и между запусками
+    with create_client(config) as client:
+        if args.input is not None:
+            run_batch(client, config, args, logger)
+        elif args.interactive:
+            run_interactive(client, args)
+        else:
+            run_single(client, args, logger)
+
+def run_single(client: GenerationClient, args, logger):
+    """Один промпт из --prompt с форматированным выводом"""
     logger.info(f"Generating response for prompt: {args.prompt[:100]}...")
-    response = client.generate(args.prompt, args.max_tokens)
     
     print("\n" + "="*50)
     print("PROMPT:")
     print(args.prompt)
     print("\n" + "="*50)
     print("RESPONSE:")
-    print(response)
+    
+    if args.no_stream:
+        response = client.generate(args.prompt, args.max_tokens)
+        print(response)
+        print("="*50)
+        return
+    
+    stats = stream_response(client, args.prompt, args.max_tokens)
     print("="*50)
+    print_stream_stats(stats)
+
+def stream_response(client: GenerationClient, prompt: str, max_tokens: int = None) -> tuple:
+    """Потоковый вывод ответа. Возвращает (время до первого токена или None, токены, общее время)"""
+    start = time.perf_counter()
+    first_token_time = None
+    num_tokens = 0
+    
+    for token in client.generate_stream(prompt, max_tokens):
+        if first_token_time is None:
+            first_token_time = time.perf_counter() - start
+        num_tokens += 1
+        print(token, end='', flush=True)
+    
+    total_time = time.perf_counter() - start
+    print()
+    return first_token_time, num_tokens, total_time
+
+def print_stream_stats(stats: tuple):
+    first_token_time, num_tokens, total_time = stats
+    if first_token_time is None:
+        print("No tokens received")
+        return
+    
+    generation_time = total_time - first_token_time
+    tokens_per_sec = (num_tokens - 1) / generation_time if num_tokens > 1 and generation_time > 0 else 0.0
+    print(f"Time to first token: {first_token_time:.3f}s")
+    print(f"Tokens: {num_tokens}, total time: {total_time:.2f}s, {tokens_per_sec:.1f} tokens/sec")
+
+def read_requests(lines, input_format: str, prompts: PromptLibrary):
+    """
+    Запросы из строк ввода: словари с prompt (и необязательными system,
+    max_tokens, id). Строка JSONL - объект с полем prompt или запись
+    датасета (instruction/input), промпт для которой строится шаблоном record.
+    Пустые строки пропускаются, нераспознанная строка дает запрос с error.
+    """
+    for line in lines:
+        line = line.rstrip('\r\n')
+        if not line.strip():
+            continue
+        if input_format == 'auto':
+            # Формат определяется по первой непустой строке
+            input_format = 'jsonl' if line.lstrip().startswith('{') else 'lines'
+        
+        if input_format == 'lines':
+            yield {'prompt': line}
+            continue
+        
+        try:
+            record = loads(line)
+            if not isinstance(record, dict):
+                raise ValueError("expected a JSON object")
+        except ValueError as e:
+            yield {'prompt': line, 'error': f"Invalid input line: {e}"}
+            continue
+        if 'prompt' not in record:
+            record = {**record, 'prompt': prompts.record.render(record)}
+        yield record
+
+def run_batch(client: GenerationClient, config: dict, args, logger):
+    """
+    Пакетный режим: промпты из файла или stdin выполняются параллельно (до
+    concurrency одновременно), результаты пишутся в JSONL в порядке ввода
+    по мере готовности
+    """
+    concurrency = args.concurrency or client.max_concurrency
+    prompts = PromptLibrary(config)
+    source = sys.stdin if args.input == '-' else open_text(args.input, 'r')
+    sink = sys.stdout if args.output == '-' else open_text(args.output, 'w')
+    
+    def work(request):
+        if 'error' in request:
+            raise ValueError(request['error'])
+        return client.generate(request['prompt'], request.get('max_tokens', args.max_tokens),
+                               system=request.get('system'))
+    
+    processed = 0
+    failed = 0
+    
+    def collect(i, request, response):
+        nonlocal processed, failed
+        result = {"index": i}
+        if 'id' in request:
+            result["id"] = request['id']
+        result["prompt"] = request['prompt']
+        if isinstance(response, Exception):
+            logger.error(f"Error generating response for prompt {i}: {response}")
+            result.update(response=None, error=str(response))
+        elif response is None:
+            # Сервер вернул ответ без текста: запись тоже считается неудачной
+            logger.error(f"Empty response for prompt {i}")
+            result.update(response=None, error="Empty response")
+        else:
+            result["response"] = response
+        
+        processed += 1
+        failed += result["response"] is None
+        sink.write(dumps(result) + '\n')
+        # Читатель конвейера получает каждый результат сразу
+        sink.flush()
+    
+    start = time.perf_counter()
+    try:
+        requests = read_requests(source, args.input_format, prompts)
+        AsyncGenerationEngine(concurrency).run(work, requests, on_result=collect)
+    finally:
+        if source is not sys.stdin:
+            source.close()
+        if sink is not sys.stdout:
+            sink.close()
+    
+    elapsed = time.perf_counter() - start
+    logger.info(f"Batch completed: {processed} prompts ({failed} failed) in {elapsed:.2f}s, "
+                f"{processed / elapsed if elapsed > 0 else 0.0:.1f} prompts/s at concurrency {concurrency}")
+    if client.metrics is not None:
+        logger.info(client.metrics.summary())
+
+def run_interactive(client: GenerationClient, args):
+    """
+    REPL: промпт на строку (строка, оканчивающаяся на \\, продолжается на
+    следующей). Команды: /max_tokens N, /stream on|off, /quit
+    """
+    try:
+        # История и редактирование строки, если модуль доступен
+        import readline  # noqa: F401
+    except ImportError:
+        pass
+    
+    max_tokens = args.max_tokens
+    stream = not args.no_stream
+    print("Interactive mode: enter a prompt, /max_tokens N, /stream on|off or /quit (Ctrl-D to exit)")
+    
+    while True:
+        lines = []
+        try:
+            line = input('> ')
+            while line.endswith('\\'):
+                lines.append(line[:-1])
+                line = input('. ')
+        except (EOFError, KeyboardInterrupt):
+            print()
+            return
+        prompt = '\n'.join(lines + [line]).strip()
+        if not prompt:
+            continue
+        
+        if prompt.startswith('/'):
+            command, _, value = prompt.partition(' ')
+            if command in ('/quit', '/exit'):
+                return
+            if command == '/max_tokens':
+                max_tokens = int(value) if value.strip().isdigit() else None
+                print(f"max_tokens: {max_tokens or 'from config'}")
+            elif command == '/stream':
+                stream = value.strip() != 'off'
+                print(f"stream: {'on' if stream else 'off'}")
+            else:
+                print(f"Unknown command: {command}")
+            continue
+        
+        try:
+            if stream:
+                print_stream_stats(stream_response(client, prompt, max_tokens))
+            else:
+                print(client.generate(prompt, max_tokens))
+        except KeyboardInterrupt:
+            # Прерывает текущий ответ, но не сессию
+            print("\nInterrupted")
+        except Exception as e:
+            print(f"Error: {e}")
 
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,60 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+import sys
+
+# Добавляем корневую директорию в путь Python
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.utils import load_config, setup_logging
+from src.data_loader import DataProcessor
+
+def main():
+    parser = argparse.ArgumentParser(description='Deterministic train/test split of a JSONL dataset')
+    parser.add_argument('--config', type=str, default='config/training_config.yaml')
+    parser.add_argument('--input', type=str, required=True, help='Input JSONL file')
+    parser.add_argument('--train_output', type=str, required=True, help='Output train JSONL file')
+    parser.add_argument('--test_output', type=str, required=True, help='Output test JSONL file')
+    parser.add_argument('--test_size', type=float, default=None,
+                       help='Test fraction (defaults to data.test_size from config)')
+    parser.add_argument('--shuffle', action='store_true',
+                       help='Shuffle the train output out of core')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk_size', type=int, default=100000,
+                       help='Lines kept in memory per shuffle chunk')
+    parser.add_argument('--max_samples', type=int, default=None,
+                       help='Split only the first N records (default: all records)')
+
+    args = parser.parse_args()
+
+    if not os.path.exists(args.input):
+        print(f"Input file not found: {args.input}")
+        sys.exit(1)
+
+    logger = setup_logging()
+    config = load_config(args.config)
+    test_size = args.test_size if args.test_size is not None else config['data']['test_size']
+
+    for path in (args.train_output, args.test_output):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+    data_processor = DataProcessor(config)
+    num_train, num_test = data_processor.split_file(
+        args.input,
+        args.train_output,
+        args.test_output,
+        test_size,
+        shuffle=args.shuffle,
+        seed=args.seed,
+        chunk_size=args.chunk_size,
+        max_samples=args.max_samples
+    )
+
+    logger.info(f"Train samples: {num_train} -> {args.train_output}")
+    logger.info(f"Test samples: {num_test} -> {args.test_output}")
+
+if __name__ == "__main__":
+    main()
\ No newline at end of file
@@ -1,62 +1,70 @@
 #!/usr/bin/env python3
 
 import argparse
-import json
 import os
 import sys
+from itertools import islice
 
 # Добавляем корневую директорию в путь Python
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 
 from src.utils import load_config, setup_logging
-from src.model_utils import LMStudioClient
+from src.jsonl import iter_jsonl, JSONLIndex
+from src.daemon import create_client
+from src.prompts import PromptLibrary
+from src.profiling import add_profile_arguments, profiling, phase
 
-def test_with_dataset_samples(config_path, dataset_path, num_samples=5):
-    """Тестирование модели на примерах из датасета"""
+def test_with_dataset_samples(config_path, dataset_path, num_samples=5, random_samples=False, seed=None):
+    """
+    Тестирование модели на примерах из датасета: первые num_samples записей
+    или, при random_samples, случайные (через индекс строк, без чтения всего файла)
+    """
     
     logger = setup_logging()
-    config = load_config(config_path)
-    client = LMStudioClient(config)
-    
-    # Загрузка датасета
-    with open(dataset_path, 'r', encoding='utf-8') as f:
-        samples = []
-        for i, line in enumerate(f):
-            if i >= num_samples:
-                break
-            samples.append(json.loads(line))
-    
-    print(f"Testing with {len(samples)} samples from dataset:")
-    print("=" * 80)
-    
-    for i, sample in enumerate(samples, 1):
-        print(f"\nSample {i}:")
-        print(f"Instruction: {sample.get('instruction', '')}")
-        
-        if sample.get('input'):
-            print(f"Input: {sample.get('input', '')}")
+    with phase('config_load'):
+        config = load_config(config_path)
+    # Клиент закрывается в конце: финальная запись метрик и освобождение соединений
+    with create_client(config) as client:
+        prompts = PromptLibrary(config)
         
-        print(f"Expected: {sample.get('output', '')}")
+        # Загрузка датасета
+        with phase('dataset_load'):
+            if random_samples:
+                with JSONLIndex(dataset_path) as index:
+                    samples = index.sample(num_samples, seed)
+            else:
+                samples = list(islice(iter_jsonl(dataset_path), num_samples))
         
-        # Создаем промпт
-        prompt_parts = []
-        if sample.get('system'):
-            prompt_parts.append(f"System: {sample['system']}")
-        prompt_parts.append(f"Instruction: {sample.get('instruction', '')}")
-        if sample.get('input'):
-            prompt_parts.append(f"Input: {sample.get('input', '')}")
-        prompt = "\n".join(prompt_parts) + "\nResponse:"
+        print(f"Testing with {len(samples)} samples from dataset:")
+        print("=" * 80)
         
-        print("Generated:")
-        response = client.generate(prompt)
-        print(f"{response}")
-        print("-" * 80)
+        for i, sample in enumerate(samples, 1):
+            print(f"\nSample {i}:")
+            print(f"Instruction: {sample.get('instruction', '')}")
+            
+            if sample.get('input'):
+                print(f"Input: {sample.get('input', '')}")
+            
+            print(f"Expected: {sample.get('output', '')}")
+            
+            # Создаем промпт
+            with phase('prompt_build'):
+                prompt = prompts.record.render(sample)
+            
+            print("Generated:")
+            response = client.generate(prompt)
+            print(f"{response}")
+            print("-" * 80)
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description='Test model with dataset samples')
     parser.add_argument('--config', type=str, default='config/training_config.yaml')
     parser.add_argument('--dataset', type=str, required=True)
     parser.add_argument('--samples', type=int, default=3)
+    parser.add_argument('--random', action='store_true',
+                        help='Pick random samples instead of the first ones')
+    parser.add_argument('--seed', type=int, default=None, help='Seed for --random')
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
     
@@ -71,4 +79,5 @@ if __name__ == "__main__":
         print("Please make sure the dataset file exists")
         sys.exit(1)
     
-    test_with_dataset_samples(args.config, args.dataset, args.samples)
\ No newline at end of file
+    with profiling(args):
+        test_with_dataset_samples(args.config, args.dataset, args.samples, args.random, args.seed)
\ No newline at end of file
@@ -6,6 +6,7 @@ sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
 from src.utils import setup_logging, load_config
 from src.data_loader import DataProcessor
 from src.trainer import APITrainer
+from src.profiling import add_profile_arguments, profiling, phase
 
 
 
@@ -15,14 +16,24 @@ def main():
                        help='Path to config file')
     parser.add_argument('--data_path', type=str, default=None,
                        help='Path to training data')
+    parser.add_argument('--no_cache', action='store_true',
+                       help='Bypass the response cache for this run')
+    add_profile_arguments(parser)
     
     args = parser.parse_args()
     
+    with profiling(args):
+        run(args)
+
+def run(args):
     # Настройка логирования
     logger = setup_logging()
     
     # Загрузка конфигурации
-    config = load_config(args.config)
+    with phase('config_load'):
+        config = load_config(args.config)
+    if args.no_cache:
+        config.setdefault('cache', {})['enabled'] = False
     
     # Создание выходной директории
     os.makedirs(config['training']['output_dir'], exist_ok=True)
@@ -30,36 +41,43 @@ def main():
     # Обработчик данных
     data_processor = DataProcessor(config)
 
-    
     # Проверка пути к данным
     if not args.data_path:
         raise ValueError("Please provide data_path or use --create_sample")
     
-    # Загрузка данных
+    # Загрузка данных (ленивый конвейер: чтение -> подготовка -> разделение)
     logger.info("Loading data...")
-    raw_data = data_processor.load_dataset(args.data_path)
-    
-    if not raw_data:
-        raise ValueError(f"No data found in {args.data_path}")
+    dataset = data_processor.stream_dataset(args.data_path)
     
-    logger.info(f"Loaded {len(raw_data)} samples")
+    with phase('dataset_scan'):
+        if not dataset:
+            raise ValueError(f"No data found in {args.data_path}")
+        num_samples = len(dataset)
     
-    # Подготовка данных
-    processed_data = data_processor.prepare_training_data(raw_data)
+    logger.info(f"Loaded {num_samples} samples")
+    logger.info(data_processor.budget.summary())
     
     # Разделение на train/test
-    train_data, eval_data = data_processor.train_test_split(
-        processed_data, 
+    train_data, eval_data = data_processor.stream_train_test_split(
+        dataset, 
         config['data']['test_size']
     )
     
-    logger.info(f"Train samples: {len(train_data)}, Eval samples: {len(eval_data)}")
+    with phase('split_scan'):
+        logger.info(f"Train samples: {len(train_data)}, Eval samples: {len(eval_data)}")
     
     # Обучение
     trainer = APITrainer(config)
-    results = trainer.train(train_data, eval_data)
+    try:
+        with phase('train'):
+            processed = trainer.train(train_data, eval_data, return_results=False)
+    finally:
+        # Финальная запись метрик и сводка по запросам к API
+        trainer.client.close()
+        if trainer.client.metrics is not None:
+            logger.info(trainer.client.metrics.summary())
     
-    logger.info(f"Training completed. Processed {len(results)} samples")
+    logger.info(f"Training completed. Processed {processed} samples")
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
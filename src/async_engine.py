@@ -0,0 +1,74 @@
+import asyncio
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+class AsyncGenerationEngine:
+    """
+    Конкурентное выполнение блокирующих запросов к API через asyncio.
+
+    Держит в работе до `concurrency` запросов одновременно, но отдает
+    результаты строго в порядке входных элементов.
+    """
+
+    def __init__(self, concurrency: int = 4, window_factor: int = 4):
+        self.concurrency = max(1, int(concurrency))
+        # Сколько задач может ждать своей очереди в буфере переупорядочивания
+        self.window = self.concurrency * max(1, int(window_factor))
+
+    def run(self, func, items, on_result=None) -> list:
+        """Синхронная обертка: выполняет func(item) для всех items и возвращает результаты по порядку"""
+        results = []
+
+        async def consume():
+            async for index, item, result in self.map_ordered(func, items):
+                if on_result is not None:
+                    on_result(index, item, result)
+                else:
+                    results.append(result)
+
+        asyncio.run(consume())
+        return results
+
+    async def map_ordered(self, func, items):
+        """
+        Асинхронный генератор (index, item, result) в порядке items.
+
+        Элементы читаются из items лениво, поэтому подходит и для итераторов.
+        Исключение из func возвращается как result, чтобы один неудачный
+        элемент не останавливал всю эпоху.
+        """
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        executor = ThreadPoolExecutor(max_workers=self.concurrency)
+        pending = deque()
+        iterator = iter(enumerate(items))
+
+        async def call(item):
+            async with semaphore:
+                try:
+                    return await loop.run_in_executor(executor, func, item)
+                except Exception as e:
+                    return e
+
+        def fill():
+            while len(pending) < self.window:
+                try:
+                    index, item = next(iterator)
+                except StopIteration:
+                    return
+                pending.append((index, item, asyncio.ensure_future(call(item))))
+
+        try:
+            fill()
+            while pending:
+                index, item, task = pending.popleft()
+                result = await task
+                fill()
+                yield index, item, result
+        finally:
+            for _, _, task in pending:
+                task.cancel()
+            executor.shutdown(wait=False, cancel_futures=True)
\ No newline at end of file
@@ -0,0 +1,145 @@
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class ResponseCache:
+    """
+    Постоянный кэш ответов API в SQLite.
+
+    Ключ - хэш от имени модели, сообщений и параметров сэмплирования,
+    поэтому повторные запуски с теми же промптами не обращаются к серверу.
+    """
+
+    def __init__(self, path: str, max_entries: int = 100000, max_age_days: float = 30, max_size_mb: float = 512):
+        self.path = path
+        self.max_entries = max_entries
+        self.max_age = max_age_days * 86400 if max_age_days else None
+        self.max_size = int(max_size_mb * 1024 * 1024) if max_size_mb else None
+        self.hits = 0
+        self.misses = 0
+        self._writes = 0
+        self._lock = threading.Lock()
+
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, accessed_at REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_accessed ON responses(accessed_at)")
+        self._conn.commit()
+        self.evict()
+
+    @staticmethod
+    def make_key(model: str, messages: list, **params) -> str:
+        """Ключ кэша по модели, сообщениям и параметрам генерации"""
+        raw = json.dumps({"model": model, "messages": messages, "params": params},
+                         ensure_ascii=False, sort_keys=True)
+        return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+    def get(self, key: str):
+        """Ответ из кэша или None"""
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT response, created_at FROM responses WHERE key = ?", (key,)
+            ).fetchone()
+
+            if row is None or (self.max_age and now - row[1] > self.max_age):
+                self.misses += 1
+                return None
+
+            self._conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+            self.hits += 1
+
+        return json.loads(row[0])
+
+    def set(self, key: str, response):
+        """Сохранение ответа в кэш"""
+        if response is None:
+            return
+
+        data = json.dumps(response, ensure_ascii=False)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, response, size, created_at, accessed_at) "
+                "VALUES (?, ?, ?, ?, ?)",
+                (key, data, len(data), now, now)
+            )
+            self._conn.commit()
+            self._writes += 1
+            need_eviction = self._writes % 1000 == 0
+
+        if need_eviction:
+            self.evict()
+
+    def evict(self):
+        """Удаление устаревших записей и давно не использованных при превышении лимитов"""
+        with self._lock:
+            if self.max_age:
+                self._conn.execute("DELETE FROM responses WHERE created_at < ?", (time.time() - self.max_age,))
+
+            count, total_size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()
+
+            if self.max_entries and count > self.max_entries:
+                self._conn.execute(
+                    "DELETE FROM responses WHERE key IN "
+                    "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)",
+                    (count - self.max_entries,)
+                )
+
+            if self.max_size and total_size > self.max_size:
+                # Удаляем самые старые по доступу, пока не уложимся в лимит
+                excess = total_size - self.max_size
+                rows = self._conn.execute("SELECT key, size FROM responses ORDER BY accessed_at").fetchall()
+                to_delete = []
+                for key, size in rows:
+                    if excess <= 0:
+                        break
+                    to_delete.append((key,))
+                    excess -= size
+                self._conn.executemany("DELETE FROM responses WHERE key = ?", to_delete)
+
+            self._conn.commit()
+
+    def stats(self) -> dict:
+        """Счетчики попаданий и промахов"""
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0
+        }
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+
+def create_cache(config: dict):
+    """Создание кэша ответов по секции cache конфига (None если кэш выключен)"""
+    cache_config = config.get('cache', {})
+    if not cache_config.get('enabled', False):
+        return None
+
+    return ResponseCache(
+        cache_config.get('path', f"{config['training']['output_dir']}/response_cache.sqlite"),
+        max_entries=cache_config.get('max_entries', 100000),
+        max_age_days=cache_config.get('max_age_days', 30),
+        max_size_mb=cache_config.get('max_size_mb', 512)
+    )
\ No newline at end of file
@@ -0,0 +1,435 @@
+import copy
+import logging
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+
+from .jsonl import loads, dumps_bytes
+from .model_utils import GenerationClient, LMStudioClient
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SOCKET = "./output/lmstudio.sock"
+
+class _Server(socketserver.ThreadingUnixStreamServer):
+    daemon_threads = True
+    # Очередь listen по умолчанию (5) переполняется, когда несколько
+    # процессов одновременно открывают десятки соединений
+    request_queue_size = 256
+
+def socket_path(config: dict) -> str:
+    return config.get('daemon', {}).get('socket', DEFAULT_SOCKET)
+
+class _RequestEvents:
+    """
+    Метрики демона, которые дополнительно копят события HTTP-запросов
+    текущего потока (задержка, usage, повторы, finish_reason, число
+    запросов демона в работе при старте запроса). Они возвращаются клиенту
+    и повторяются в его APIMetrics.
+    """
+
+    def __init__(self, metrics):
+        self.metrics = metrics
+        self._local = threading.local()
+        # Запросы к серверу в работе от всех клиентов демона
+        self.in_flight = 0
+        self._lock = threading.Lock()
+
+    def begin(self):
+        self._local.events = []
+
+    def end(self) -> list:
+        events = getattr(self._local, 'events', None) or []
+        self._local.events = None
+        return events
+
+    def _add(self, *event):
+        events = getattr(self._local, 'events', None)
+        if events is not None:
+            events.append(event)
+
+    def request_started(self):
+        if self.metrics is not None:
+            self.metrics.request_started()
+        with self._lock:
+            self.in_flight += 1
+            in_flight = self.in_flight
+        self._add('in_flight', in_flight)
+
+    def request_finished(self, latency: float, usage: dict = None, error: str = None):
+        if self.metrics is not None:
+            self.metrics.request_finished(latency, usage, error)
+        with self._lock:
+            self.in_flight -= 1
+        self._add('request', latency, usage, error)
+
+    def record_retry(self):
+        if self.metrics is not None:
+            self.metrics.record_retry()
+        self._add('retry')
+
+    def record_finish_reasons(self, reasons: list):
+        if self.metrics is not None:
+            self.metrics.record_finish_reasons(reasons)
+        self._add('finish', list(reasons))
+
+    def record_generation(self, latency: float, success: bool = True):
+        if self.metrics is not None:
+            self.metrics.record_generation(latency, success)
+
+def replay_events(metrics, events: list):
+    """Повтор событий запросов демона в локальных APIMetrics"""
+    if metrics is None:
+        return
+    for event in events:
+        kind = event[0]
+        if kind == 'request':
+            metrics.record_request(*event[1:])
+        elif kind == 'retry':
+            metrics.record_retry()
+        elif kind == 'finish':
+            metrics.record_finish_reasons(event[1])
+        elif kind == 'in_flight':
+            metrics.record_in_flight(event[1])
+
+class InferenceDaemon:
+    """
+    Локальный демон с одним LMStudioClient (пул соединений, кэш ответов,
+    AdaptiveLimiter и пул серверов) на все скрипты хоста. Одновременные
+    задания делят общий лимит конкурентности и кэш, а короткие команды не
+    тратят время на прогрев.
+
+    Клиенты подключаются через Unix-сокет, каждое соединение обслуживается
+    своим потоком. Протокол - JSON по строке: запрос {"op": ..., ...},
+    ответ {"result": ..., "events": [...]} или {"error": ...}; для op stream -
+    строки {"token": ...} и завершающая {"done": true, "events": [...]}.
+    """
+
+    OPS = ('ping', 'generate', 'samples', 'stream', 'stats', 'shutdown')
+
+    def __init__(self, config: dict, path: str = None):
+        self.path = path or socket_path(config)
+        # Снимок метрик демона пишется отдельно от метрик клиентов
+        config = copy.deepcopy(config)
+        config.setdefault('metrics', {})['path'] = config.get('daemon', {}).get('metrics_path')
+        self.config = config
+
+        self.client = LMStudioClient(config)
+        self.events = _RequestEvents(self.client.metrics)
+        self.client.metrics = self.events
+        # Запросы клиентов без кэша (например train.py --no_cache)
+        self.uncached = copy.copy(self.client)
+        self.uncached.cache = None
+        # Поддержка параметра n общая для всех копий клиента (см. _client_for)
+        self.supports_n = self.client.supports_n
+
+        self.started = time.time()
+        self.connections = 0
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = None
+
+    def _client_for(self, request: dict) -> LMStudioClient:
+        client = self.client if request.get('cache', True) else self.uncached
+        stop = request.get('stop')
+        if stop != client.config.get('generation', {}).get('stop'):
+            # Стоп-последовательности клиента входят в запрос и в ключ кэша
+            client = copy.copy(client)
+            client.config = {**client.config, 'generation': {**client.config.get('generation', {}), 'stop': stop}}
+        return client
+
+    def process(self, request: dict, send):
+        """Выполнение запроса, ответ (для stream - несколько) передается send"""
+        op = request.get('op')
+        with self._lock:
+            self.requests += 1
+        self.events.begin()
+        try:
+            if op not in self.OPS:
+                raise ValueError(f"Unknown op: {op}")
+            client = self._client_for(request)
+
+            if op == 'stream':
+                for token in client.generate_stream(request['prompt'], request.get('max_tokens')):
+                    send({"token": token})
+                send({"done": True, "events": self.events.end()})
+                return
+
+            if op == 'ping':
+                # Клиенты подбирают число рабочих потоков по потолку общего лимитера
+                result = {"max_concurrency": self.client.max_concurrency}
+            elif op == 'generate':
+                start = time.perf_counter()
+                result = client._generate(request['prompt'], request['max_tokens'], request.get('system'),
+                                          sample=request.get('sample', 0))
+                self.events.record_generation(time.perf_counter() - start, success=result is not None)
+            elif op == 'samples':
+                # Копия клиента узнает о поддержке n от демона и сообщает ему,
+                # если определила ее по ответу сервера
+                client.supports_n = self.supports_n
+                result = client.generate_samples(request['prompt'], request['n'], request['max_tokens'],
+                                                 request.get('system'), request.get('sample_ids'))
+                if client.supports_n is not None:
+                    self.supports_n = client.supports_n
+            elif op == 'stats':
+                result = self.stats()
+            else:
+                result = "stopping"
+            send({"result": result, "events": self.events.end()})
+            if op == 'shutdown':
+                self.shutdown()
+        except (BrokenPipeError, ConnectionResetError):
+            raise
+        except Exception as e:
+            logger.warning(f"Request {op} failed: {e}")
+            send({"error": f"{type(e).__name__}: {e}", "events": self.events.end()})
+
+    def stats(self) -> dict:
+        """Состояние демона: соединения, запросы, кэш, лимитер и метрики API"""
+        client = self.client
+        limiter = client.limiter
+        with self._lock:
+            stats = {
+                "socket": self.path,
+                "pid": os.getpid(),
+                "uptime_seconds": time.time() - self.started,
+                "connections": self.connections,
+                "requests": self.requests
+            }
+        stats["cache"] = client.cache.stats() if client.cache is not None else None
+        stats["limiter"] = {"limit": limiter.limit, "in_flight": limiter.in_flight} if limiter is not None else None
+        stats["supports_n"] = self.supports_n
+        stats["metrics"] = self.events.metrics.snapshot() if self.events.metrics is not None else None
+        return stats
+
+    def _handler(self):
+        daemon = self
+
+        class Handler(socketserver.StreamRequestHandler):
+            def send(self, message: dict):
+                self.wfile.write(dumps_bytes(message) + b'\n')
+
+            def handle(self):
+                with daemon._lock:
+                    daemon.connections += 1
+                try:
+                    for line in self.rfile:
+                        if not line.strip():
+                            continue
+                        try:
+                            request = loads(line)
+                        except ValueError as e:
+                            self.send({"error": f"Invalid request: {e}"})
+                            continue
+                        daemon.process(request, self.send)
+                except (BrokenPipeError, ConnectionResetError):
+                    # Клиент ушел, не дочитав ответ (например прерванный поток)
+                    pass
+                finally:
+                    with daemon._lock:
+                        daemon.connections -= 1
+
+        return Handler
+
+    def _prepare_socket(self):
+        """Каталог сокета; старый файл сокета удаляется, если демон за ним не отвечает"""
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        if not os.path.exists(self.path):
+            return
+        probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            probe.connect(self.path)
+        except OSError:
+            os.unlink(self.path)
+        else:
+            raise RuntimeError(f"Inference daemon is already running at {self.path}")
+        finally:
+            probe.close()
+
+    def serve_forever(self):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise RuntimeError("The inference daemon needs Unix domain sockets")
+        self._prepare_socket()
+        self._server = _Server(self.path, self._handler())
+        # Сокет доступен только владельцу
+        os.chmod(self.path, 0o600)
+        logger.info(f"Inference daemon listening on {self.path}")
+        try:
+            self._server.serve_forever()
+        finally:
+            self._server.server_close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+            self.client.close()
+            logger.info("Inference daemon stopped")
+
+    def shutdown(self):
+        """Остановка serve_forever (можно вызывать из любого потока)"""
+        if self._server is not None:
+            threading.Thread(target=self._server.shutdown, daemon=True).start()
+
+class DaemonClient(GenerationClient):
+    """
+    Клиент генерации, отправляющий запросы через InferenceDaemon: соединения
+    с LM Studio, кэш ответов и лимитер общие для всех процессов хоста.
+    Промпты, LengthPolicy и метрики остаются в процессе, события
+    HTTP-запросов демона повторяются в локальных APIMetrics. Параметры
+    сэмплирования и сервер задает конфиг демона, стоп-последовательности
+    и использование кэша - конфиг клиента.
+    """
+
+    def __init__(self, config: dict, path: str = None, connect_timeout: float = 5.0):
+        if not hasattr(socket, 'AF_UNIX'):
+            raise OSError("Unix domain sockets are not supported on this platform")
+        # Пул соединений, кэш и лимитер находятся в демоне
+        super().__init__(config)
+        self.path = path or socket_path(config)
+        self.connect_timeout = connect_timeout
+        self.use_cache = config.get('cache', {}).get('enabled', False)
+        self.stop = config.get('generation', {}).get('stop')
+        self._connections = queue.LifoQueue()
+        try:
+            # Демон должен отвечать уже при создании клиента
+            self._max_concurrency = self.call({"op": "ping"})['result']['max_concurrency']
+        except OSError:
+            self.close()
+            raise
+
+    @property
+    def max_concurrency(self) -> int:
+        """Потолок общего лимитера демона"""
+        return self._max_concurrency
+
+    def _connect(self) -> tuple:
+        deadline = time.monotonic() + self.connect_timeout
+        delay = 0.01
+        while True:
+            sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                sock.settimeout(self.connect_timeout)
+                sock.connect(self.path)
+                # Генерация может идти дольше любого разумного таймаута
+                sock.settimeout(None)
+                return sock, sock.makefile('rb')
+            except BlockingIOError:
+                # Очередь listen демона заполнена: повтор до connect_timeout
+                sock.close()
+                if time.monotonic() + delay > deadline:
+                    raise
+                time.sleep(delay)
+                delay = min(delay * 2, 0.5)
+            except OSError:
+                sock.close()
+                raise
+
+    def _acquire(self) -> tuple:
+        try:
+            return self._connections.get_nowait()
+        except queue.Empty:
+            return self._connect()
+
+    @staticmethod
+    def _discard(connection: tuple):
+        sock, reader = connection
+        reader.close()
+        sock.close()
+
+    def _read(self, connection: tuple) -> dict:
+        line = connection[1].readline()
+        if not line:
+            raise ConnectionError(f"Inference daemon at {self.path} closed the connection")
+        message = loads(line)
+        replay_events(self.metrics, message.get('events', ()))
+        return message
+
+    def call(self, request: dict) -> dict:
+        """Запрос к демону по свободному соединению (новое, если все заняты)"""
+        connection = self._acquire()
+        try:
+            connection[0].sendall(dumps_bytes(request) + b'\n')
+            response = self._read(connection)
+        except BaseException:
+            self._discard(connection)
+            raise
+        self._connections.put(connection)
+        if 'error' in response:
+            raise RuntimeError(f"Inference daemon: {response['error']}")
+        return response
+
+    def _request(self, op: str, **fields) -> dict:
+        return {"op": op, "cache": self.use_cache, "stop": self.stop, **fields}
+
+    def _generate(self, prompt: str, max_tokens: int, system: str = None, sample: int = 0):
+        """Ответ через демон (с его кэшем и лимитером)"""
+        request = self._request('generate', prompt=prompt, max_tokens=max_tokens, system=system, sample=sample)
+        return self.call(request)['result']
+
+    def generate_samples(self, prompt: str, n: int, max_tokens: int = None, system: str = None,
+                         sample_ids: list = None) -> list:
+        """n вариантов ответа через демон (см. LMStudioClient.generate_samples)"""
+        if max_tokens is None:
+            max_tokens = self.lengths.limit()
+        start = time.perf_counter()
+        request = self._request('samples', prompt=prompt, n=n, max_tokens=max_tokens, system=system,
+                                sample_ids=list(sample_ids) if sample_ids is not None else None)
+        samples = self.call(request)['result']
+        if self.metrics is not None:
+            self.metrics.record_generation(time.perf_counter() - start,
+                                           success=any(sample is not None for sample in samples))
+        return samples
+
+    def generate_stream(self, prompt: str, max_tokens: int = None):
+        """Потоковая генерация через демон"""
+        if max_tokens is None:
+            max_tokens = self.lengths.limit()
+        connection = self._acquire()
+        finished = False
+        try:
+            connection[0].sendall(dumps_bytes(self._request('stream', prompt=prompt, max_tokens=max_tokens)) + b'\n')
+            while True:
+                message = self._read(connection)
+                if 'error' in message:
+                    finished = True
+                    raise RuntimeError(f"Inference daemon: {message['error']}")
+                if message.get('done'):
+                    finished = True
+                    return
+                yield message['token']
+        finally:
+            # Недочитанный поток оставил бы в соединении чужие строки
+            if finished:
+                self._connections.put(connection)
+            else:
+                self._discard(connection)
+
+    def stats(self) -> dict:
+        """Состояние демона (см. InferenceDaemon.stats)"""
+        return self.call({"op": "stats"})['result']
+
+    def close(self):
+        """Закрытие соединений с демоном и финальная запись метрик"""
+        while True:
+            try:
+                self._discard(self._connections.get_nowait())
+            except queue.Empty:
+                break
+        super().close()
+
+def create_client(config: dict) -> GenerationClient:
+    """
+    Клиент API для скриптов: DaemonClient, если включен daemon.enabled и
+    демон отвечает, иначе собственный LMStudioClient процесса
+    """
+    if config.get('daemon', {}).get('enabled', False):
+        try:
+            client = DaemonClient(config)
+            logger.info(f"Using the inference daemon at {client.path}")
+            return client
+        except OSError as e:
+            logger.warning(f"Inference daemon is not available at {socket_path(config)} ({e}), using a local client")
+    return LMStudioClient(config)
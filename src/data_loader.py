@@ -1,69 +1,299 @@
+import hashlib
 import json
+import logging
+import os
 import random
+import shutil
+import tempfile
+from itertools import islice
+from . import jsonl
+from .jsonl import iter_jsonl, write_jsonl
+from .prompts import PromptLibrary
+from .tokens import TokenBudget
+from .profiling import phase, profile_iter
+from .dedup import MinHashDeduplicator, save_dedup_report
+
+logger = logging.getLogger(__name__)
+
+class StreamingDataset:
+    """
+    Ленивый набор данных: каждый проход заново запускает конвейер
+    (чтение -> подготовка -> разделение), поэтому в памяти находится
+    только текущая запись.
+    """
+    
+    def __init__(self, factory):
+        self._factory = factory
+        self._length = None
+    
+    def __iter__(self):
+        return iter(self._factory())
+    
+    def __len__(self):
+        # Подсчет требует одного прохода по источнику, результат запоминается
+        if self._length is None:
+            self._length = sum(1 for _ in self)
+        return self._length
+    
+    def __bool__(self):
+        return self.peek() is not None
+    
+    def peek(self):
+        """Первая запись или None, если набор пуст"""
+        return next(iter(self), None)
+    
+    def filter(self, predicate):
+        """Новый ленивый набор из записей, для которых predicate(index, item) истинно"""
+        return StreamingDataset(
+            lambda: (item for i, item in enumerate(self) if predicate(i, item))
+        )
+
+# Поля, по которым определяется принадлежность записи к train/test
+SPLIT_FIELDS = ('system', 'instruction', 'input', 'output')
+
+def split_bucket(item: dict) -> float:
+    """Стабильное число в [0, 1) по содержимому записи, одинаковое на любой машине"""
+    key = json.dumps([item.get(field, '') for field in SPLIT_FIELDS], ensure_ascii=False)
+    digest = hashlib.blake2b(key.encode('utf-8'), digest_size=8).digest()
+    return int.from_bytes(digest, 'big') / 2 ** 64
+
+def is_test_record(item: dict, test_size: float) -> bool:
+    return split_bucket(item) < test_size
+
+class ExternalShuffler:
+    """
+    Перемешивание строк, не помещающихся в память.
+    Строки копятся блоками по chunk_size, каждый блок перемешивается и
+    сбрасывается во временный файл. При слиянии следующая строка берется
+    из случайного блока с вероятностью, пропорциональной числу оставшихся
+    в нем строк, что дает равномерно случайную перестановку.
+    """
+    
+    def __init__(self, output_path: str, seed: int = 42, chunk_size: int = 100000):
+        self.output_path = output_path
+        self.chunk_size = chunk_size
+        self.rng = random.Random(seed)
+        self._buffer = []
+        self._runs = []
+        self._tmpdir = None
+    
+    def add(self, line: str):
+        self._buffer.append(line)
+        if len(self._buffer) >= self.chunk_size:
+            self._flush_run()
+    
+    def _flush_run(self):
+        if not self._buffer:
+            return
+        if self._tmpdir is None:
+            self._tmpdir = tempfile.mkdtemp(prefix='shuffle_', dir=os.path.dirname(os.path.abspath(self.output_path)))
+        
+        self.rng.shuffle(self._buffer)
+        path = os.path.join(self._tmpdir, f"run_{len(self._runs)}.jsonl")
+        with open(path, 'w', encoding='utf-8') as f:
+            f.writelines(self._buffer)
+        self._runs.append((path, len(self._buffer)))
+        self._buffer = []
+    
+    def finish(self):
+        """Слияние блоков в выходной файл"""
+        try:
+            with open(self.output_path, 'w', encoding='utf-8') as out:
+                if not self._runs:
+                    # Все строки поместились в один блок
+                    self.rng.shuffle(self._buffer)
+                    out.writelines(self._buffer)
+                    return
+                
+                self._flush_run()
+                files = [open(path, 'r', encoding='utf-8') for path, _ in self._runs]
+                remaining = [count for _, count in self._runs]
+                try:
+                    total = sum(remaining)
+                    while total:
+                        run = self.rng.choices(range(len(files)), weights=remaining)[0]
+                        out.write(files[run].readline())
+                        remaining[run] -= 1
+                        total -= 1
+                finally:
+                    for f in files:
+                        f.close()
+        finally:
+            self._buffer = []
+            if self._tmpdir is not None:
+                shutil.rmtree(self._tmpdir, ignore_errors=True)
 
 class DataProcessor:
     def __init__(self, config: dict):
         self.config = config
         self.max_tokens = config['data']['max_tokens_per_sample']
+        self.max_samples = config['data'].get('max_samples')
+        self.prompts = PromptLibrary(config)
+        self.budget = TokenBudget(config)
+        # Удаление почти одинаковых записей (секция dedup конфига, None если выключено)
+        self.dedup = MinHashDeduplicator.from_config(config)
+        self.dedup_report_path = config.get('dedup', {}).get('report_path')
     
-    def load_dataset(self, filepath: str) -> list:
-        """Загрузка датасета"""
-        data = []
+    def iter_dataset(self, filepath: str):
+        """Построчное чтение датасета с остановкой на max_samples"""
         try:
-            with open(filepath, 'r', encoding='utf-8') as f:
-                for line in f:
-                    data.append(json.loads(line.strip()))
+            yield from profile_iter('dataset_load', islice(iter_jsonl(filepath), self.max_samples))
         except FileNotFoundError:
             print(f"File {filepath} not found.")
-        
-        return data
+    
+    def load_dataset(self, filepath: str) -> list:
+        """Загрузка датасета"""
+        return list(self.iter_dataset(filepath))
+    
+    def stream_dataset(self, filepath: str) -> StreamingDataset:
+        """Ленивый конвейер: чтение, подготовка и удаление дубликатов при каждом проходе"""
+        dataset = StreamingDataset(lambda: self.iter_training_data(self.iter_dataset(filepath)))
+        return self.deduplicate(dataset)
+    
+    def iter_training_data(self, data):
+        """
+        Подготовка данных для обучения по одной записи.
+        Записи, не помещающиеся в max_tokens_per_sample, обрезаются или
+        отбрасываются; статистика последнего прохода - в self.budget.stats.
+        """
+        self.budget.reset()
+        for item in data:
+            with phase('prepare'):
+                item = self.budget.fit_record(item, self._create_prompt)
+                if item is None:
+                    continue
+                
+                prompt = self._create_prompt(item)
+                output = item.get('output', '')
+                
+                record = {
+                    'prompt': prompt,
+                    'instruction': item.get('instruction', ''),
+                    'input': item.get('input', ''),
+                    'output': output,
+                    'system': item.get('system', ''),
+                    'full_text': f"{prompt}{output}"
+                }
+            
+            yield record
     
     def prepare_training_data(self, data: list) -> list:
         """Подготовка данных для обучения"""
-        processed_data = []
+        return self.deduplicate(list(self.iter_training_data(data)))
+    
+    def deduplicate(self, data):
+        """
+        Удаление почти одинаковых записей (MinHash/LSH по instruction, input
+        и output), из каждой группы остается первая запись. Для StreamingDataset
+        дубликаты ищутся отдельным проходом при первом чтении, до начала
+        самого прохода (иначе вложенный проход сбросил бы статистику
+        TokenBudget посреди внешнего), затем набор фильтруется по индексам.
+        """
+        if self.dedup is None:
+            return data
         
-        for item in data:
-            prompt = self._create_prompt(item)
+        if isinstance(data, StreamingDataset):
+            duplicates = None
+            
+            def kept():
+                nonlocal duplicates
+                if duplicates is None:
+                    duplicates = self._find_duplicates(data)
+                return (item for i, item in enumerate(data) if i not in duplicates)
             
-            processed_data.append({
-                'prompt': prompt,
-                'instruction': item.get('instruction', ''),
-                'input': item.get('input', ''),
-                'output': item.get('output', ''),
-                'system': item.get('system', ''),
-                'full_text': f"{prompt}{item.get('output', '')}"
-            })
+            return StreamingDataset(kept)
+        
+        data = list(data)
+        duplicates = self._find_duplicates(data)
+        return [item for i, item in enumerate(data) if i not in duplicates]
+    
+    def _find_duplicates(self, data) -> dict:
+        num_items = 0
+        
+        def counted():
+            nonlocal num_items
+            for item in data:
+                num_items += 1
+                yield item
         
-        return processed_data
+        with phase('dedup'):
+            duplicates = self.dedup.find_duplicates(counted())
+            logger.info(self.dedup.report(duplicates, num_items))
+            if self.dedup_report_path:
+                save_dedup_report(self.dedup_report_path, duplicates, data)
+                logger.info(f"Dedup report saved to {self.dedup_report_path}")
+        return duplicates
     
     def _create_prompt(self, item: dict) -> str:
         """Создание промпта из данных"""
-        prompt_parts = []
-        
-        if item.get('system'):
-            prompt_parts.append(f"System: {item['system']}")
+        return self.prompts.record.render(item)
+    
+    def train_test_split(self, data: list, test_size: float = 0.1):
+        """
+        Разделение на train/test по хэшу содержимого записи.
+        Результат не зависит от порядка строк и не трогает глобальный random.
+        """
+        train_data = []
+        test_data = []
         
-        prompt_parts.append(f"Instruction: {item.get('instruction', '')}")
+        for item in data:
+            if is_test_record(item, test_size):
+                test_data.append(item)
+            else:
+                train_data.append(item)
         
-        if item.get('input'):
-            prompt_parts.append(f"Input: {item.get('input', '')}")
+        return train_data, test_data
+    
+    def stream_train_test_split(self, dataset: StreamingDataset, test_size: float = 0.1):
+        """Ленивое разделение на train/test по хэшу содержимого без загрузки данных в память"""
+        def in_test(i, item):
+            with phase('split'):
+                return is_test_record(item, test_size)
         
-        prompt = "\n".join(prompt_parts) + "\nResponse:"
-        return prompt
+        train_data = dataset.filter(lambda i, item: not in_test(i, item))
+        test_data = dataset.filter(in_test)
+        return train_data, test_data
     
-    def train_test_split(self, data: list, test_size: float = 0.1):
-        """Разделение на train/test"""
-        random.seed(42)
-        random.shuffle(data)
+    def split_file(self, input_path: str, train_path: str, test_path: str, test_size: float = 0.1,
+                   shuffle: bool = False, seed: int = 42, chunk_size: int = 100000,
+                   max_samples: int = None) -> tuple:
+        """
+        Разделение JSONL файла на train/test за один проход.
+        Строки копируются без изменений, в памяти находится одна запись
+        (или chunk_size строк train при shuffle=True). Делятся все записи
+        файла, max_samples ограничивает их число явно.
+        Возвращает количество записей в train и test.
+        """
+        num_train = 0
+        num_test = 0
+        shuffler = ExternalShuffler(train_path, seed, chunk_size) if shuffle else None
         
-        split_idx = int(len(data) * (1 - test_size))
-        train_data = data[:split_idx]
-        test_data = data[split_idx:]
+        with open(input_path, 'r', encoding='utf-8') as src, \
+             open(test_path, 'w', encoding='utf-8') as test_file:
+            train_file = None if shuffle else open(train_path, 'w', encoding='utf-8')
+            try:
+                for line in islice((line for line in src if line.strip()), max_samples):
+                    if not line.endswith('\n'):
+                        line += '\n'
+                    
+                    if is_test_record(jsonl.loads(line), test_size):
+                        test_file.write(line)
+                        num_test += 1
+                    elif shuffle:
+                        shuffler.add(line)
+                        num_train += 1
+                    else:
+                        train_file.write(line)
+                        num_train += 1
+            finally:
+                if train_file is not None:
+                    train_file.close()
         
-        return train_data, test_data
+        if shuffle:
+            shuffler.finish()
+        
+        return num_train, num_test
     
     def save_dataset(self, data: list, filepath: str):
         """Сохранение датасета"""
-        with open(filepath, 'w', encoding='utf-8') as f:
-            for item in data:
-                f.write(json.dumps(item, ensure_ascii=False) + '\n')
\ No newline at end of file
+        write_jsonl(filepath, data)
\ No newline at end of file
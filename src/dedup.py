@@ -0,0 +1,207 @@
+import logging
+import re
+
+import numpy as np
+
+from .jsonl import write_jsonl
+
+logger = logging.getLogger(__name__)
+
+WHITESPACE_RE = re.compile(r'\s+')
+
+DEDUP_FIELDS = ('instruction', 'input', 'output')
+
+# np.trapz переименован в NumPy 2.0
+_trapezoid = getattr(np, 'trapezoid', None) or np.trapz
+
+def lsh_params(threshold: float, num_perm: int, false_positive_weight: float = 0.5) -> tuple:
+    """
+    Число полос b и строк в полосе r (b * r <= num_perm), при которых
+    взвешенная сумма вероятностей ложных срабатываний (сходство ниже порога)
+    и пропусков (выше порога) минимальна
+    """
+    similarity = np.linspace(0, 1, 201)
+    below = similarity <= threshold
+    best = None
+    for bands in range(1, num_perm + 1):
+        for rows in range(1, num_perm // bands + 1):
+            candidate = 1 - (1 - similarity ** rows) ** bands
+            false_positive = _trapezoid(np.where(below, candidate, 0), similarity)
+            false_negative = _trapezoid(np.where(below, 0, 1 - candidate), similarity)
+            error = false_positive_weight * false_positive + (1 - false_positive_weight) * false_negative
+            if best is None or error < best[0]:
+                best = (error, bands, rows)
+    return best[1], best[2]
+
+class MinHashDeduplicator:
+    """
+    Поиск почти одинаковых записей по MinHash/LSH.
+
+    Запись - множество символьных k-грамм нормализованного текста полей
+    DEDUP_FIELDS. Подпись из num_perm минимумов хэшей разбивается на полосы
+    (LSH), записи с совпавшей полосой сравниваются попарно по доле совпавших
+    минимумов (оценка сходства Жаккара). Запись отбрасывается, если она
+    похожа на более раннюю оставленную запись.
+
+    Все полосы обрабатываются сортировкой массивов NumPy, поэтому в памяти
+    хранится около 2 * num_perm + 8 * bands байт на запись.
+    """
+
+    # Наибольшее расстояние между сравниваемыми записями одной группы LSH
+    BUCKET_WINDOW = 64
+
+    def __init__(self, threshold: float = 0.85, num_perm: int = 128, shingle_size: int = 5,
+                 seed: int = 1, fields: tuple = DEDUP_FIELDS):
+        if not 0 < threshold <= 1:
+            raise ValueError(f"Dedup threshold must be in (0, 1], got {threshold}")
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        self.fields = tuple(fields)
+        self.bands, self.rows = lsh_params(threshold, num_perm)
+
+        # Хэши multiply-shift: h(x) = (a * x + b) >> 32, a нечетное
+        rng = np.random.default_rng(seed)
+        self._a = rng.integers(1, 2 ** 63, num_perm, dtype=np.uint64) | np.uint64(1)
+        self._b = rng.integers(0, 2 ** 63, num_perm, dtype=np.uint64)
+        self._band_weights = rng.integers(1, 2 ** 63, self.rows, dtype=np.uint64) | np.uint64(1)
+        self._powers = np.uint64(1000003) ** np.arange(shingle_size - 1, -1, -1, dtype=np.uint64)
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """Создание по секции dedup конфига (None если выключено)"""
+        dedup_config = config.get('dedup', {})
+        if not dedup_config.get('enabled', False):
+            return None
+        return cls(
+            threshold=dedup_config.get('threshold', 0.85),
+            num_perm=dedup_config.get('num_perm', 128),
+            shingle_size=dedup_config.get('shingle_size', 5)
+        )
+
+    def text(self, item: dict) -> str:
+        text = ' '.join(str(item.get(field) or '') for field in self.fields)
+        return WHITESPACE_RE.sub(' ', text.lower()).strip()
+
+    def shingles(self, text: str) -> np.ndarray:
+        """
+        32-битные хэши символьных k-грамм текста. Повторы не убираются:
+        на минимумы они не влияют.
+        """
+        chars = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.uint64)
+        k = min(self.shingle_size, len(chars))
+        if k == 0:
+            return np.zeros(1, dtype=np.uint64)
+
+        # Полиномиальный хэш окон длины k, переполнение uint64 допустимо
+        count = len(chars) - k + 1
+        hashes = chars[:count] * self._powers[-k]
+        for offset in range(1, k):
+            hashes += chars[offset:offset + count] * self._powers[offset - k]
+        return (hashes ^ (hashes >> np.uint64(32))) & np.uint64(0xFFFFFFFF)
+
+    def signature(self, item: dict) -> np.ndarray:
+        """MinHash-подпись записи: num_perm значений uint32"""
+        hashed = self.shingles(self.text(item))[:, None] * self._a
+        hashed += self._b
+        # Сдвиг монотонен, поэтому его можно применить уже к минимумам
+        return (hashed.min(axis=0) >> np.uint64(32)).astype(np.uint32)
+
+    def find_duplicates(self, items) -> dict:
+        """
+        Один проход по items. Возвращает {индекс дубликата: (индекс оставленной
+        записи, оценка сходства)}.
+        """
+        # Подписи копятся блоками, чтобы не держать по объекту NumPy на запись
+        band_blocks, short_blocks = [], []
+        block = []
+        
+        def flush_block():
+            signatures = np.stack(block)
+            bands = signatures[:, :self.bands * self.rows].reshape(-1, self.bands, self.rows).astype(np.uint64)
+            band_blocks.append((bands * self._band_weights).sum(axis=2, dtype=np.uint64))
+            # Для проверки кандидатов достаточно младших 16 бит (b-bit MinHash)
+            short_blocks.append(signatures.astype(np.uint16))
+            block.clear()
+
+        with np.errstate(over='ignore'):
+            for item in items:
+                block.append(self.signature(item))
+                if len(block) >= 10000:
+                    flush_block()
+            if block:
+                flush_block()
+
+        if not band_blocks:
+            return {}
+        band_keys = np.concatenate(band_blocks)
+        short_signatures = np.concatenate(short_blocks)
+        num_items = len(short_signatures)
+
+        # Кандидаты: все пары записей группы с одинаковым ключом полосы (в больших
+        # группах - пары на расстоянии до BUCKET_WINDOW позиций в группе)
+        pairs = []
+        for band in range(self.bands):
+            keys = band_keys[:, band]
+            order = np.argsort(keys, kind='stable')
+            sorted_keys = keys[order]
+            group = np.cumsum(np.r_[True, sorted_keys[1:] != sorted_keys[:-1]])
+            for offset in range(1, min(self.BUCKET_WINDOW, num_items - 1) + 1):
+                mask = group[offset:] == group[:-offset]
+                if not mask.any():
+                    break
+                first, second = order[:-offset][mask], order[offset:][mask]
+                # Пара (меньший, больший индекс) кодируется одним числом
+                pairs.append(np.minimum(first, second).astype(np.int64) * num_items + np.maximum(first, second))
+
+        if not pairs:
+            return {}
+        codes = np.unique(np.concatenate(pairs))
+        pairs = np.stack([codes // num_items, codes % num_items], axis=1)
+        similarity = self._similarity(short_signatures, pairs)
+        similar = similarity >= self.threshold
+        pairs, similarity = pairs[similar], similarity[similar]
+
+        # Записи по порядку: запись отбрасывается, если она похожа на более раннюю
+        # оставленную (из них выбирается самая похожая). Сходство не транзитивно,
+        # поэтому дубликат дубликата без прямого сходства с оставленной записью остается
+        order = np.lexsort((-similarity, pairs[:, 1]))
+        duplicates = {}
+        for (kept, duplicate), value in zip(pairs[order].tolist(), similarity[order].tolist()):
+            if duplicate not in duplicates and kept not in duplicates:
+                duplicates[duplicate] = (kept, value)
+        return duplicates
+
+    @staticmethod
+    def _similarity(short_signatures: np.ndarray, pairs: np.ndarray) -> np.ndarray:
+        """Оценка сходства Жаккара для пар индексов по 16-битным подписям"""
+        similarity = (short_signatures[pairs[:, 0]] == short_signatures[pairs[:, 1]]).mean(axis=1)
+        # Поправка b-bit MinHash на случайные совпадения младших бит
+        collision = 1 / 2 ** 16
+        return np.clip((similarity - collision) / (1 - collision), 0, 1)
+
+    def report(self, duplicates: dict, num_items: int) -> str:
+        kept = num_items - len(duplicates)
+        return (f"Dedup (threshold {self.threshold}, {self.bands}x{self.rows} LSH bands): "
+                f"{len(duplicates)} of {num_items} records dropped as near-duplicates, {kept} kept")
+
+def save_dedup_report(path: str, duplicates: dict, items=None):
+    """
+    Отчет об отброшенных записях (JSONL): индекс, индекс оставленной записи,
+    оценка сходства и, если переданы items (список или повторно читаемый
+    набор), начало инструкций обеих записей
+    """
+    lookup = {}
+    if items is not None:
+        needed = set(duplicates) | {kept for kept, _ in duplicates.values()}
+        lookup = {i: item for i, item in enumerate(items) if i in needed}
+
+    def records():
+        for index, (kept, similarity) in sorted(duplicates.items()):
+            record = {"index": index, "duplicate_of": kept, "similarity": round(similarity, 4)}
+            if lookup:
+                record["instruction"] = str(lookup[index].get('instruction', ''))[:200]
+                record["kept_instruction"] = str(lookup[kept].get('instruction', ''))[:200]
+            yield record
+    
+    write_jsonl(path, records())
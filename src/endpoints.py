@@ -0,0 +1,179 @@
+import logging
+import threading
+import time
+
+from .rate_limit import RetryableAPIError
+
+logger = logging.getLogger(__name__)
+
+class CircuitBreaker:
+    """
+    Предохранитель для одного сервера: после failure_threshold ошибок подряд
+    сервер исключается из маршрутизации на reset_timeout секунд, затем
+    пропускается один пробный запрос (half-open).
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold: int = 5, reset_timeout: float = 30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = self.CLOSED
+        self.failures = 0
+        self.opened_at = 0.0
+        self._probe_in_flight = False
+
+    def available(self, now: float) -> bool:
+        if self.state == self.CLOSED:
+            return True
+        if self.state == self.OPEN:
+            return now - self.opened_at >= self.reset_timeout
+        return not self._probe_in_flight
+
+    def on_acquire(self, now: float):
+        if self.state == self.OPEN and now - self.opened_at >= self.reset_timeout:
+            self.state = self.HALF_OPEN
+        if self.state == self.HALF_OPEN:
+            self._probe_in_flight = True
+
+    def record_success(self):
+        self.state = self.CLOSED
+        self.failures = 0
+        self._probe_in_flight = False
+
+    def record_failure(self, now: float) -> bool:
+        """Учет ошибки, возвращает True если предохранитель сработал"""
+        self.failures += 1
+        self._probe_in_flight = False
+        if self.state == self.HALF_OPEN or self.failures >= self.failure_threshold:
+            tripped = self.state != self.OPEN
+            self.state = self.OPEN
+            self.opened_at = now
+            return tripped
+        return False
+
+    def record_inconclusive(self, now: float):
+        """
+        Запрос завершился без признака здоровья сервера (ответ 4xx, пустой
+        ответ, прерванный поток). Если это был пробный запрос, предохранитель
+        снова открывается на reset_timeout: иначе сервер остался бы в
+        half-open без пробы и больше никогда не выбирался бы.
+        """
+        if self.state == self.HALF_OPEN and self._probe_in_flight:
+            self._probe_in_flight = False
+            self.state = self.OPEN
+            self.opened_at = now
+
+class Endpoint:
+    """Сервер LM Studio и его текущее состояние"""
+
+    def __init__(self, url: str, breaker: CircuitBreaker):
+        self.url = url.rstrip('/')
+        self.breaker = breaker
+        self.outstanding = 0
+        self.latency = None
+        self.requests = 0
+        self.errors = 0
+
+class EndpointPool:
+    """
+    Пул серверов с маршрутизацией запросов:
+    - least_outstanding: сервер с наименьшим числом запросов в работе
+    - lowest_latency: сервер с наименьшей сглаженной задержкой
+      (серверы без замеров выбираются первыми)
+    """
+
+    STRATEGIES = ('least_outstanding', 'lowest_latency')
+
+    def __init__(self, urls: list, strategy: str = 'least_outstanding', failure_threshold: int = 5,
+                 reset_timeout: float = 30.0, latency_alpha: float = 0.2):
+        if not urls:
+            raise ValueError("At least one API endpoint is required")
+        if strategy not in self.STRATEGIES:
+            raise ValueError(f"Unknown routing strategy: {strategy}")
+
+        self.endpoints = [Endpoint(url, CircuitBreaker(failure_threshold, reset_timeout)) for url in urls]
+        self.strategy = strategy
+        self.latency_alpha = latency_alpha
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: dict):
+        """Пул из api.endpoints, либо из api.base_url (строка или список)"""
+        api_config = config['api']
+        urls = api_config.get('endpoints') or api_config['base_url']
+        if isinstance(urls, str):
+            urls = [urls]
+
+        return cls(
+            urls,
+            strategy=api_config.get('routing', 'least_outstanding'),
+            failure_threshold=api_config.get('breaker_failures', 5),
+            reset_timeout=api_config.get('breaker_reset', 30.0)
+        )
+
+    def __len__(self):
+        return len(self.endpoints)
+
+    def acquire(self, exclude: tuple = ()) -> Endpoint:
+        """
+        Выбор сервера для очередного запроса. exclude - серверы, уже
+        ответившие ошибкой на этот запрос (используются, только если других нет).
+        """
+        with self._lock:
+            now = time.monotonic()
+            available = [e for e in self.endpoints if e.breaker.available(now)]
+            candidates = [e for e in available if e not in exclude] or available
+            if not candidates:
+                retry_after = min(e.breaker.reset_timeout - (now - e.breaker.opened_at) for e in self.endpoints)
+                raise RetryableAPIError("All API endpoints are unavailable", retry_after=max(0.0, retry_after))
+
+            # Серверы с недавними ошибками идут последними: они отвечают быстро
+            # и иначе притягивали бы запросы по числу выполняемых запросов
+            if self.strategy == 'lowest_latency':
+                endpoint = min(candidates, key=lambda e: (e.breaker.failures, e.latency is not None,
+                                                          e.latency or 0.0, e.outstanding))
+            else:
+                endpoint = min(candidates, key=lambda e: (e.breaker.failures, e.outstanding, e.latency or 0.0))
+
+            endpoint.breaker.on_acquire(now)
+            endpoint.outstanding += 1
+            endpoint.requests += 1
+            return endpoint
+
+    def release(self, endpoint: Endpoint, latency: float = None, success: bool = True, failure: bool = False):
+        """
+        Завершение запроса. failure - ошибка сервера (сетевая или 5xx/429),
+        она учитывается предохранителем; ошибки клиента (4xx) не учитываются,
+        но завершают пробный запрос (см. CircuitBreaker.record_inconclusive).
+        """
+        with self._lock:
+            endpoint.outstanding -= 1
+            if failure:
+                endpoint.errors += 1
+                if endpoint.breaker.record_failure(time.monotonic()):
+                    logger.warning(f"Circuit breaker opened for {endpoint.url}")
+                return
+
+            if not success:
+                endpoint.breaker.record_inconclusive(time.monotonic())
+            else:
+                endpoint.breaker.record_success()
+                if latency is not None:
+                    if endpoint.latency is None:
+                        endpoint.latency = latency
+                    else:
+                        endpoint.latency += self.latency_alpha * (latency - endpoint.latency)
+
+    def stats(self) -> list:
+        with self._lock:
+            return [{
+                "url": e.url,
+                "state": e.breaker.state,
+                "requests": e.requests,
+                "errors": e.errors,
+                "outstanding": e.outstanding,
+                "latency": e.latency
+            } for e in self.endpoints]
\ No newline at end of file
@@ -0,0 +1,152 @@
+import logging
+import re
+from itertools import islice
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+TOKEN_RE = re.compile(r'\w+')
+
+def tokenize(text: str) -> list:
+    return TOKEN_RE.findall(text.lower())
+
+def example_key(item: dict) -> tuple:
+    """Ключ записи для исключения текущего примера вместо сравнения словарей"""
+    return (item.get('instruction', ''), item.get('input', ''), item.get('output', ''))
+
+class ExampleIndex:
+    """
+    Индекс few-shot примеров, строится один раз для набора данных.
+
+    Режимы:
+    - first: первые num_examples записей, отличные от текущей (как раньше), O(1)
+    - similarity: num_examples самых похожих по BM25 записей; обратный индекс
+      хранится в массивах NumPy, и для запроса просматриваются только списки
+      документов его терминов, а не весь набор
+    """
+
+    def __init__(self, examples: list, num_examples: int = 2, mode: str = 'first',
+                 k1: float = 1.5, b: float = 0.75, max_df: float = 0.5):
+        if mode not in ('first', 'similarity'):
+            raise ValueError(f"Unknown few-shot mode: {mode}")
+
+        self.examples = examples
+        self.num_examples = num_examples
+        self.mode = mode
+        self.k1 = k1
+        self.b = b
+        self.max_df = max_df
+        self._keys = [example_key(item) for item in examples]
+        # Для режима first достаточно num_examples + 1 кандидатов
+        self._first = list(range(min(len(examples), num_examples + 1)))
+
+        if mode == 'similarity':
+            self._build_inverted_index()
+
+    @classmethod
+    def from_config(cls, config: dict, data):
+        """Построение индекса по секции few_shot конфига"""
+        few_shot = config.get('few_shot', {})
+        mode = few_shot.get('mode', 'first')
+        num_examples = few_shot.get('num_examples', 2)
+        # В режиме first нужны только первые записи, остальные не читаем
+        pool_size = num_examples + 1 if mode == 'first' else few_shot.get('pool_size', 10000)
+
+        examples = list(islice(data, pool_size))
+        index = cls(examples, num_examples=num_examples, mode=mode,
+                    k1=few_shot.get('bm25_k1', 1.5), b=few_shot.get('bm25_b', 0.75),
+                    max_df=few_shot.get('max_df', 0.5))
+        logger.info(f"Built few-shot index ({mode}) over {len(examples)} examples")
+        return index
+
+    @staticmethod
+    def _text(item: dict) -> str:
+        return f"{item.get('instruction', '')} {item.get('input', '')}"
+
+    def _build_inverted_index(self):
+        """Обратный индекс с предвычисленными BM25 весами"""
+        self.vocab = {}
+        term_ids = []
+        doc_ids = []
+        term_freqs = []
+        doc_lengths = np.zeros(len(self.examples), dtype=np.float32)
+
+        for doc_id, item in enumerate(self.examples):
+            tokens = tokenize(self._text(item))
+            doc_lengths[doc_id] = len(tokens)
+            counts = {}
+            for token in tokens:
+                term_id = self.vocab.setdefault(token, len(self.vocab))
+                counts[term_id] = counts.get(term_id, 0) + 1
+            term_ids.extend(counts.keys())
+            doc_ids.extend([doc_id] * len(counts))
+            term_freqs.extend(counts.values())
+
+        term_ids = np.asarray(term_ids, dtype=np.int64)
+        doc_ids = np.asarray(doc_ids, dtype=np.int64)
+        term_freqs = np.asarray(term_freqs, dtype=np.float32)
+
+        # Сортировка постингов по терминам: постинги термина t лежат в [offsets[t], offsets[t + 1])
+        order = np.argsort(term_ids, kind='stable')
+        term_ids = term_ids[order]
+        self._post_docs = doc_ids[order]
+        term_freqs = term_freqs[order]
+
+        doc_freqs = np.bincount(term_ids, minlength=len(self.vocab))
+        self._offsets = np.concatenate(([0], np.cumsum(doc_freqs)))
+        self._doc_freqs = doc_freqs
+
+        num_docs = max(len(self.examples), 1)
+        avg_length = float(doc_lengths.mean()) if len(self.examples) else 1.0
+        idf = np.log1p((num_docs - doc_freqs + 0.5) / (doc_freqs + 0.5))
+        norm = self.k1 * (1 - self.b + self.b * doc_lengths[self._post_docs] / max(avg_length, 1e-9))
+        self._post_weights = (idf[term_ids] * term_freqs * (self.k1 + 1) / (term_freqs + norm)).astype(np.float32)
+
+    def select(self, current_item: dict) -> list:
+        """Few-shot примеры для текущей записи (без нее самой)"""
+        if self.mode == 'similarity':
+            selected = self._select_similar(current_item)
+        else:
+            selected = []
+
+        if len(selected) < self.num_examples:
+            # Недостающие примеры добираем из первых записей
+            current_key = example_key(current_item)
+            for i in self._first:
+                if len(selected) >= self.num_examples:
+                    break
+                if i not in selected and self._keys[i] != current_key:
+                    selected.append(i)
+
+        return [self.examples[i] for i in selected]
+
+    def _select_similar(self, current_item: dict) -> list:
+        terms = {self.vocab[token] for token in tokenize(self._text(current_item)) if token in self.vocab}
+        if not terms:
+            return []
+
+        # Слишком частые термины почти не влияют на ранжирование, но дают самые длинные списки
+        max_df = max(1, int(self.max_df * len(self.examples)))
+        rare_terms = [t for t in terms if self._doc_freqs[t] <= max_df]
+        terms = rare_terms or list(terms)
+
+        docs = np.concatenate([self._post_docs[self._offsets[t]:self._offsets[t + 1]] for t in terms])
+        weights = np.concatenate([self._post_weights[self._offsets[t]:self._offsets[t + 1]] for t in terms])
+        candidates, inverse = np.unique(docs, return_inverse=True)
+        scores = np.bincount(inverse, weights=weights)
+
+        # Берем с запасом на случай, если среди лучших окажется сам текущий пример
+        k = min(self.num_examples + 1, len(candidates))
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top], kind='stable')]
+
+        current_key = example_key(current_item)
+        selected = []
+        for position in top:
+            doc_id = int(candidates[position])
+            if self._keys[doc_id] != current_key:
+                selected.append(doc_id)
+            if len(selected) == self.num_examples:
+                break
+        return selected
\ No newline at end of file
@@ -0,0 +1,273 @@
+import gzip
+import json
+import logging
+import mmap
+import os
+
+import numpy as np
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+logger = logging.getLogger(__name__)
+
+# Сжатие определяется по расширению файла
+COMPRESSIONS = {'.gz': 'gzip', '.zst': 'zstd'}
+
+def compression_of(path: str):
+    return COMPRESSIONS.get(os.path.splitext(path)[1])
+
+def open_text(path: str, mode: str = 'r'):
+    """
+    Открытие текстового файла с учетом сжатия (.gz - gzip, .zst - zstd).
+    mode: 'r', 'w' или 'a'. Для zstd нужен пакет zstandard.
+    """
+    compression = compression_of(path)
+    if compression == 'gzip':
+        return gzip.open(path, mode + 't', encoding='utf-8')
+    if compression == 'zstd':
+        try:
+            import zstandard
+        except ImportError as e:
+            raise ImportError(f"zstandard is required for {path} (pip install zstandard)") from e
+        return zstandard.open(path, mode + 't', encoding='utf-8')
+    return open(path, mode, encoding='utf-8')
+
+class JSONCodec:
+    """Стандартный json, строки без экранирования не-ASCII символов"""
+    name = 'json'
+    # Разбирает ли loads строки bytes без предварительного декодирования
+    binary = False
+
+    @staticmethod
+    def loads(line):
+        return json.loads(line)
+
+    @staticmethod
+    def dumps(record) -> str:
+        return json.dumps(record, ensure_ascii=False)
+
+    @staticmethod
+    def dumps_bytes(record) -> bytes:
+        return json.dumps(record, ensure_ascii=False).encode('utf-8')
+
+class OrjsonCodec:
+    """
+    orjson для чтения: разбирает строки в несколько раз быстрее json.
+    Запись идет через json, чтобы файлы не зависели от того, установлен ли
+    orjson (orjson пишет без пробелов после разделителей, а NaN - как null).
+    """
+    name = 'orjson'
+    binary = True
+
+    @staticmethod
+    def loads(line):
+        try:
+            return orjson.loads(line)
+        except orjson.JSONDecodeError:
+            # NaN/Infinity, которые пишет json, orjson не разбирает
+            return json.loads(line)
+
+    dumps = staticmethod(JSONCodec.dumps)
+    dumps_bytes = staticmethod(JSONCodec.dumps_bytes)
+
+CODECS = {'json': JSONCodec, 'orjson': OrjsonCodec}
+
+_codec = OrjsonCodec if orjson is not None else JSONCodec
+
+def set_codec(name: str = 'auto'):
+    """Выбор кодека для всего процесса: 'auto' (orjson, если установлен), 'orjson' или 'json'"""
+    global _codec
+    if name == 'auto':
+        name = 'orjson' if orjson is not None else 'json'
+    if name not in CODECS:
+        raise ValueError(f"Unknown JSON codec: {name}")
+    if name == 'orjson' and orjson is None:
+        raise ImportError("orjson is not installed (pip install orjson)")
+    _codec = CODECS[name]
+
+def get_codec():
+    return _codec
+
+def loads(line):
+    """Разбор одной строки JSONL (str или bytes). Ошибки - json.JSONDecodeError"""
+    return _codec.loads(line)
+
+def dumps(record) -> str:
+    """Запись в одну строку JSON без перевода строки"""
+    return _codec.dumps(record)
+
+def dumps_bytes(record) -> bytes:
+    """Запись в одну строку JSON в UTF-8 без перевода строки"""
+    return _codec.dumps_bytes(record)
+
+def iter_jsonl(path: str, skip_errors: bool = False):
+    """
+    Построчное чтение JSONL (в том числе сжатого .gz/.zst), пустые строки
+    пропускаются. При skip_errors битые строки пропускаются с предупреждением.
+    """
+    codec = _codec
+    # Несжатый файл читается без декодирования в str, если кодек разбирает bytes
+    binary = codec.binary and not compression_of(path)
+    with (open(path, 'rb') if binary else open_text(path, 'r')) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                yield codec.loads(line)
+            except json.JSONDecodeError:
+                if not skip_errors:
+                    raise
+                logger.warning(f"Skipping corrupted line in {path}")
+
+def write_jsonl(path: str, records, append: bool = False, batch_size: int = 1000) -> int:
+    """
+    Запись records в JSONL (сжатый при .gz/.zst) пачками по batch_size строк.
+    Возвращает число записанных записей.
+    """
+    codec = _codec
+    mode = 'a' if append else 'w'
+    # Несжатый файл пишется байтами, если кодек их выдает без кодирования str
+    if codec.binary and not compression_of(path):
+        f, dumps, newline = open(path, mode + 'b'), codec.dumps_bytes, b'\n'
+    else:
+        f, dumps, newline = open_text(path, mode), codec.dumps, '\n'
+    
+    count = 0
+    batch = []
+    with f:
+        for record in records:
+            batch.append(dumps(record))
+            if len(batch) >= batch_size:
+                f.write(newline.join(batch) + newline)
+                count += len(batch)
+                batch = []
+        if batch:
+            f.write(newline.join(batch) + newline)
+            count += len(batch)
+    return count
+
+def iter_jsonl_range(path: str, start: int, end: int):
+    """
+    Записи, строки которых начинаются в байтах [start, end) несжатого файла.
+    start должен быть началом строки (см. JSONLIndex.byte_ranges), поэтому
+    диапазоны можно читать независимо, например в разных процессах.
+    """
+    codec = _codec
+    with open(path, 'rb') as f:
+        f.seek(start)
+        position = start
+        while position < end:
+            line = f.readline()
+            if not line:
+                break
+            position += len(line)
+            if line.strip():
+                yield codec.loads(line)
+
+class JSONLIndex:
+    """
+    Индекс смещений строк несжатого JSONL поверх отображенного в память
+    файла: запись i читается и разбирается за O(1) без чтения предыдущих.
+
+    Индекс строится одним векторным проходом по файлу (поиск '\\n' в NumPy).
+    С index_path он сохраняется рядом (.npy) и при следующем открытии
+    отображается в память, если файл данных с тех пор не менялся.
+    """
+
+    # Размер блока при поиске переводов строк
+    SCAN_BLOCK = 64 << 20
+
+    def __init__(self, path: str, index_path: str = None):
+        if compression_of(path):
+            raise ValueError(f"Random access needs an uncompressed JSONL file: {path}")
+        self.path = path
+        self.index_path = index_path
+        self._file = open(path, 'rb')
+        size = os.fstat(self._file.fileno()).st_size
+        self._mmap = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else b''
+        self.size = size
+
+        if index_path and self._index_is_fresh():
+            self.offsets = np.load(index_path, mmap_mode='r')
+        else:
+            self.offsets = self._build()
+            if index_path:
+                np.save(index_path, self.offsets)
+
+    def _index_is_fresh(self) -> bool:
+        try:
+            return os.stat(self.index_path).st_mtime_ns >= os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    def _build(self) -> np.ndarray:
+        """Массив (n, 2) с началом и концом каждой непустой строки"""
+        newlines = []
+        for offset in range(0, self.size, self.SCAN_BLOCK):
+            block = np.frombuffer(self._mmap, dtype=np.uint8,
+                                  count=min(self.SCAN_BLOCK, self.size - offset), offset=offset)
+            newlines.append(np.flatnonzero(block == 10) + offset)
+        newlines = np.concatenate(newlines) if newlines else np.zeros(0, dtype=np.int64)
+
+        starts = np.concatenate([[0], newlines + 1]).astype(np.int64)
+        ends = np.concatenate([newlines, [self.size]]).astype(np.int64)
+        # Пустые строки (в том числе после последнего перевода строки) не входят в индекс
+        lengths = ends - starts
+        keep = lengths > 0
+        if keep.any():
+            # Строки из одного '\r' (файлы с CRLF) тоже пустые
+            single = np.flatnonzero(lengths == 1)
+            if len(single):
+                data = np.frombuffer(self._mmap, dtype=np.uint8)
+                keep[single[data[starts[single]] == 13]] = False
+        return np.stack([starts[keep], ends[keep]], axis=1)
+
+    def __len__(self) -> int:
+        return len(self.offsets)
+
+    def line(self, i: int, limit: int = None) -> bytes:
+        """Байты строки i (не больше limit первых байт, если limit задан)"""
+        start, end = self.offsets[i]
+        if limit is not None:
+            end = min(end, start + limit)
+        return self._mmap[start:end]
+
+    def __getitem__(self, i: int):
+        return _codec.loads(self.line(i))
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+
+    def sample(self, k: int, seed: int = None) -> list:
+        """k случайных различных записей (все, если записей меньше)"""
+        rng = np.random.default_rng(seed)
+        indices = rng.choice(len(self), size=min(k, len(self)), replace=False)
+        return [self[int(i)] for i in indices]
+
+    def byte_ranges(self, parts: int) -> list:
+        """
+        Разбиение файла на parts диапазонов байт по границам строк
+        с примерно равным числом записей (для iter_jsonl_range)
+        """
+        if not len(self):
+            return []
+        bounds = np.linspace(0, len(self), min(parts, len(self)) + 1).astype(np.int64)
+        return [(int(self.offsets[a][0]), int(self.offsets[b - 1][1]) + 1)
+                for a, b in zip(bounds[:-1], bounds[1:])]
+
+    def close(self):
+        if isinstance(self._mmap, mmap.mmap):
+            # Массив индекса и срезы могут ссылаться на mmap, поэтому сначала отпускаем их
+            self.offsets = None
+            self._mmap.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
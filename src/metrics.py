@@ -0,0 +1,184 @@
+import re
+
+import numpy as np
+
+TOKEN_RE = re.compile(r'\w+')
+WHITESPACE_RE = re.compile(r'\s+')
+
+METRIC_NAMES = ('exact_match', 'token_f1', 'rouge_l', 'chrf')
+
+def normalize(text) -> str:
+    return WHITESPACE_RE.sub(' ', (text or '').lower()).strip()
+
+def _encode_tokens(texts: list, vocab: dict):
+    """Токены всех текстов одним массивом id и массив номеров пар"""
+    ids = []
+    owners = []
+    lengths = np.zeros(len(texts), dtype=np.int64)
+    for i, text in enumerate(texts):
+        tokens = TOKEN_RE.findall(normalize(text))
+        lengths[i] = len(tokens)
+        ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+        owners.extend([i] * len(tokens))
+    return np.asarray(ids, dtype=np.int64), np.asarray(owners, dtype=np.int64), lengths
+
+def _overlap(owners_a, ids_a, owners_b, ids_b, num_pairs: int, vocab_size: int) -> np.ndarray:
+    """
+    Для каждой пары - размер пересечения мультимножеств (сумма min по
+    совпадающим элементам), посчитанный сразу для всего набора.
+    """
+    if len(ids_a) == 0 or len(ids_b) == 0:
+        return np.zeros(num_pairs, dtype=np.int64)
+
+    keys_a, counts_a = np.unique(owners_a * vocab_size + ids_a, return_counts=True)
+    keys_b, counts_b = np.unique(owners_b * vocab_size + ids_b, return_counts=True)
+    common, index_a, index_b = np.intersect1d(keys_a, keys_b, assume_unique=True, return_indices=True)
+    matches = np.minimum(counts_a[index_a], counts_b[index_b])
+    return np.bincount(common // vocab_size, weights=matches, minlength=num_pairs).astype(np.int64)
+
+def _f_score(precision, recall, beta: float = 1.0):
+    beta2 = beta * beta
+    denominator = beta2 * precision + recall
+    with np.errstate(divide='ignore', invalid='ignore'):
+        score = (1 + beta2) * precision * recall / denominator
+    return np.where(denominator > 0, score, 0.0)
+
+def _ratio(numerator, denominator):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return np.where(denominator > 0, numerator / np.maximum(denominator, 1), 0.0)
+
+def exact_match(predictions: list, references: list) -> np.ndarray:
+    preds = np.array([normalize(p) for p in predictions], dtype=object)
+    refs = np.array([normalize(r) for r in references], dtype=object)
+    return (preds == refs).astype(np.float64)
+
+def token_f1(pred_tokens, ref_tokens, num_pairs: int, vocab_size: int) -> np.ndarray:
+    pred_ids, pred_owners, pred_lengths = pred_tokens
+    ref_ids, ref_owners, ref_lengths = ref_tokens
+    overlap = _overlap(pred_owners, pred_ids, ref_owners, ref_ids, num_pairs, vocab_size)
+    return _f_score(_ratio(overlap, pred_lengths), _ratio(overlap, ref_lengths))
+
+def _pad(ids, owners, lengths, rows, fill: int) -> np.ndarray:
+    """Матрица токенов для выбранных пар, дополненная значением fill"""
+    width = int(lengths[rows].max()) if len(rows) else 0
+    matrix = np.full((len(rows), width), fill, dtype=np.int64)
+    starts = np.concatenate(([0], np.cumsum(lengths)))[:-1]
+    for r, pair in enumerate(rows):
+        n = lengths[pair]
+        matrix[r, :n] = ids[starts[pair]:starts[pair] + n]
+    return matrix
+
+def rouge_l(pred_tokens, ref_tokens, num_pairs: int, chunk_size: int = 256) -> np.ndarray:
+    """
+    ROUGE-L F1. Длина LCS считается динамическим программированием сразу
+    для пачки пар: строка таблицы для очередного токена предсказания
+    получается как накопленный максимум по всем ссылкам пачки.
+    """
+    pred_ids, pred_owners, pred_lengths = pred_tokens
+    ref_ids, ref_owners, ref_lengths = ref_tokens
+    lcs = np.zeros(num_pairs, dtype=np.int64)
+
+    # Пары близкой длины в одной пачке - меньше заполнения
+    order = np.argsort(pred_lengths * (ref_lengths.max(initial=0) + 1) + ref_lengths, kind='stable')
+    for start in range(0, num_pairs, chunk_size):
+        rows = order[start:start + chunk_size]
+        preds = _pad(pred_ids, pred_owners, pred_lengths, rows, fill=-1)
+        refs = _pad(ref_ids, ref_owners, ref_lengths, rows, fill=-2)
+        if preds.shape[1] == 0 or refs.shape[1] == 0:
+            continue
+
+        previous = np.zeros((len(rows), refs.shape[1] + 1), dtype=np.int64)
+        for i in range(preds.shape[1]):
+            match = preds[:, i:i + 1] == refs
+            candidate = np.where(match, previous[:, :-1] + 1, previous[:, 1:])
+            previous[:, 1:] = np.maximum.accumulate(candidate, axis=1)
+        lcs[rows] = previous[:, -1]
+
+    return _f_score(_ratio(lcs, pred_lengths), _ratio(lcs, ref_lengths))
+
+def _char_ngrams(texts: list, n: int):
+    """Хэши символьных n-грамм (без пробелов) всех текстов и номера их пар"""
+    codes = []
+    owners = []
+    for i, text in enumerate(texts):
+        chars = np.frombuffer(WHITESPACE_RE.sub('', text or '').encode('utf-32-le'), dtype=np.uint32)
+        if len(chars) < n:
+            continue
+        # Полиномиальный хэш окна длины n, переполнение uint64 допустимо
+        windows = np.lib.stride_tricks.sliding_window_view(chars.astype(np.uint64), n)
+        powers = np.uint64(1000003) ** np.arange(n - 1, -1, -1, dtype=np.uint64)
+        codes.append((windows * powers).sum(axis=1, dtype=np.uint64))
+        owners.append(np.full(len(windows), i, dtype=np.int64))
+
+    if not codes:
+        return np.zeros(0, dtype=np.uint64), np.zeros(0, dtype=np.int64)
+    return np.concatenate(codes), np.concatenate(owners)
+
+def chrf(predictions: list, references: list, max_order: int = 6, beta: float = 2.0) -> np.ndarray:
+    """chrF: средние по порядкам n-грамм точность и полнота, F-мера с beta=2"""
+    num_pairs = len(predictions)
+    precision_sum = np.zeros(num_pairs)
+    recall_sum = np.zeros(num_pairs)
+    orders = np.zeros(num_pairs)
+
+    with np.errstate(over='ignore'):
+        for n in range(1, max_order + 1):
+            pred_codes, pred_owners = _char_ngrams(predictions, n)
+            ref_codes, ref_owners = _char_ngrams(references, n)
+
+            # Перевод хэшей в плотные id, чтобы ключ (пара, n-грамма) поместился в int64
+            unique, inverse = np.unique(np.concatenate((pred_codes, ref_codes)), return_inverse=True)
+            pred_ids = inverse[:len(pred_codes)]
+            ref_ids = inverse[len(pred_codes):]
+
+            matches = _overlap(pred_owners, pred_ids, ref_owners, ref_ids, num_pairs, max(len(unique), 1))
+            pred_total = np.bincount(pred_owners, minlength=num_pairs)
+            ref_total = np.bincount(ref_owners, minlength=num_pairs)
+
+            valid = (pred_total > 0) & (ref_total > 0)
+            precision_sum += np.where(valid, _ratio(matches, pred_total), 0.0)
+            recall_sum += np.where(valid, _ratio(matches, ref_total), 0.0)
+            orders += valid
+
+    return _f_score(_ratio(precision_sum, orders), _ratio(recall_sum, orders), beta)
+
+def compute_metrics(predictions: list, references: list) -> dict:
+    """Все метрики для набора пар (предсказание, эталон): имя -> массив оценок"""
+    predictions = [p or '' for p in predictions]
+    references = [r or '' for r in references]
+    num_pairs = len(predictions)
+
+    vocab = {}
+    pred_tokens = _encode_tokens(predictions, vocab)
+    ref_tokens = _encode_tokens(references, vocab)
+    vocab_size = max(len(vocab), 1)
+
+    return {
+        'exact_match': exact_match(predictions, references),
+        'token_f1': token_f1(pred_tokens, ref_tokens, num_pairs, vocab_size),
+        'rouge_l': rouge_l(pred_tokens, ref_tokens, num_pairs),
+        'chrf': chrf(predictions, references)
+    }
+
+def summarize(scores: dict) -> dict:
+    """Средние значения метрик"""
+    summary = {name: float(values.mean()) if len(values) else 0.0 for name, values in scores.items()}
+    summary['count'] = int(len(next(iter(scores.values())))) if scores else 0
+    return summary
+
+class ScoreAccumulator:
+    """Средние значения метрик по нескольким пачкам оценок (для потоковой оценки)"""
+
+    def __init__(self):
+        self.sums = {name: 0.0 for name in METRIC_NAMES}
+        self.count = 0
+
+    def add(self, scores: dict):
+        for name, values in scores.items():
+            self.sums[name] = self.sums.get(name, 0.0) + float(values.sum())
+        self.count += len(next(iter(scores.values()))) if scores else 0
+
+    def summary(self) -> dict:
+        summary = {name: total / self.count if self.count else 0.0 for name, total in self.sums.items()}
+        summary['count'] = self.count
+        return summary
@@ -1,91 +1,343 @@
 import logging
 import time
+from abc import ABC, abstractmethod
+import requests
 from tqdm import tqdm
-from .utils import make_api_request, generate_with_retry
+from .utils import make_api_request, generate_with_retry, create_session, stream_api_request, build_messages
+from .cache import ResponseCache, create_cache
+from .example_index import ExampleIndex
+from .prompts import PromptLibrary
+from .tokens import TokenBudget, TokenBudgetError, LengthPolicy
+from .rate_limit import AdaptiveLimiter
+from .endpoints import EndpointPool
+from .async_engine import AsyncGenerationEngine
+from .telemetry import create_metrics
+from .profiling import phase
 
 logger = logging.getLogger(__name__)
 
-class LMStudioClient:
+class GenerationClient(ABC):
+    """
+    Общая часть клиентов генерации: промпты, LengthPolicy, метрики и
+    построенные на generate методы (evaluate, fine_tune_simulation).
+    Подкласс реализует абстрактные _generate, generate_samples,
+    generate_stream и max_concurrency; cache - локальный кэш ответов
+    (None, если его нет в процессе).
+    """
+    
     def __init__(self, config: dict):
         self.config = config
-        self.base_url = config['api']['base_url']
-        self.model_name = config['api']['model_name']
-        self.api_key = config['api']['api_key']
+        self.cache = None
+        self.prompts = PromptLibrary(config)
+        # Задержки, токены и ошибки запросов с периодической записью в файл
+        self.metrics, self._metrics_flusher = create_metrics(config)
+        # max_tokens запросов по длине эталонных ответов (секция generation)
+        self.lengths = LengthPolicy.from_config(config)
+    
+    @property
+    @abstractmethod
+    def max_concurrency(self) -> int:
+        """Число рабочих потоков для параллельных запросов"""
+    
+    def close(self):
+        """Финальная запись метрик"""
+        if self._metrics_flusher is not None:
+            self._metrics_flusher.close()
+            self._metrics_flusher = None
+    
+    def __enter__(self):
+        return self
     
-    def generate(self, prompt: str, max_tokens: int = 2048):
-        """Генерация текста через API"""
-        return generate_with_retry(self.config, prompt, max_tokens)
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+    
+    @abstractmethod
+    def _generate(self, prompt: str, max_tokens: int, system: str = None, sample: int = 0):
+        """Ответ на промпт (None, если его не удалось получить)"""
+    
+    @abstractmethod
+    def generate_samples(self, prompt: str, n: int, max_tokens: int = None, system: str = None,
+                         sample_ids: list = None) -> list:
+        """n вариантов ответа на один промпт (см. LMStudioClient.generate_samples)"""
+    
+    @abstractmethod
+    def generate_stream(self, prompt: str, max_tokens: int = None):
+        """Потоковая генерация: отдает фрагменты ответа по мере поступления"""
+    
+    def generate(self, prompt: str, max_tokens: int = None, system: str = None, sample: int = 0):
+        """
+        Генерация текста через API. system - общий для многих запросов
+        префикс, отправляется отдельным system-сообщением. max_tokens по
+        умолчанию задает LengthPolicy. sample - номер варианта ответа в
+        ключе кэша (например эпоха - 1): при temperature > 0 повтор того же
+        промпта с другим номером дает новый ответ, а не копию из кэша
+        """
+        if max_tokens is None:
+            max_tokens = self.lengths.limit()
+        start = time.perf_counter()
+        response = self._generate(prompt, max_tokens, system, sample)
+        if self.metrics is not None:
+            self.metrics.record_generation(time.perf_counter() - start, success=response is not None)
+        return response
     
-    def evaluate(self, prompts: list, references: list = None):
-        """Оценка модели на наборе промптов"""
-        results = []
+    def evaluate(self, prompts, references=None, concurrency: int = None, on_result=None, sample: int = 0):
+        """
+        Оценка модели на наборе промптов. Запросы выполняются параллельно
+        (до concurrency одновременно, по умолчанию max_concurrency),
+        результаты возвращаются в порядке промптов.
+        prompts и references могут быть итераторами. Если задан
+        on_result(i, result), результаты передаются ему по мере получения
+        и не накапливаются, возвращается их количество. sample - номер
+        варианта ответа в ключе кэша (см. generate).
+        """
+        if concurrency is None:
+            concurrency = self.max_concurrency
+        
+        results = [] if on_result is None else None
+        processed = 0
+        total = len(prompts) if hasattr(prompts, '__len__') else None
+        progress = tqdm(total=total, desc="Evaluating")
+        reference_iter = iter(references) if references is not None else iter(())
+        items = ((prompt, next(reference_iter, None)) for prompt in prompts)
         
-        for i, prompt in enumerate(tqdm(prompts, desc="Evaluating")):
-            response = self.generate(prompt)
+        def work(item):
+            return self.generate(item[0], sample=sample)
+        
+        def collect(i, item, response):
+            nonlocal processed
+            if isinstance(response, Exception):
+                logger.error(f"Error evaluating prompt {i}: {response}")
+                response = None
             
+            prompt, reference = item
             result = {
                 "prompt": prompt,
                 "generated_response": response,
-                "reference": references[i] if references and i < len(references) else None
+                "reference": reference
             }
             
-            results.append(result)
+            processed += 1
+            if on_result is not None:
+                on_result(i, result)
+            else:
+                results.append(result)
+            progress.update(1)
             
             if (i + 1) % 10 == 0:
-                logger.info(f"Processed {i + 1}/{len(prompts)} prompts")
+                logger.info(f"Processed {i + 1}/{total or '?'} prompts")
+        
+        try:
+            AsyncGenerationEngine(concurrency).run(work, items, on_result=collect)
+        finally:
+            progress.close()
         
-        return results
+        return results if on_result is None else processed
     
-    def fine_tune_simulation(self, examples: list, num_epochs: int = 3):
+    def fine_tune_simulation(self, examples: list, num_epochs: int = 3, multi_sample: bool = None):
         """
-        Симуляция дообучения через few-shot learning
+        Симуляция дообучения через few-shot learning.
+        multi_sample (по умолчанию training.multi_sample): ответы всех эпох
+        одним запросом с num_epochs вариантами вместо прохода на каждую эпоху;
+        результаты, как и без него, идут по эпохам.
         """
-        results = []
+        if multi_sample is None:
+            multi_sample = self.config.get('training', {}).get('multi_sample', False)
+        example_index = ExampleIndex.from_config(self.config, examples)
+        budget = TokenBudget(self.config)
+        self.lengths.fit(example.get('output', '') for example in examples)
         
-        for epoch in range(num_epochs):
-            logger.info(f"Starting epoch {epoch + 1}/{num_epochs}")
-            epoch_results = []
-            
-            for example in tqdm(examples, desc=f"Epoch {epoch + 1}"):
-                # Создаем few-shot промпт
-                few_shot_prompt = self._create_few_shot_prompt(examples, example)
-                response = self.generate(few_shot_prompt)
+        def make_prompt(example):
+            # Создаем few-shot промпт
+            try:
+                with phase('prompt_build'):
+                    shots = budget.fit_examples(example_index.select(example), example, self.prompts.few_shot)
+                    return self._create_few_shot_prompt(shots, example)
+            except TokenBudgetError as e:
+                logger.warning(f"Skipping example: {e}")
+                return None
+        
+        def make_result(epoch, example, response):
+            return {
+                "epoch": epoch,
+                "input": example.get('input', ''),
+                "instruction": example.get('instruction', ''),
+                "expected_output": example.get('output', ''),
+                "generated_output": response
+            }
+        
+        epoch_results = [[] for _ in range(num_epochs)]
+        if multi_sample and num_epochs > 1:
+            logger.info(f"Sampling {num_epochs} epochs in one pass")
+            for example in tqdm(examples, desc=f"Epochs 1-{num_epochs}"):
+                few_shot_prompt = make_prompt(example)
+                if few_shot_prompt is None:
+                    continue
+                responses = self.generate_samples(few_shot_prompt, num_epochs,
+                                                  max_tokens=self.lengths.limit(example.get('output')))
+                for epoch, response in enumerate(responses):
+                    epoch_results[epoch].append(make_result(epoch + 1, example, response))
+        else:
+            for epoch in range(num_epochs):
+                logger.info(f"Starting epoch {epoch + 1}/{num_epochs}")
                 
-                result = {
-                    "epoch": epoch + 1,
-                    "input": example.get('input', ''),
-                    "instruction": example.get('instruction', ''),
-                    "expected_output": example.get('output', ''),
-                    "generated_output": response
-                }
+                for example in tqdm(examples, desc=f"Epoch {epoch + 1}"):
+                    few_shot_prompt = make_prompt(example)
+                    if few_shot_prompt is None:
+                        continue
+                    response = self.generate(few_shot_prompt, self.lengths.limit(example.get('output')),
+                                             sample=epoch)
+                    epoch_results[epoch].append(make_result(epoch + 1, example, response))
                 
-                epoch_results.append(result)
-            
-            results.extend(epoch_results)
-            logger.info(f"Completed epoch {epoch + 1}")
-        
-        return results
-    
-    def _create_few_shot_prompt(self, examples: list, current_example: dict, num_shots: int = 2):
-        """Создание few-shot промпта"""
-        prompt = "Ты - помощник, дообученный на следующих примерах:\n\n"
-        
-        # Добавляем примеры
-        shot_count = 0
-        for example in examples:
-            if example != current_example and shot_count < num_shots:
-                prompt += f"Пример {shot_count + 1}:\n"
-                prompt += f"Инструкция: {example.get('instruction', '')}\n"
-                if example.get('input'):
-                    prompt += f"Вход: {example.get('input', '')}\n"
-                prompt += f"Ответ: {example.get('output', '')}\n\n"
-                shot_count += 1
-        
-        # Добавляем текущий запрос
-        prompt += "Новый запрос:\n"
-        prompt += f"Инструкция: {current_example.get('instruction', '')}\n"
-        if current_example.get('input'):
-            prompt += f"Вход: {current_example.get('input', '')}\n"
-        prompt += "Ответ:"
-        
-        return prompt
\ No newline at end of file
+                logger.info(f"Completed epoch {epoch + 1}")
+        
+        logger.info(budget.summary())
+        if self.metrics is not None:
+            logger.info(self.lengths.report(self.metrics.snapshot()['finish_reasons']))
+        
+        return [result for results in epoch_results for result in results]
+    
+    def _create_few_shot_prompt(self, examples: list, current_example: dict):
+        """Создание few-shot промпта из примеров, выбранных ExampleIndex"""
+        return self.prompts.few_shot.render(examples, current_example)
+
+class LMStudioClient(GenerationClient):
+    def __init__(self, config: dict):
+        super().__init__(config)
+        self.base_url = config['api']['base_url']
+        # Пул серверов LM Studio (один сервер, если задан только base_url)
+        self.endpoints = EndpointPool.from_config(config)
+        self.model_name = config['api']['model_name']
+        self.api_key = config['api']['api_key']
+        # Общий пул соединений для generate, evaluate и fine_tune_simulation
+        self.session = create_session(config)
+        self.cache = create_cache(config)
+        # Общий для всех потоков контроллер темпа запросов
+        self.limiter = AdaptiveLimiter.from_config(config, endpoints=len(self.endpoints))
+        # Поддерживает ли сервер параметр n (None - определяется по первому ответу)
+        self.supports_n = config['api'].get('supports_n')
+        self.max_retries = config.get('rate_limit', {}).get('max_retries', 3)
+    
+    @property
+    def max_concurrency(self) -> int:
+        """
+        Число рабочих потоков для параллельных запросов. С AdaptiveLimiter -
+        его потолок: реальную конкурентность задает лимитер, и рост лимита
+        не упирается в размер пула. Без лимитера - training.max_concurrency
+        на каждый сервер пула
+        """
+        if self.limiter is not None:
+            return int(self.limiter.max_limit)
+        return self.config['training'].get('max_concurrency', 4) * len(self.endpoints)
+    
+    def close(self):
+        """Закрытие пула соединений и кэша, финальная запись метрик"""
+        self.session.close()
+        if self.cache is not None:
+            self.cache.close()
+        super().close()
+    
+    def generate_samples(self, prompt: str, n: int, max_tokens: int = None, system: str = None,
+                         sample_ids: list = None) -> list:
+        """
+        n вариантов ответа на один промпт. Недостающие в кэше варианты
+        запрашиваются одним запросом с параметром n (промпт обрабатывается
+        сервером один раз); если сервер n не поддерживает, остальные
+        запрашиваются отдельно тем же промптом, который уже лежит в кэше
+        префиксов сервера. sample_ids - номера вариантов в ключах кэша (по
+        умолчанию 0..n-1, см. generate). Возвращает список длины n, None на
+        месте неудавшихся вариантов.
+        """
+        if max_tokens is None:
+            max_tokens = self.lengths.limit()
+        if sample_ids is None:
+            sample_ids = range(n)
+        start = time.perf_counter()
+        # Каждый вариант кэшируется под своим ключом, каким бы запросом он ни был получен
+        keys = [self._cache_key(prompt, max_tokens, system, k) for k in sample_ids] if self.cache is not None else None
+        samples = [None] * n
+        if keys is not None:
+            with phase('cache'):
+                samples = [self.cache.get(key) for key in keys]
+        missing = [k for k, sample in enumerate(samples) if sample is None]
+        
+        if len(missing) > 1 and self.supports_n is not False:
+            response = generate_with_retry(self.config, prompt, self.max_retries, session=self.session,
+                                           limiter=self.limiter, endpoints=self.endpoints, metrics=self.metrics,
+                                           system=system, n=len(missing), max_tokens=max_tokens)
+            if response:
+                if len(response) < len(missing) and self.supports_n is None:
+                    logger.info(f"Server returned {len(response)} of {len(missing)} requested completions, "
+                                f"requesting the rest one by one")
+                    self.supports_n = False
+                elif self.supports_n is None:
+                    self.supports_n = True
+                for k, sample in zip(missing, response):
+                    samples[k] = sample
+                    if keys is not None:
+                        with phase('cache'):
+                            self.cache.set(keys[k], sample)
+                missing = missing[len(response):]
+        
+        for k in missing:
+            samples[k] = self._generate(prompt, max_tokens, system, sample=sample_ids[k])
+        
+        if self.metrics is not None:
+            self.metrics.record_generation(time.perf_counter() - start,
+                                           success=any(sample is not None for sample in samples))
+        return samples
+    
+    def _cache_key(self, prompt: str, max_tokens: int, system: str = None, sample: int = 0) -> str:
+        """
+        Ключ кэша ответа. sample - номер варианта при нескольких ответах на
+        один промпт: у каждого свой ключ, иначе все варианты совпали бы
+        """
+        params = dict(
+            temperature=self.config['model']['temperature'],
+            top_p=self.config['model']['top_p'],
+            max_tokens=max_tokens
+        )
+        # Стоп-последовательности меняют ответ, но без них ключ остается прежним
+        stop = self.config.get('generation', {}).get('stop')
+        if stop:
+            params['stop'] = stop
+        if sample:
+            params['sample'] = sample
+        return ResponseCache.make_key(self.model_name, build_messages(prompt, system), **params)
+    
+    def _generate(self, prompt: str, max_tokens: int, system: str = None, sample: int = 0):
+        """Ответ сервера с учетом кэша"""
+        def request():
+            return generate_with_retry(self.config, prompt, self.max_retries, session=self.session,
+                                       limiter=self.limiter, endpoints=self.endpoints, metrics=self.metrics,
+                                       system=system, max_tokens=max_tokens)
+        
+        if self.cache is None:
+            return request()
+        
+        key = self._cache_key(prompt, max_tokens, system, sample)
+        with phase('cache'):
+            response = self.cache.get(key)
+        if response is None:
+            response = request()
+            with phase('cache'):
+                self.cache.set(key, response)
+        
+        return response
+    
+    def generate_stream(self, prompt: str, max_tokens: int = None):
+        """Потоковая генерация: отдает фрагменты ответа по мере поступления"""
+        if max_tokens is None:
+            max_tokens = self.lengths.limit()
+        messages = build_messages(prompt)
+        endpoint = self.endpoints.acquire()
+        success = False
+        failure = False
+        try:
+            yield from stream_api_request(self.config, messages, max_tokens, session=self.session,
+                                          base_url=endpoint.url, metrics=self.metrics)
+            success = True
+        except requests.exceptions.RequestException:
+            failure = True
+            raise
+        finally:
+            self.endpoints.release(endpoint, success=success, failure=failure)
\ No newline at end of file
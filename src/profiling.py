@@ -0,0 +1,172 @@
+import cProfile
+import io
+import json
+import logging
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+# Активный профилировщик процесса (None - профилирование выключено)
+_active = None
+_NULL = nullcontext()
+
+class Profiler:
+    """
+    Время по фазам выполнения (загрузка конфига и данных, подготовка,
+    разделение, построение промптов, ожидание сети, ввод-вывод чекпоинта,
+    сохранение оценки). Время фазы - собственное: вложенные фазы вычитаются
+    из внешней, поэтому сумма по фазам потока равна его времени работы.
+    Фазы рабочих потоков складываются, поэтому при параллельных запросах их
+    сумма может превышать общее время.
+
+    Дополнительно: cProfile (только главный поток) и пики памяти tracemalloc
+    после каждой фазы верхнего уровня.
+    """
+
+    def __init__(self, cprofile: bool = False, trace_memory: bool = False):
+        self.phases = {}
+        self.memory = []
+        self.cprofile = cProfile.Profile() if cprofile else None
+        self.trace_memory = trace_memory
+        self.started = None
+        self.wall_time = 0.0
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._main_thread = threading.main_thread()
+
+    def start(self):
+        if self.trace_memory:
+            tracemalloc.start()
+        if self.cprofile is not None:
+            self.cprofile.enable()
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.wall_time = time.perf_counter() - self.started
+        if self.cprofile is not None:
+            self.cprofile.disable()
+        if self.trace_memory:
+            self._snapshot_memory('end')
+            self.top_allocations = tracemalloc.take_snapshot().statistics('lineno')[:10]
+            tracemalloc.stop()
+
+    @contextmanager
+    def phase(self, name: str):
+        stack = getattr(self._local, 'stack', None)
+        if stack is None:
+            stack = self._local.stack = []
+        # [имя, начало, время вложенных фаз]
+        frame = [name, time.perf_counter(), 0.0]
+        stack.append(frame)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - frame[1]
+            stack.pop()
+            if stack:
+                stack[-1][2] += elapsed
+            with self._lock:
+                stats = self.phases.setdefault(name, [0, 0.0])
+                stats[0] += 1
+                stats[1] += elapsed - frame[2]
+            if self.trace_memory and not stack and threading.current_thread() is self._main_thread:
+                self._snapshot_memory(name)
+
+    def iterate(self, name: str, iterable):
+        """Учет времени получения каждого элемента iterable как фазы name"""
+        iterator = iter(iterable)
+        while True:
+            with self.phase(name):
+                try:
+                    item = next(iterator)
+                except StopIteration:
+                    return
+            yield item
+
+    def _snapshot_memory(self, name: str):
+        current, peak = tracemalloc.get_traced_memory()
+        self.memory.append({"phase": name, "current_mb": current / 2 ** 20, "peak_mb": peak / 2 ** 20})
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+
+    def to_dict(self) -> dict:
+        with self._lock:
+            phases = {name: {"calls": calls, "seconds": seconds} for name, (calls, seconds) in self.phases.items()}
+        return {"wall_time": self.wall_time, "phases": phases, "memory": list(self.memory)}
+
+    def report(self) -> str:
+        data = self.to_dict()
+        wall = data['wall_time'] or 1e-9
+        lines = [f"Profile: wall time {data['wall_time']:.3f}s",
+                 f"{'phase':<20} {'calls':>10} {'seconds':>10} {'% wall':>8}"]
+        for name, stats in sorted(data['phases'].items(), key=lambda kv: -kv[1]['seconds']):
+            lines.append(f"{name:<20} {stats['calls']:>10} {stats['seconds']:>10.3f} "
+                         f"{100 * stats['seconds'] / wall:>7.1f}%")
+
+        if data['memory']:
+            lines.append("Memory (tracemalloc, peak since previous phase):")
+            for snapshot in data['memory']:
+                lines.append(f"  {snapshot['phase']:<18} peak {snapshot['peak_mb']:.1f} MB, "
+                             f"current {snapshot['current_mb']:.1f} MB")
+            for stat in getattr(self, 'top_allocations', []):
+                lines.append(f"  {stat}")
+
+        if self.cprofile is not None:
+            stream = io.StringIO()
+            pstats.Stats(self.cprofile, stream=stream).sort_stats('cumulative').print_stats(15)
+            lines.append(stream.getvalue().rstrip())
+        return "\n".join(lines)
+
+    def save(self, prefix: str):
+        """Отчет в {prefix}.json и статистика cProfile в {prefix}.prof"""
+        with open(f"{prefix}.json", 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        if self.cprofile is not None:
+            self.cprofile.dump_stats(f"{prefix}.prof")
+
+def phase(name: str):
+    """Фаза активного профилировщика (ничего не делает, если профилирование выключено)"""
+    profiler = _active
+    return profiler.phase(name) if profiler is not None else _NULL
+
+def profile_iter(name: str, iterable):
+    profiler = _active
+    return profiler.iterate(name, iterable) if profiler is not None else iterable
+
+def add_profile_arguments(parser):
+    """Общие для скриптов флаги профилирования"""
+    parser.add_argument('--profile', action='store_true',
+                        help='Report wall-clock time per phase at the end of the run')
+    parser.add_argument('--cprofile', action='store_true',
+                        help='Also collect cProfile statistics (main thread, implies --profile)')
+    parser.add_argument('--trace_memory', action='store_true',
+                        help='Also record tracemalloc peak memory per phase (implies --profile)')
+    parser.add_argument('--profile_output', type=str, default=None,
+                        help='Save the report to PREFIX.json and cProfile stats to PREFIX.prof')
+
+@contextmanager
+def profiling(args):
+    """Профилирование скрипта по флагам add_profile_arguments (без флагов ничего не делает)"""
+    global _active
+    if not (args.profile or args.cprofile or args.trace_memory or args.profile_output):
+        yield None
+        return
+
+    profiler = Profiler(cprofile=args.cprofile, trace_memory=args.trace_memory)
+    _active = profiler
+    profiler.start()
+    try:
+        yield profiler
+    finally:
+        profiler.stop()
+        _active = None
+        # Отчет идет в stderr: stdout может быть потоком результатов (inference.py --output -)
+        print(profiler.report(), file=sys.stderr)
+        if args.profile_output:
+            profiler.save(args.profile_output)
+            logger.info(f"Profile saved to {args.profile_output}.json")
@@ -0,0 +1,190 @@
+import copy
+import string
+
+_FORMATTER = string.Formatter()
+
+# Шаблоны по умолчанию повторяют прежнее форматирование промптов.
+# Сегмент - строка формата или {"text": ..., "if": поле}: условный сегмент
+# выводится только если поле записи непустое. Фигурные скобки в тексте
+# экранируются удвоением, как в str.format.
+DEFAULT_PROMPTS = {
+    # DataProcessor, scripts/test_model.py, scripts/convert_dataset.py
+    'record': [
+        {'text': "System: {system}\n", 'if': 'system'},
+        "Instruction: {instruction}\n",
+        {'text': "Input: {input}\n", 'if': 'input'},
+        "Response:"
+    ],
+    # APITrainer.evaluate
+    'eval': [
+        "Инструкция: {instruction}\n",
+        {'text': "Входные данные: {input}\n", 'if': 'input'},
+        "Ответ:"
+    ],
+    # APITrainer._prepare_sample (заголовок и примеры - общий префикс запросов)
+    'training': {
+        'header': "Ты проходишь дообучение на следующих примерах:\n\n",
+        'example': [
+            "Пример {n}:\n",
+            "Инструкция: {instruction}\n",
+            {'text': "Входные данные: {input}\n", 'if': 'input'},
+            "Ожидаемый ответ: {output}\n\n"
+        ],
+        'query': [
+            "Новый запрос для обучения:\n",
+            "Инструкция: {instruction}\n",
+            {'text': "Входные данные: {input}\n", 'if': 'input'},
+            "Твой ответ должен быть:"
+        ]
+    },
+    # GenerationClient._create_few_shot_prompt
+    'few_shot': {
+        'header': "Ты - помощник, дообученный на следующих примерах:\n\n",
+        'example': [
+            "Пример {n}:\n",
+            "Инструкция: {instruction}\n",
+            {'text': "Вход: {input}\n", 'if': 'input'},
+            "Ответ: {output}\n\n"
+        ],
+        'query': [
+            "Новый запрос:\n",
+            "Инструкция: {instruction}\n",
+            {'text': "Вход: {input}\n", 'if': 'input'},
+            "Ответ:"
+        ]
+    }
+}
+
+class PromptTemplate:
+    """
+    Шаблон промпта, проверенный один раз при создании (string.Formatter.parse).
+    Рендер - str.format_map строки из сегментов, условия которых выполнены;
+    такая строка собирается один раз для каждого набора условий. Текст
+    шаблонов из конфига не компилируется и не выполняется: допускаются только
+    простые имена полей и спецификации формата без вложенных полей.
+    """
+
+    def __init__(self, segments: list, params: tuple = ()):
+        self.segments = segments
+        self.params = tuple(params)
+        self._segments, fields = self._parse(segments)
+        # Поля записи, читаемые при рендере (поля из params передаются аргументами)
+        self._fields = tuple(field for field in fields if field not in self.params)
+        self._conditions = tuple(dict.fromkeys(condition for _, condition in self._segments
+                                               if condition is not None))
+        # Склеенная строка формата для каждого набора выполненных условий
+        self._formats = {}
+
+    @staticmethod
+    def _parse(segments: list) -> tuple:
+        """
+        Проверенные сегменты (текст формата, условие или None) и имена всех
+        используемых полей в порядке появления
+        """
+        parsed = []
+        fields = {}
+        for segment in segments:
+            if isinstance(segment, str):
+                text, condition = segment, None
+            else:
+                text, condition = segment['text'], segment.get('if')
+
+            for _, field, spec, _ in _FORMATTER.parse(text):
+                if field is None:
+                    continue
+                if not field.isidentifier():
+                    raise ValueError(f"Unsupported template field: {field!r}")
+                if spec and '{' in spec:
+                    raise ValueError(f"Nested fields in format specs are not supported: {field}:{spec}")
+                fields[field] = None
+            if condition is not None:
+                if not condition.isidentifier():
+                    raise ValueError(f"Unsupported template condition: {condition!r}")
+                fields[condition] = None
+            parsed.append((text, condition))
+        return parsed, tuple(fields)
+
+    def _format_for(self, key: tuple):
+        """format_map строки из сегментов, условия которых выполнены (key - по _conditions)"""
+        enabled = {condition for condition, on in zip(self._conditions, key) if on}
+        text = ''.join(text for text, condition in self._segments if condition is None or condition in enabled)
+        render = self._formats[key] = text.format_map
+        return render
+
+    def _render(self, item: dict, *args) -> str:
+        """Рендер записи; args - значения полей из params по порядку (например номер примера n)"""
+        get = item.get
+        values = {field: get(field, '') for field in self._fields}
+        if self.params:
+            values.update(zip(self.params, args + ('',) * (len(self.params) - len(args))))
+        key = tuple([not not values[condition] for condition in self._conditions])
+        render = self._formats.get(key) or self._format_for(key)
+        return render(values)
+
+    def render(self, item: dict, **extra) -> str:
+        args = tuple(extra.pop(name, '') for name in self.params)
+        if extra:
+            item = {**item, **extra}
+        return self._render(item, *args)
+
+    def render_many(self, items) -> list:
+        """Рендер набора записей"""
+        render = self._render
+        return [render(item) for item in items]
+
+class FewShotTemplate:
+    """Few-shot промпт: заголовок, пронумерованные примеры и текущий запрос"""
+
+    def __init__(self, header: str, example: list, query: list):
+        self.header = header
+        self.example = PromptTemplate(example, params=('n',))
+        self.query = PromptTemplate(query)
+        self._render_example = self.example._render
+        self._render_query = self.query._render
+        # Блок примеров одинаков для многих запросов (например в режиме first),
+        # поэтому готовый текст запоминается по идентичности объектов примеров
+        self._block_cache = {}
+
+    def render(self, examples: list, current_item: dict) -> str:
+        return self.render_examples(examples) + self._render_query(current_item)
+
+    def render_parts(self, examples: list, current_item: dict) -> tuple:
+        """Общий для многих запросов префикс (заголовок и примеры) и сам запрос"""
+        return self.render_examples(examples), self._render_query(current_item)
+
+    def render_examples(self, examples: list) -> str:
+        """Заголовок и пронумерованные примеры"""
+        examples = tuple(examples)
+        key = tuple(map(id, examples))
+        cached = self._block_cache.get(key)
+        # Ссылки на сами примеры хранятся в кэше, поэтому их id не переиспользуются
+        if cached is not None and cached[0] == examples:
+            return cached[1]
+
+        render_example = self._render_example
+        parts = [self.header]
+        for j, example in enumerate(examples, 1):
+            parts.append(render_example(example, j))
+        block = ''.join(parts)
+
+        if len(self._block_cache) >= 4096:
+            self._block_cache.clear()
+        self._block_cache[key] = (examples, block)
+        return block
+
+class PromptLibrary:
+    """Набор шаблонов проекта с переопределениями из секции prompts конфига"""
+
+    def __init__(self, config: dict = None):
+        prompts = copy.deepcopy(DEFAULT_PROMPTS)
+        overrides = (config or {}).get('prompts') or {}
+        for name, value in overrides.items():
+            if isinstance(value, dict) and isinstance(prompts.get(name), dict):
+                prompts[name].update(value)
+            else:
+                prompts[name] = value
+
+        self.record = PromptTemplate(prompts['record'])
+        self.eval = PromptTemplate(prompts['eval'])
+        self.training = FewShotTemplate(**prompts['training'])
+        self.few_shot = FewShotTemplate(**prompts['few_shot'])
\ No newline at end of file
@@ -0,0 +1,136 @@
+import logging
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+# Статусы, при которых сервер перегружен или временно недоступен
+RETRYABLE_STATUSES = {408, 429, 500, 502, 503, 504}
+OVERLOAD_STATUSES = {429, 503}
+
+class RetryableAPIError(Exception):
+    """Временная ошибка API, запрос стоит повторить"""
+
+    def __init__(self, message: str, status: int = None, retry_after: float = None):
+        super().__init__(message)
+        self.status = status
+        self.retry_after = retry_after
+
+    @property
+    def overloaded(self) -> bool:
+        # Таймауты и обрывы соединения (status=None) тоже считаем признаком перегрузки
+        return self.status is None or self.status in OVERLOAD_STATUSES
+
+def parse_retry_after(value) -> float:
+    """Значение заголовка Retry-After в секундах (число секунд или HTTP-дата)"""
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        retry_at = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if retry_at.tzinfo is None:
+        retry_at = retry_at.replace(tzinfo=timezone.utc)
+    return max(0.0, (retry_at - datetime.now(timezone.utc)).total_seconds())
+
+def backoff_delay(attempt: int, base: float = 1.0, cap: float = 30.0) -> float:
+    """Экспоненциальная задержка с полным джиттером"""
+    return random.uniform(0, min(cap, base * 2 ** attempt))
+
+class AdaptiveLimiter:
+    """
+    Ограничение числа одновременных запросов по схеме AIMD.
+
+    Пока запросы успешны и задержка (на токен ответа, если сервер сообщает
+    usage) не превышает latency_tolerance от лучшей наблюдаемой, лимит
+    растет примерно на 1 за каждые `limit` ответов. При 429/503, таймаутах
+    или росте задержки лимит умножается на decrease_factor (не чаще раза за
+    cooldown). Retry-After приостанавливает выдачу новых разрешений для всех
+    потоков.
+    """
+
+    def __init__(self, initial: float = 4, min_limit: float = 1, max_limit: float = 16,
+                 decrease_factor: float = 0.5, latency_tolerance: float = 3.0, cooldown: float = 1.0):
+        self.limit = float(min(max(initial, min_limit), max_limit))
+        self.min_limit = float(min_limit)
+        self.max_limit = float(max_limit)
+        self.decrease_factor = decrease_factor
+        self.latency_tolerance = latency_tolerance
+        self.cooldown = cooldown
+        self.in_flight = 0
+        self.min_latency = None
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+
+    @classmethod
+    def from_config(cls, config: dict, endpoints: int = 1):
+        """
+        Создание по секции rate_limit конфига (None если выключено).
+        Стартовый лимит и потолок заданы на один сервер и умножаются на
+        число серверов endpoints: каждый сервер добавляет свою долю запросов
+        """
+        rate_config = config.get('rate_limit', {})
+        if not rate_config.get('enabled', True):
+            return None
+
+        per_endpoint = rate_config.get('max_concurrency', config['training'].get('max_concurrency', 4))
+        max_limit = per_endpoint * endpoints
+        return cls(
+            initial=rate_config.get('initial_concurrency', max(1, per_endpoint // 2)) * endpoints,
+            min_limit=rate_config.get('min_concurrency', 1),
+            max_limit=max_limit,
+            decrease_factor=rate_config.get('decrease_factor', 0.5),
+            latency_tolerance=rate_config.get('latency_tolerance', 3.0),
+            cooldown=rate_config.get('cooldown', 1.0)
+        )
+
+    def acquire(self):
+        with self._condition:
+            while True:
+                wait = self._paused_until - time.monotonic()
+                if wait > 0:
+                    self._condition.wait(wait)
+                    continue
+                if self.in_flight < int(self.limit):
+                    self.in_flight += 1
+                    return
+                self._condition.wait()
+
+    def release(self, latency: float = None, success: bool = True, overloaded: bool = False):
+        with self._condition:
+            self.in_flight -= 1
+
+            if overloaded:
+                self._decrease()
+            elif success and latency is not None:
+                if self.min_latency is None or latency < self.min_latency:
+                    self.min_latency = latency
+                if latency > self.min_latency * self.latency_tolerance:
+                    self._decrease()
+                else:
+                    self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+            self._condition.notify_all()
+
+    def pause(self, seconds: float):
+        """Приостановка новых запросов (Retry-After)"""
+        with self._condition:
+            self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+            self._condition.notify_all()
+
+    def _decrease(self):
+        now = time.monotonic()
+        if now - self._last_decrease < self.cooldown:
+            return
+        self._last_decrease = now
+        old_limit = self.limit
+        self.limit = max(self.min_limit, self.limit * self.decrease_factor)
+        logger.info(f"Server under pressure, concurrency limit {old_limit:.1f} -> {self.limit:.1f}")
\ No newline at end of file
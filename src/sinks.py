@@ -0,0 +1,149 @@
+import json
+import logging
+import os
+from abc import ABC, abstractmethod
+from . import jsonl
+from .jsonl import open_text, compression_of
+
+logger = logging.getLogger(__name__)
+
+class ResultSink(ABC):
+    """Запись результатов по одному по мере получения"""
+
+    @abstractmethod
+    def write(self, record: dict):
+        """Запись одного результата"""
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+class JSONLSink(ResultSink):
+    """
+    JSONL, при расширении .gz/.zst - сжатый. flush() сбрасывает сжатые
+    данные до границы блока, так что все записанные строки читаются даже
+    после аварийного завершения.
+    """
+
+    def __init__(self, path: str, append: bool = False):
+        self.path = path
+        self._file = open_text(path, 'a' if append else 'w')
+
+    def write(self, record: dict):
+        self._file.write(jsonl.dumps(record) + '\n')
+
+    def flush(self):
+        self._file.flush()
+
+    def fileno(self):
+        """Дескриптор файла на диске (None, если поток сжатия его не отдает)"""
+        try:
+            return self._file.fileno()
+        except (AttributeError, OSError, ValueError):
+            return None
+
+    def close(self):
+        if not self._file.closed:
+            self._file.close()
+
+class JSONArraySink(ResultSink):
+    """
+    JSON-массив, дописываемый по одной записи. Результат совпадает с
+    json.dump(records, f, ensure_ascii=False, indent=2).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._file = open_text(path, 'w')
+        self._count = 0
+
+    def write(self, record: dict):
+        text = json.dumps(record, ensure_ascii=False, indent=2).replace('\n', '\n  ')
+        self._file.write(('[\n  ' if self._count == 0 else ',\n  ') + text)
+        self._count += 1
+
+    def flush(self):
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self._file.write('\n]' if self._count else '[]')
+        self._file.close()
+
+class ParquetSink(ResultSink):
+    """
+    Parquet для анализа (нужен pyarrow). Записи копятся по batch_size и
+    записываются отдельными группами строк, схема берется из первой группы.
+    """
+
+    def __init__(self, path: str, batch_size: int = 1000):
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError as e:
+            raise ImportError(f"pyarrow is required for {path} (pip install pyarrow)") from e
+
+        self.path = path
+        self.batch_size = batch_size
+        self._pa = pyarrow
+        self._pq = pyarrow.parquet
+        self._writer = None
+        self._schema = None
+        self._buffer = []
+
+    def write(self, record: dict):
+        self._buffer.append(record)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        if not self._buffer:
+            return
+        pa = self._pa
+        if self._schema is None:
+            schema = pa.Table.from_pylist(self._buffer).schema
+            # Поля, пустые во всей первой группе, считаем строковыми
+            self._schema = pa.schema([
+                field.with_type(pa.string()) if pa.types.is_null(field.type) else field
+                for field in schema
+            ])
+            self._writer = self._pq.ParquetWriter(self.path, self._schema, compression='zstd')
+        self._writer.write_table(pa.Table.from_pylist(self._buffer, schema=self._schema))
+        self._buffer = []
+
+    def close(self):
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+        elif self._schema is None and not os.path.exists(self.path):
+            # Пустой результат - пустой файл без колонок
+            self._pq.write_table(self._pa.table({}), self.path)
+            self._schema = self._pa.schema([])
+
+# Форматы результатов оценки: расширение файла -> класс записи
+SINK_FORMATS = {
+    'json': JSONArraySink,
+    'jsonl': JSONLSink,
+    'jsonl.gz': JSONLSink,
+    'jsonl.zst': JSONLSink,
+    'parquet': ParquetSink
+}
+
+def open_sink(path: str, fmt: str = None) -> ResultSink:
+    """Запись результатов в формате fmt (по умолчанию по расширению path)"""
+    if fmt is None:
+        fmt = next((name for name in sorted(SINK_FORMATS, key=len, reverse=True)
+                    if path.endswith('.' + name)), None)
+    if fmt not in SINK_FORMATS:
+        raise ValueError(f"Unknown result format for {path}: {fmt}")
+    return SINK_FORMATS[fmt](path)
@@ -0,0 +1,281 @@
+import json
+import logging
+import math
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+class LatencyHistogram:
+    """
+    Гистограмма задержек с логарифмическими корзинами (шаг 5%): память не
+    растет с числом запросов, а квантили точны до половины шага корзины.
+    """
+
+    def __init__(self, min_value: float = 0.001, max_value: float = 3600.0, ratio: float = 1.05):
+        self.min_value = min_value
+        self.log_ratio = math.log(ratio)
+        self.buckets = [0] * (int(math.log(max_value / min_value) / self.log_ratio) + 2)
+        self.count = 0
+        self.sum = 0.0
+        self.max = 0.0
+
+    def observe(self, value: float):
+        if value <= self.min_value:
+            index = 0
+        else:
+            index = min(len(self.buckets) - 1, int(math.log(value / self.min_value) / self.log_ratio) + 1)
+        self.buckets[index] += 1
+        self.count += 1
+        self.sum += value
+        self.max = max(self.max, value)
+
+    def quantile(self, q: float) -> float:
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for index, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n:
+                if index == 0:
+                    return self.min_value
+                # Середина корзины в логарифмической шкале
+                value = self.min_value * math.exp((index - 0.5) * self.log_ratio)
+                return min(value, self.max)
+        return self.max
+
+class APIMetrics:
+    """
+    Счетчики и задержки запросов к API: HTTP-запросы (make_api_request и
+    stream_api_request), вызовы LMStudioClient.generate целиком (с кэшем и
+    повторами), повторы, ошибки, токены из поля usage, причины завершения
+    ответов (finish_reason: length - обрезан по max_tokens) и число запросов
+    в работе.
+    """
+
+    QUANTILES = (0.5, 0.95, 0.99)
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.started = time.time()
+        self.request_latency = LatencyHistogram()
+        self.generate_latency = LatencyHistogram()
+        self.requests = 0
+        self.errors = {}
+        self.retries = 0
+        self.failed_generations = 0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.cached_prompt_tokens = 0
+        self.finish_reasons = {}
+        self.timed_completion_tokens = 0
+        self.timed_completion_seconds = 0.0
+        self.in_flight = 0
+        self.max_in_flight = 0
+
+    def request_started(self):
+        with self._lock:
+            self.in_flight += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
+
+    def request_finished(self, latency: float, usage: dict = None, error: str = None):
+        """
+        Завершение HTTP-запроса. error - вид ошибки (например 'http_429' или
+        'connection'), usage - поле usage ответа сервера.
+        """
+        with self._lock:
+            self.in_flight -= 1
+        self.record_request(latency, usage, error)
+
+    def record_request(self, latency: float, usage: dict = None, error: str = None):
+        """Запрос, выполненный вне процесса (демоном инференса): без учета in-flight"""
+        with self._lock:
+            self.requests += 1
+            self.request_latency.observe(latency)
+            if error is not None:
+                self.errors[error] = self.errors.get(error, 0) + 1
+            if usage:
+                completion_tokens = usage.get('completion_tokens') or 0
+                self.prompt_tokens += usage.get('prompt_tokens') or 0
+                self.completion_tokens += completion_tokens
+                self.cached_prompt_tokens += (usage.get('prompt_tokens_details') or {}).get('cached_tokens') or 0
+                if completion_tokens:
+                    self.timed_completion_tokens += completion_tokens
+                    self.timed_completion_seconds += latency
+
+    def record_in_flight(self, in_flight: int):
+        """
+        Число запросов в работе, замеренное вне процесса (демоном инференса
+        при старте запроса этого клиента): учитывается только пик
+        """
+        with self._lock:
+            self.max_in_flight = max(self.max_in_flight, in_flight)
+
+    def record_finish_reasons(self, reasons: list):
+        with self._lock:
+            for reason in reasons:
+                reason = reason or 'unknown'
+                self.finish_reasons[reason] = self.finish_reasons.get(reason, 0) + 1
+
+    def record_retry(self):
+        with self._lock:
+            self.retries += 1
+
+    def record_generation(self, latency: float, success: bool = True):
+        with self._lock:
+            self.generate_latency.observe(latency)
+            if not success:
+                self.failed_generations += 1
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            elapsed = max(time.time() - self.started, 1e-9)
+            return {
+                "uptime_seconds": elapsed,
+                "requests_total": self.requests,
+                "errors_total": sum(self.errors.values()),
+                "errors": dict(self.errors),
+                "retries_total": self.retries,
+                "generations_total": self.generate_latency.count,
+                "failed_generations_total": self.failed_generations,
+                "in_flight": self.in_flight,
+                "max_in_flight": self.max_in_flight,
+                "prompt_tokens_total": self.prompt_tokens,
+                "completion_tokens_total": self.completion_tokens,
+                "cached_prompt_tokens_total": self.cached_prompt_tokens,
+                "finish_reasons": dict(self.finish_reasons),
+                "truncated_total": self.finish_reasons.get('length', 0),
+                # Общая пропускная способность и скорость генерации одного запроса
+                "throughput_tokens_per_second": self.completion_tokens / elapsed,
+                "decode_tokens_per_second": (self.timed_completion_tokens / self.timed_completion_seconds
+                                             if self.timed_completion_seconds else 0.0),
+                "request_latency": self._latency(self.request_latency),
+                "generate_latency": self._latency(self.generate_latency)
+            }
+
+    def _latency(self, histogram: LatencyHistogram) -> dict:
+        latency = {f"p{int(q * 100)}": histogram.quantile(q) for q in self.QUANTILES}
+        latency.update(count=histogram.count, sum=histogram.sum, max=histogram.max)
+        return latency
+
+    def to_prometheus(self, prefix: str = 'lmstudio') -> str:
+        """Снимок в текстовом формате Prometheus"""
+        data = self.snapshot()
+        lines = []
+
+        def metric(name, kind, value, help_text, labels=None):
+            lines.append(f"# HELP {prefix}_{name} {help_text}")
+            lines.append(f"# TYPE {prefix}_{name} {kind}")
+            for label, label_value in (labels or {None: value}).items():
+                suffix = f'{{{label}}}' if label else ''
+                lines.append(f"{prefix}_{name}{suffix} {label_value}")
+
+        for kind in ('request', 'generate'):
+            latency = data[f"{kind}_latency"]
+            name = f"{kind}_latency_seconds"
+            quantiles = {f'quantile="{q}"': latency[f"p{int(q * 100)}"] for q in self.QUANTILES}
+            metric(name, 'summary', None, f"Latency of API {kind} calls", quantiles)
+            lines.append(f"{prefix}_{name}_sum {latency['sum']}")
+            lines.append(f"{prefix}_{name}_count {latency['count']}")
+
+        metric('requests_total', 'counter', data['requests_total'], "HTTP requests sent to the API")
+        errors = {f'kind="{kind}"': n for kind, n in sorted(data['errors'].items())}
+        if errors:
+            metric('errors_total', 'counter', None, "Failed HTTP requests by kind", errors)
+        metric('retries_total', 'counter', data['retries_total'], "Retried generation attempts")
+        metric('failed_generations_total', 'counter', data['failed_generations_total'],
+               "Generations that returned no response")
+        metric('in_flight_requests', 'gauge', data['in_flight'], "HTTP requests in progress")
+        metric('max_in_flight_requests', 'gauge', data['max_in_flight'], "Peak HTTP requests in progress")
+        metric('prompt_tokens_total', 'counter', data['prompt_tokens_total'], "Prompt tokens reported by usage")
+        metric('completion_tokens_total', 'counter', data['completion_tokens_total'],
+               "Completion tokens reported by usage")
+        metric('cached_prompt_tokens_total', 'counter', data['cached_prompt_tokens_total'],
+               "Prompt tokens served from the server prompt cache")
+        reasons = {f'reason="{reason}"': n for reason, n in sorted(data['finish_reasons'].items())}
+        if reasons:
+            metric('completions_total', 'counter', None, "Completions by finish reason", reasons)
+        metric('throughput_tokens_per_second', 'gauge', data['throughput_tokens_per_second'],
+               "Completion tokens per second of wall time")
+        metric('decode_tokens_per_second', 'gauge', data['decode_tokens_per_second'],
+               "Completion tokens per second of request time")
+        return "\n".join(lines) + "\n"
+
+    def summary(self) -> str:
+        data = self.snapshot()
+        request = data['request_latency']
+        completions = sum(data['finish_reasons'].values())
+        truncated = f" ({data['truncated_total'] / completions:.1%} truncated)" if completions else ""
+        return (f"API metrics: {data['requests_total']} requests, {data['errors_total']} errors, "
+                f"{data['retries_total']} retries, max in-flight {data['max_in_flight']}; "
+                f"latency p50 {request['p50']:.2f}s, p95 {request['p95']:.2f}s, p99 {request['p99']:.2f}s; "
+                f"{data['completion_tokens_total']} completion tokens{truncated}, "
+                f"{data['throughput_tokens_per_second']:.1f} tok/s overall, "
+                f"{data['decode_tokens_per_second']:.1f} tok/s per request")
+
+class MetricsFlusher:
+    """Периодическая запись снимка метрик в файл (Prometheus или JSON) в фоновом потоке"""
+
+    FORMATS = ('prometheus', 'json')
+
+    def __init__(self, metrics: APIMetrics, path: str, fmt: str = 'prometheus', interval: float = 10.0):
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Unknown metrics format: {fmt}")
+        self.metrics = metrics
+        self.path = path
+        self.format = fmt
+        self.interval = interval
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='metrics-flusher', daemon=True)
+        self._thread.start()
+
+    def _run(self):
+        while not self._stop.wait(self.interval):
+            self.flush()
+
+    def flush(self):
+        if self.format == 'json':
+            text = json.dumps(self.metrics.snapshot(), indent=2)
+        else:
+            text = self.metrics.to_prometheus()
+
+        # Атомарная замена: читатель (например node_exporter) не увидит половину файла
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        try:
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                f.write(text)
+            os.replace(tmp_path, self.path)
+        except OSError as e:
+            logger.warning(f"Failed to write metrics to {self.path}: {e}")
+
+    def close(self):
+        self._stop.set()
+        self._thread.join()
+        self.flush()
+
+def create_metrics(config: dict):
+    """
+    Метрики API и фоновая запись в файл по секции metrics конфига.
+    Возвращает (APIMetrics, MetricsFlusher или None), либо (None, None) если выключено.
+    """
+    metrics_config = config.get('metrics', {})
+    if not metrics_config.get('enabled', True):
+        return None, None
+
+    metrics = APIMetrics()
+    path = metrics_config.get('path')
+    if not path:
+        return metrics, None
+
+    flusher = MetricsFlusher(
+        metrics,
+        path,
+        fmt=metrics_config.get('format', 'prometheus'),
+        interval=metrics_config.get('flush_interval', 10.0)
+    )
+    return metrics, flusher
@@ -0,0 +1,257 @@
+import logging
+import math
+import threading
+from functools import lru_cache
+from itertools import islice
+
+logger = logging.getLogger(__name__)
+
+class TokenBudgetError(ValueError):
+    """Промпт не помещается в бюджет токенов даже после сокращения"""
+
+@lru_cache(maxsize=None)
+def load_tokenizer(name: str):
+    """Загрузка токенизатора transformers один раз на процесс (None если недоступен)"""
+    try:
+        from transformers import AutoTokenizer
+    except ImportError:
+        logger.warning("transformers is not installed, using approximate token counting")
+        return None
+
+    try:
+        return AutoTokenizer.from_pretrained(name)
+    except Exception as e:
+        logger.warning(f"Failed to load tokenizer {name}: {e}. Using approximate token counting")
+        return None
+
+class TokenCounter:
+    """
+    Подсчет токенов: настоящим токенизатором, если он задан и доступен,
+    иначе быстрой оценкой по числу символов. Результаты кэшируются, так как
+    заголовки и few-shot примеры повторяются во многих промптах.
+    """
+
+    def __init__(self, tokenizer_name: str = None, chars_per_token: float = 3.0, cache_size: int = 65536):
+        self.tokenizer = load_tokenizer(tokenizer_name) if tokenizer_name else None
+        self.chars_per_token = chars_per_token
+        self.count = lru_cache(maxsize=cache_size)(self._count)
+
+    @property
+    def approximate(self) -> bool:
+        return self.tokenizer is None
+
+    def _count(self, text: str) -> int:
+        if not text:
+            return 0
+        if self.tokenizer is not None:
+            return len(self.tokenizer.encode(text, add_special_tokens=False))
+        return math.ceil(len(text) / self.chars_per_token)
+
+    def truncate(self, text: str, max_tokens: int) -> str:
+        """Обрезка текста до max_tokens токенов"""
+        if max_tokens <= 0:
+            return ''
+        if self.count(text) <= max_tokens:
+            return text
+        if self.tokenizer is not None:
+            ids = self.tokenizer.encode(text, add_special_tokens=False)[:max_tokens]
+            return self.tokenizer.decode(ids)
+        return text[:int(max_tokens * self.chars_per_token)]
+
+class TokenBudget:
+    """
+    Соблюдение max_tokens_per_sample до отправки запроса: слишком длинные
+    записи обрезаются (сначала input, затем instruction) или отбрасываются,
+    а few-shot примеры убираются с конца, пока промпт не поместится.
+    """
+
+    TRUNCATE_FIELDS = ('input', 'instruction')
+
+    def __init__(self, config: dict, counter: TokenCounter = None):
+        data_config = config['data']
+        self.max_tokens = data_config['max_tokens_per_sample']
+        self.overflow = data_config.get('overflow', 'truncate')
+        if self.overflow not in ('truncate', 'drop'):
+            raise ValueError(f"Unknown overflow policy: {self.overflow}")
+
+        self.counter = counter or TokenCounter(
+            data_config.get('tokenizer'),
+            chars_per_token=data_config.get('chars_per_token', 3.0)
+        )
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self.stats = {
+                'records_truncated': 0,
+                'records_dropped': 0,
+                'examples_dropped': 0,
+                'tokens_saved': 0
+            }
+
+    def _add(self, **deltas):
+        with self._lock:
+            for key, value in deltas.items():
+                self.stats[key] += value
+
+    def fit_record(self, item: dict, render):
+        """
+        Запись, чей промпт render(item) помещается в бюджет, или None если
+        запись отброшена.
+        """
+        tokens = self.counter.count(render(item))
+        if tokens <= self.max_tokens:
+            return item
+
+        if self.overflow == 'drop':
+            self._add(records_dropped=1, tokens_saved=tokens)
+            return None
+
+        item = dict(item)
+        for field in self.TRUNCATE_FIELDS:
+            # Подсчет по частям не аддитивен, поэтому при необходимости повторяем
+            for _ in range(3):
+                excess = self.counter.count(render(item)) - self.max_tokens
+                value = item.get(field) or ''
+                if excess <= 0 or not value:
+                    break
+                item[field] = self.counter.truncate(value, self.counter.count(value) - max(excess, 1))
+
+        new_tokens = self.counter.count(render(item))
+        if new_tokens > self.max_tokens:
+            self._add(records_dropped=1, tokens_saved=tokens)
+            return None
+
+        self._add(records_truncated=1, tokens_saved=tokens - new_tokens)
+        return item
+
+    def fit_examples(self, examples: list, current_item: dict, template) -> list:
+        """
+        Few-shot примеры, с которыми промпт template.render(examples, current_item)
+        помещается в бюджет. Примеры убираются с конца.
+        """
+        query_tokens = self.counter.count(template.query.render(current_item))
+        header_tokens = self.counter.count(template.header)
+        example_tokens = [self.counter.count(template.example.render(example, n=j + 1))
+                          for j, example in enumerate(examples)]
+
+        total = header_tokens + sum(example_tokens) + query_tokens
+        if total <= self.max_tokens:
+            return examples
+
+        kept = list(examples)
+        saved = 0
+        while kept and total > self.max_tokens:
+            kept.pop()
+            removed = example_tokens[len(kept)]
+            total -= removed
+            saved += removed
+
+        if total > self.max_tokens:
+            self._add(records_dropped=1, examples_dropped=len(examples), tokens_saved=total + saved)
+            raise TokenBudgetError(
+                f"Prompt needs {total} tokens without examples, budget is {self.max_tokens}"
+            )
+
+        self._add(examples_dropped=len(examples) - len(kept), tokens_saved=saved)
+        return kept
+
+    def summary(self) -> str:
+        stats = self.stats
+        kind = "approx" if self.counter.approximate else "tokenizer"
+        return (f"Token budget {self.max_tokens} ({kind}): {stats['records_truncated']} truncated, "
+                f"{stats['records_dropped']} dropped, {stats['examples_dropped']} few-shot examples dropped, "
+                f"{stats['tokens_saved']} tokens saved")
+
+
+class LengthPolicy:
+    """
+    max_tokens каждого запроса. Политика fixed - всегда max_tokens.
+    Политика reference - по распределению длины эталонных ответов (fit):
+    quantile длин, умноженная на factor, в пределах [min_tokens, max_tokens].
+    Для запроса с известным эталоном (обучение) лимит не меньше factor * его
+    длины, чтобы длинные ответы не обрезались, а зацикленные генерации не
+    тянулись до max_tokens.
+    """
+
+    POLICIES = ('fixed', 'reference')
+
+    def __init__(self, max_tokens: int = 2048, policy: str = 'fixed', quantile: float = 0.95,
+                 factor: float = 1.5, min_tokens: int = 16, sample_size: int = 10000,
+                 counter: TokenCounter = None):
+        if policy not in self.POLICIES:
+            raise ValueError(f"Unknown generation length policy: {policy}")
+        if not 0 < quantile <= 1:
+            raise ValueError(f"Length quantile must be in (0, 1], got {quantile}")
+        self.max_tokens = max_tokens
+        self.policy = policy
+        self.quantile = quantile
+        self.factor = factor
+        self.min_tokens = min(min_tokens, max_tokens)
+        self.sample_size = sample_size
+        self.counter = counter or TokenCounter()
+        # Лимит для запросов без эталона, до fit - max_tokens
+        self.default = max_tokens
+        self.fitted = False
+
+    @classmethod
+    def from_config(cls, config: dict, counter: TokenCounter = None):
+        generation = config.get('generation', {})
+        data_config = config.get('data', {})
+        return cls(
+            max_tokens=generation.get('max_tokens', 2048),
+            policy=generation.get('length_policy', 'fixed'),
+            quantile=generation.get('length_quantile', 0.95),
+            factor=generation.get('length_factor', 1.5),
+            min_tokens=generation.get('min_tokens', 16),
+            sample_size=generation.get('length_sample_size', 10000),
+            counter=counter or TokenCounter(
+                data_config.get('tokenizer'),
+                chars_per_token=data_config.get('chars_per_token', 3.0)
+            )
+        )
+
+    def _clamp(self, tokens: float) -> int:
+        return max(self.min_tokens, min(self.max_tokens, math.ceil(tokens)))
+
+    def fit(self, references) -> int:
+        """
+        Лимит по первым sample_size эталонным ответам (пустые не учитываются).
+        Возвращает лимит для запросов без эталона.
+        """
+        if self.policy == 'fixed':
+            return self.default
+        lengths = sorted(self.counter.count(reference) for reference in
+                         islice((r for r in references if r), self.sample_size))
+        if not lengths:
+            logger.warning("No reference outputs to fit the generation length policy, using max_tokens")
+            return self.default
+
+        quantile = lengths[min(len(lengths) - 1, max(0, math.ceil(self.quantile * len(lengths)) - 1))]
+        self.default = self._clamp(quantile * self.factor)
+        self.fitted = True
+        logger.info(f"Generation length: q{self.quantile:g} of {len(lengths)} reference outputs is "
+                    f"{quantile} tokens, max_tokens {self.default}")
+        return self.default
+
+    def limit(self, reference: str = None) -> int:
+        """max_tokens запроса, reference - эталонный ответ, если он известен"""
+        if self.policy == 'fixed':
+            return self.max_tokens
+        if reference:
+            return max(self.default, self._clamp(self.counter.count(reference) * self.factor))
+        return self.default
+
+    def report(self, finish_reasons: dict = None) -> str:
+        """Лимит и доля ответов, обрезанных по max_tokens (finish_reason length)"""
+        if self.policy == 'fixed':
+            text = f"Generation length: max_tokens {self.max_tokens}"
+        else:
+            text = (f"Generation length (q{self.quantile:g} x {self.factor:g} of reference outputs): "
+                    f"max_tokens {self.default}, up to {self.max_tokens} for long references")
+        total = sum((finish_reasons or {}).values())
+        if total:
+            truncated = finish_reasons.get('length', 0)
+            text += f"; {truncated} of {total} completions truncated ({truncated / total:.1%})"
+        return text
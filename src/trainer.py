@@ -1,142 +1,417 @@
 import logging
 import json
+import os
 import time
 from datetime import datetime
+from itertools import islice, tee
 from tqdm import tqdm
-from .utils import save_checkpoint, load_checkpoint
-from .model_utils import LMStudioClient
+from .utils import iter_checkpoint, checkpoint_progress, seek_checkpoint_progress, CheckpointWriter
+from .daemon import create_client
+from .async_engine import AsyncGenerationEngine
+from .example_index import ExampleIndex
+from .prompts import PromptLibrary
+from .tokens import TokenBudget
+from .metrics import compute_metrics, ScoreAccumulator, METRIC_NAMES
+from .sinks import open_sink, compression_of
+from .profiling import phase, profile_iter
+from .scheduler import PrefixScheduler
 
 logger = logging.getLogger(__name__)
 
 class APITrainer:
     def __init__(self, config: dict):
         self.config = config
-        self.client = LMStudioClient(config)
-        self.checkpoint_path = f"{config['training']['output_dir']}/checkpoint.jsonl"
+        # Через InferenceDaemon, если он включен и запущен
+        self.client = create_client(config)
+        training_config = config['training']
+        # Формат чекпоинта: jsonl, jsonl.gz или jsonl.zst
+        self.checkpoint_path = f"{training_config['output_dir']}/checkpoint.{training_config.get('checkpoint_format', 'jsonl')}"
+        # Промпт восстанавливается по записи и примерам, хранить его в чекпоинте необязательно
+        self.checkpoint_prompts = training_config.get('checkpoint_store_prompt', True)
+        # Формат результатов оценки: json, jsonl, jsonl.gz, jsonl.zst или parquet
+        self.eval_format = training_config.get('eval_format', 'json')
+        self.execution_mode = config['training'].get('execution_mode', 'sync')
+        # Ответы всех эпох за один проход: n вариантов на один промпт
+        self.multi_sample = training_config.get('multi_sample', False)
+        self.prompts = PromptLibrary(config)
+        self.budget = TokenBudget(config)
+        # Порядок запросов с учетом кэша промптов сервера (секция scheduling)
+        self.scheduler = PrefixScheduler.from_config(config, self.budget.counter)
+        # Общий префикс промпта: отдельное system-сообщение или начало единого user-сообщения
+        self.prefix_role = config.get('scheduling', {}).get('prefix_role', 'user')
+        if self.prefix_role not in ('system', 'user'):
+            raise ValueError(f"Unknown prefix role: {self.prefix_role}")
+        self._example_index = None
+        self._example_index_source = None
     
-    def train(self, train_data: list, eval_data: list = None):
-        """Процесс обучения через API"""
+    def train(self, train_data, eval_data=None, return_results: bool = True):
+        """
+        Процесс обучения через API.
+        train_data может быть списком или ленивым StreamingDataset.
+        При return_results=False результаты не накапливаются в памяти
+        (они уже есть в чекпоинте) и возвращается только их количество.
+        """
         logger.info("Starting API-based training simulation")
         
-        results = []
+        results = [] if return_results else None
+        processed = 0
+        num_train = len(train_data)
         start_time = datetime.now()
         
-        # Загрузка чекпоинта если есть
-        checkpoint_data = load_checkpoint(self.checkpoint_path)
-        if checkpoint_data:
-            results.extend(checkpoint_data)
-            logger.info(f"Loaded checkpoint with {len(checkpoint_data)} samples")
+        # Загрузка чекпоинта если есть (один проход по файлу)
+        num_loaded = 0
+        def read_checkpoint():
+            nonlocal num_loaded
+            for item in iter_checkpoint(self.checkpoint_path):
+                num_loaded += 1
+                if return_results:
+                    results.append(item)
+                yield item
         
-        # Обработка данных
-        for epoch in range(self.config['training']['num_train_epochs']):
-            logger.info(f"Starting epoch {epoch + 1}")
-            
-            epoch_results = self._process_epoch(epoch + 1, train_data, len(results))
-            results.extend(epoch_results)
-            
-            # Сохранение чекпоинта
-            save_checkpoint(results, self.checkpoint_path)
-            logger.info(f"Checkpoint saved after epoch {epoch + 1}")
-            
-            # Оценка если есть eval данные
-            if eval_data:
-                self.evaluate(eval_data, epoch + 1)
+        with phase('checkpoint_io'):
+            if not return_results and not compression_of(self.checkpoint_path):
+                # Результаты не нужны: эпохи и индексы читаются из начала строк без разбора записей
+                num_loaded, progress = seek_checkpoint_progress(self.checkpoint_path)
+            else:
+                progress = checkpoint_progress(read_checkpoint())
+        if num_loaded:
+            processed += num_loaded
+            logger.info(f"Loaded checkpoint with {num_loaded} samples")
+        
+        # max_tokens запросов по длине эталонных ответов обучающих данных
+        self.client.lengths.fit(item.get('output', '') for item in train_data)
+        
+        num_epochs = self.config['training']['num_train_epochs']
+        fsync_every = self.config['training'].get('checkpoint_fsync_every', 50)
+        with CheckpointWriter(self.checkpoint_path, fsync_every) as writer:
+            if self.multi_sample:
+                processed += self._train_multi_sample(train_data, eval_data, progress, writer, results)
+            else:
+                # Обработка данных
+                for epoch in range(1, num_epochs + 1):
+                    # Продолжаем с примера, следующего за последним сохраненным в этой эпохе
+                    start_idx = progress.get(epoch, -1) + 1
+                    
+                    if start_idx >= num_train:
+                        logger.info(f"Epoch {epoch} already completed in checkpoint, skipping")
+                    else:
+                        if start_idx:
+                            logger.info(f"Resuming epoch {epoch} from sample {start_idx}")
+                        else:
+                            logger.info(f"Starting epoch {epoch}")
+                        
+                        processed += self._process_epoch([epoch], train_data, start_idx, writer, results)
+                        writer.sync()
+                        logger.info(f"Checkpoint synced after epoch {epoch}")
+                    
+                    # Оценка если есть eval данные
+                    if eval_data and not os.path.exists(self._eval_path(epoch)):
+                        self.evaluate(eval_data, epoch, return_results=False)
         
         training_time = datetime.now() - start_time
         logger.info(f"Training completed in {training_time}")
+        logger.info(self.budget.summary())
         
-        return results
+        if self.client.cache is not None:
+            stats = self.client.cache.stats()
+            logger.info(f"Response cache: {stats['hits']} hits, {stats['misses']} misses "
+                        f"(hit rate {stats['hit_rate']:.1%})")
+        
+        return results if return_results else processed
     
-    def _process_epoch(self, epoch: int, data: list, start_idx: int = 0):
-        """Обработка одной эпохи"""
-        results = []
-        
-        for i, item in enumerate(tqdm(data[start_idx:], desc=f"Epoch {epoch}")):
-            try:
-                # Создаем промпт для few-shot обучения
-                prompt = self._create_training_prompt(data, item)
-                
-                # Генерируем ответ
-                response = self.client.generate(prompt)
-                
-                result = {
-                    "epoch": epoch,
-                    "index": start_idx + i,
-                    "original_instruction": item.get('instruction', ''),
-                    "original_input": item.get('input', ''),
-                    "original_output": item.get('output', ''),
-                    "generated_prompt": prompt,
-                    "generated_response": response,
-                    "timestamp": datetime.now().isoformat()
-                }
-                
-                results.append(result)
-                
-                # Логирование прогресса
-                if (i + 1) % self.config['training']['logging_steps'] == 0:
-                    logger.info(f"Epoch {epoch}: Processed {i + 1}/{len(data)} samples")
-                
-                # Пауза чтобы не перегружать API
-                time.sleep(0.5)
-                
-            except Exception as e:
-                logger.error(f"Error processing sample {i}: {e}")
-                continue
+    def _train_multi_sample(self, train_data, eval_data, progress: dict, writer: CheckpointWriter, results: list = None) -> int:
+        """
+        Все незавершенные эпохи за один проход по данным: на каждую запись
+        один запрос с n вариантами ответа (n - число эпох, которым запись еще
+        нужна), вариант k становится результатом k-й из этих эпох. Префикс
+        промпта обрабатывается сервером один раз на запись, а не на каждую эпоху.
+        """
+        num_train = len(train_data)
+        epochs = []
+        for epoch in range(1, self.config['training']['num_train_epochs'] + 1):
+            if progress.get(epoch, -1) + 1 >= num_train:
+                logger.info(f"Epoch {epoch} already completed in checkpoint, skipping")
+            else:
+                epochs.append(epoch)
+        
+        processed = 0
+        if epochs:
+            start_idx = min(progress.get(epoch, -1) for epoch in epochs) + 1
+            logger.info(f"Sampling epochs {', '.join(map(str, epochs))} together"
+                        + (f", resuming from sample {start_idx}" if start_idx else ""))
+            processed = self._process_epoch(epochs, train_data, start_idx, writer, results, progress)
+            writer.sync()
+            logger.info(f"Checkpoint synced after epochs {', '.join(map(str, epochs))}")
+        
+        # Оценка после генерации всех эпох
+        if eval_data:
+            for epoch in range(1, self.config['training']['num_train_epochs'] + 1):
+                if not os.path.exists(self._eval_path(epoch)):
+                    self.evaluate(eval_data, epoch, return_results=False)
+        return processed
+    
+    def _process_epoch(self, epochs: list, data, start_idx: int = 0, writer: CheckpointWriter = None,
+                       results: list = None, completed: dict = None) -> int:
+        """
+        Обработка эпох epochs (обычно одной), каждый результат сразу
+        дописывается в чекпоинт. Для нескольких эпох запись получает по
+        одному ответу на каждую эпоху, которой она еще нужна (completed -
+        последний сохраненный индекс эпохи), из одного запроса. Запросы
+        отправляются в порядке PrefixScheduler, результаты пишутся в порядке
+        данных. Возвращает количество записанных результатов.
+        """
+        processed = 0
+        num_samples = len(data)
+        completed = completed or {}
+        example_index = self._get_example_index(data)
+        request_delay = self.config['training'].get('request_delay', 0)
+        name = f"Epoch {epochs[0]}" if len(epochs) == 1 else f"Epochs {epochs[0]}-{epochs[-1]}"
+        progress = tqdm(total=num_samples - start_idx, desc=name)
+        
+        self.scheduler.reset()
+        metrics = self.client.metrics
+        before = metrics.snapshot() if metrics is not None else None
+        items = enumerate(islice(data, start_idx, None), start_idx)
+        requests = self.scheduler.schedule(
+            ((index, item, self._prepare_sample(item, example_index)) for index, item in items),
+            key=lambda request: request[2][0] if isinstance(request[2], tuple) else None
+        )
+        
+        def work(scheduled):
+            _, hit, (index, item, parts) = scheduled
+            if isinstance(parts, Exception):
+                raise parts
+            needed = [epoch for epoch in epochs if completed.get(epoch, -1) < index]
+            start = time.perf_counter()
+            result = self._process_sample(needed, index, item, parts=parts)
+            self.scheduler.observe(hit, time.perf_counter() - start)
+            return result
         
-        return results
+        def collect(i, scheduled, result):
+            nonlocal processed
+            progress.update(1)
+            index = scheduled[2][0]
+            if isinstance(result, Exception):
+                logger.error(f"Error processing sample {index}: {result}")
+                return
+            
+            for record in result:
+                processed += 1
+                if results is not None:
+                    results.append(record)
+                if writer is not None:
+                    writer.write(self._checkpoint_record(record))
+            if (i + 1) % self.config['training']['logging_steps'] == 0:
+                logger.info(f"{name}: Processed {i + 1}/{num_samples} samples")
+        
+        on_result = self.scheduler.ordered(collect)
+        try:
+            if self.execution_mode == 'async':
+                # Потоков столько, сколько разрешает потолок лимитера, темп задает сам лимитер
+                engine = AsyncGenerationEngine(self.client.max_concurrency)
+                engine.run(work, requests, on_result=on_result)
+            else:
+                for i, scheduled in enumerate(requests):
+                    try:
+                        result = work(scheduled)
+                    except Exception as e:
+                        result = e
+                    on_result(i, scheduled, result)
+                    # Фиксированная пауза (по умолчанию нет: темп задает AdaptiveLimiter)
+                    if request_delay:
+                        time.sleep(request_delay)
+        finally:
+            progress.close()
+        
+        if metrics is not None:
+            after = metrics.snapshot()
+            logger.info(self.scheduler.report(after['cached_prompt_tokens_total'] - before['cached_prompt_tokens_total']))
+            logger.info(self.client.lengths.report(self._finish_reasons_since(before, after)))
+        else:
+            logger.info(self.scheduler.report())
+        return processed
+    
+    @staticmethod
+    def _finish_reasons_since(before: dict, after: dict) -> dict:
+        """Причины завершения ответов между двумя снимками метрик"""
+        return {reason: count - before['finish_reasons'].get(reason, 0)
+                for reason, count in after['finish_reasons'].items()}
+    
+    def _checkpoint_record(self, result: dict) -> dict:
+        """Запись чекпоинта (без промпта, если checkpoint_store_prompt выключен)"""
+        if self.checkpoint_prompts:
+            return result
+        return {key: value for key, value in result.items() if key != 'generated_prompt'}
     
-    def _create_training_prompt(self, data: list, current_item: dict, num_examples: int = 2):
-        """Создание обучающего промпта с примерами"""
-        prompt = "Ты проходишь дообучение на следующих примерах:\n\n"
-        
-        # Добавляем примеры из данных (исключая текущий)
-        examples = []
-        for item in data:
-            if item != current_item and len(examples) < num_examples:
-                examples.append(item)
-        
-        for j, example in enumerate(examples):
-            prompt += f"Пример {j + 1}:\n"
-            prompt += f"Инструкция: {example.get('instruction', '')}\n"
-            if example.get('input'):
-                prompt += f"Входные данные: {example.get('input', '')}\n"
-            prompt += f"Ожидаемый ответ: {example.get('output', '')}\n\n"
-        
-        # Добавляем текущий запрос
-        prompt += "Новый запрос для обучения:\n"
-        prompt += f"Инструкция: {current_item.get('instruction', '')}\n"
-        if current_item.get('input'):
-            prompt += f"Входные данные: {current_item.get('input', '')}\n"
-        prompt += "Твой ответ должен быть:"
-        
-        return prompt
+    def _get_example_index(self, data) -> ExampleIndex:
+        """Индекс few-shot примеров, строится один раз для набора данных"""
+        if self._example_index is None or self._example_index_source is not data:
+            self._example_index = ExampleIndex.from_config(self.config, data)
+            self._example_index_source = data
+        return self._example_index
+    
+    def _prepare_sample(self, item: dict, example_index: ExampleIndex):
+        """
+        Общий префикс (заголовок и few-shot примеры) и запрос для записи.
+        Ошибка (например TokenBudgetError) возвращается, а не поднимается:
+        одна неудачная запись не должна останавливать чтение эпохи.
+        """
+        try:
+            with phase('prompt_build'):
+                examples = self.budget.fit_examples(example_index.select(item), item, self.prompts.training)
+                prefix, query = self.prompts.training.render_parts(examples, item)
+        except Exception as e:
+            return e
+        counter = self.budget.counter
+        self.scheduler.add_prompt_tokens(counter.count(prefix) + counter.count(query))
+        return prefix, query
+    
+    def _process_sample(self, epochs: list, index: int, item: dict, example_index: ExampleIndex = None,
+                        parts: tuple = None) -> list:
+        """
+        Генерация ответа для одного примера (parts - готовые префикс и
+        запрос): по записи на каждую эпоху из epochs, для нескольких эпох
+        варианты ответа запрашиваются одним запросом
+        """
+        if parts is None:
+            parts = self._prepare_sample(item, example_index)
+            if isinstance(parts, Exception):
+                raise parts
+        prefix, query = parts
+        
+        # Генерируем ответ, max_tokens - по длине эталонного ответа записи
+        if self.prefix_role == 'system':
+            prompt, system = query, prefix
+        else:
+            prompt, system = prefix + query, None
+        max_tokens = self.client.lengths.limit(item.get('output'))
+        # Номер варианта в ключе кэша - эпоха: при temperature > 0 каждая эпоха
+        # получает свой ответ, а кэш отдает только ранее полученные ответы той же эпохи
+        if len(epochs) == 1:
+            responses = [self.client.generate(prompt, max_tokens, system=system, sample=epochs[0] - 1)]
+        else:
+            responses = self.client.generate_samples(prompt, len(epochs), max_tokens, system=system,
+                                                     sample_ids=[epoch - 1 for epoch in epochs])
+        
+        timestamp = datetime.now().isoformat()
+        return [{
+            "epoch": epoch,
+            "index": index,
+            "original_instruction": item.get('instruction', ''),
+            "original_input": item.get('input', ''),
+            "original_output": item.get('output', ''),
+            "generated_prompt": prefix + query,
+            "generated_response": response,
+            "timestamp": timestamp
+        } for epoch, response in zip(epochs, responses)]
     
-    def evaluate(self, eval_data: list, epoch: int = None):
-        """Оценка модели"""
+    def evaluate(self, eval_data, epoch: int = None, return_results: bool = True, batch_size: int = 1000):
+        """
+        Оценка модели: параллельная генерация и подсчет метрик пачками по
+        batch_size. Результаты записываются в файл по мере получения, при
+        return_results=False они не накапливаются в памяти и возвращается
+        только сводка метрик.
+        """
         logger.info("Starting evaluation")
+        # Без обучения лимит длины оценивается по эталонам eval данных (без учета длины
+        # эталона каждого запроса - ответ модели не должен зависеть от него)
+        if not self.client.lengths.fitted and hasattr(eval_data, '__len__'):
+            self.client.lengths.fit(item.get('output', '') for item in eval_data)
+        metrics = self.client.metrics
+        before = metrics.snapshot() if metrics is not None else None
         
-        eval_prompts = []
-        references = []
+        prompt_items, reference_items = tee(eval_data)
+        eval_prompts = profile_iter('prompt_build', (self._create_prompt(item) for item in prompt_items))
+        references = (item.get('output', '') for item in reference_items)
         
-        for item in eval_data:
-            prompt = self._create_prompt(item)
-            eval_prompts.append(prompt)
-            references.append(item.get('output', ''))
+        eval_results = [] if return_results else None
+        accumulator = ScoreAccumulator()
+        failed = 0
+        pending = []
+        eval_file = self._eval_path(epoch)
+        # Файл появляется под своим именем только после полной оценки,
+        # иначе при продолжении обучения оборванная оценка считалась бы готовой
+        partial_file = os.path.join(os.path.dirname(eval_file), '.partial.' + os.path.basename(eval_file))
         
-        eval_results = self.client.evaluate(eval_prompts, references)
+        with open_sink(partial_file, self.eval_format) as sink:
+            def score_pending():
+                nonlocal failed
+                # Метрики считаются сразу для всей пачки
+                with phase('eval_scoring'):
+                    scores = compute_metrics([r['generated_response'] for r in pending],
+                                             [r['reference'] for r in pending])
+                    for i, result in enumerate(pending):
+                        result['scores'] = {name: float(values[i]) for name, values in scores.items()}
+                    accumulator.add(scores)
+                    failed += sum(r['generated_response'] is None for r in pending)
+                
+                with phase('eval_dump'):
+                    for result in pending:
+                        sink.write(result)
+                    sink.flush()
+                if eval_results is not None:
+                    eval_results.extend(pending)
+                pending.clear()
+            
+            def collect(i, result):
+                pending.append(result)
+                if len(pending) >= batch_size:
+                    score_pending()
+            
+            # Оценка каждой эпохи - отдельная выборка ответов, а не повтор из кэша
+            self.client.evaluate(eval_prompts, references, on_result=collect, sample=epoch - 1 if epoch else 0)
+            if pending:
+                score_pending()
+        os.replace(partial_file, eval_file)
         
-        # Сохранение результатов оценки
-        eval_file = f"{self.config['training']['output_dir']}/eval_results_epoch{epoch}.json"
-        with open(eval_file, 'w', encoding='utf-8') as f:
-            json.dump(eval_results, f, ensure_ascii=False, indent=2)
+        summary = accumulator.summary()
+        summary['failed'] = failed
+        with phase('eval_dump'):
+            self._save_eval_summary(epoch, summary)
         
         logger.info(f"Evaluation results saved to {eval_file}")
-        return eval_results
+        logger.info("Evaluation metrics: " + ", ".join(f"{name}={summary[name]:.4f}" for name in METRIC_NAMES))
+        if metrics is not None:
+            logger.info(self.client.lengths.report(self._finish_reasons_since(before, metrics.snapshot())))
+        return eval_results if return_results else summary
+    
+    def _save_eval_summary(self, epoch: int, summary: dict):
+        """
+        Сводка эпохи в eval_summary_epoch{n}.json и общая сводка по всем
+        эпохам в eval_summary.json (дополняется при продолжении обучения).
+        Оценка без эпохи сохраняется только в eval_summary_latest.json и
+        в общую сводку не попадает
+        """
+        output_dir = self.config['training']['output_dir']
+        suffix = f"_epoch{epoch}" if epoch is not None else "_latest"
+        with open(f"{output_dir}/eval_summary{suffix}.json", 'w', encoding='utf-8') as f:
+            json.dump(summary, f, indent=2)
+        if epoch is None:
+            return
+        
+        overall_path = f"{output_dir}/eval_summary.json"
+        overall = {"epochs": {}}
+        if os.path.exists(overall_path):
+            with open(overall_path, 'r', encoding='utf-8') as f:
+                overall = json.load(f)
+        overall["epochs"][str(epoch)] = summary
+        
+        # Среднее по всем оцененным примерам всех эпох
+        epochs = list(overall["epochs"].values())
+        total = sum(e['count'] for e in epochs)
+        overall["overall"] = {
+            name: sum(e[name] * e['count'] for e in epochs) / total if total else 0.0
+            for name in METRIC_NAMES
+        }
+        overall["overall"]['count'] = total
+        
+        with open(overall_path, 'w', encoding='utf-8') as f:
+            json.dump(overall, f, indent=2)
+    
+    def _eval_path(self, epoch: int = None) -> str:
+        suffix = f"_epoch{epoch}" if epoch is not None else ""
+        return f"{self.config['training']['output_dir']}/eval_results{suffix}.{self.eval_format}"
     
     def _create_prompt(self, item: dict) -> str:
         """Создание промпта для оценки"""
-        prompt = f"Инструкция: {item.get('instruction', '')}\n"
-        if item.get('input'):
-            prompt += f"Входные данные: {item.get('input', '')}\n"
-        prompt += "Ответ:"
-        return prompt
\ No newline at end of file
+        return self.prompts.eval.render(item)
\ No newline at end of file
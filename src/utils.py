@@ -1,8 +1,15 @@
 import yaml
 import logging
 import json
+import re
+import os
 import time
 import requests
+from requests.adapters import HTTPAdapter
+from .rate_limit import RetryableAPIError, RETRYABLE_STATUSES, parse_retry_after, backoff_delay
+from .profiling import phase, profile_iter
+from .sinks import JSONLSink, open_text, compression_of
+from .jsonl import iter_jsonl, write_jsonl, JSONLIndex
 from tqdm import tqdm
 
 def setup_logging():
@@ -17,61 +24,518 @@ def load_config(config_path: str) -> dict:
         config = yaml.safe_load(f)
     return config
 
-def make_api_request(config: dict, messages: list, max_tokens: int = 2048):
-    """Выполнение запроса к LM Studio API"""
-    url = f"{config['api']['base_url']}/chat/completions"
+def create_session(config: dict) -> requests.Session:
+    """Создание общей HTTP сессии с пулом keep-alive соединений"""
+    api_config = config['api']
+    pool_size = api_config.get('pool_size', 10)
     
-    headers = {
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    
+    session.headers.update({
         "Content-Type": "application/json",
-        "Authorization": f"Bearer {config['api']['api_key']}"
-    }
+        "Authorization": f"Bearer {api_config['api_key']}"
+    })
+    if not api_config.get('keep_alive', True):
+        session.headers['Connection'] = 'close'
     
+    return session
+
+def get_timeout(config: dict) -> tuple:
+    """Таймауты (connect, read) для запросов к API"""
+    api_config = config['api']
+    return (api_config.get('connect_timeout', 10), api_config.get('read_timeout', 120))
+
+def build_messages(prompt: str, system: str = None) -> list:
+    """
+    Сообщения чата: system - общий для многих запросов префикс (например
+    few-shot примеры), он идет отдельным сообщением и не меняется от запроса
+    к запросу, поэтому сервер может переиспользовать его KV-кэш
+    """
+    messages = [{"role": "system", "content": system}] if system else []
+    messages.append({"role": "user", "content": prompt})
+    return messages
+
+def response_usage(data: dict):
+    """
+    Поле usage ответа. Число токенов промпта из кэша сервера приводится к
+    usage.prompt_tokens_details.cached_tokens (так его отдает OpenAI), в том
+    числе из timings.cache_n серверов на llama.cpp.
+    """
+    if not isinstance(data, dict):
+        return None
+    usage = data.get('usage')
+    cache_n = (data.get('timings') or {}).get('cache_n')
+    if usage and cache_n is not None and not (usage.get('prompt_tokens_details') or {}).get('cached_tokens'):
+        usage = {**usage, 'prompt_tokens_details': {'cached_tokens': cache_n}}
+    return usage
+
+def build_payload(config: dict, messages: list, max_tokens: int = 2048, stream: bool = False, n: int = 1) -> dict:
+    """
+    Тело запроса к /chat/completions (n > 1 - несколько вариантов ответа на
+    один промпт). Стоп-последовательности берутся из generation.stop
+    """
     payload = {
         "model": config['api']['model_name'],
         "messages": messages,
         "temperature": config['model']['temperature'],
         "top_p": config['model']['top_p'],
         "max_tokens": max_tokens,
-        "stream": False
+        "stream": stream
     }
+    if n > 1:
+        payload["n"] = n
+    stop = config.get('generation', {}).get('stop')
+    if stop:
+        payload["stop"] = stop
+    return payload
+
+def make_api_request(config: dict, messages: list, max_tokens: int = 2048, session: requests.Session = None,
+                     base_url: str = None, metrics=None, n: int = 1):
+    """
+    Выполнение запроса к LM Studio API.
+    Временные ошибки (429, 5xx, таймауты, обрыв соединения) поднимаются как
+    RetryableAPIError, остальные логируются и дают None.
+    base_url задает сервер из пула вместо api.base_url.
+    metrics (APIMetrics) получает задержку, исход и usage запроса.
+    """
+    url = f"{base_url or config['api']['base_url']}/chat/completions"
+    payload = build_payload(config, messages, max_tokens, n=n)
     
+    if metrics is not None:
+        metrics.request_started()
+    start = time.perf_counter()
+    error = None
+    usage = None
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=120)
+        with phase('network_wait'):
+            if session is not None:
+                response = session.post(url, json=payload, timeout=get_timeout(config))
+            else:
+                headers = {
+                    "Content-Type": "application/json",
+                    "Authorization": f"Bearer {config['api']['api_key']}"
+                }
+                response = requests.post(url, headers=headers, json=payload, timeout=get_timeout(config))
+        
+        if response.status_code >= 400:
+            error = f"http_{response.status_code}"
+        if response.status_code in RETRYABLE_STATUSES:
+            raise RetryableAPIError(
+                f"HTTP {response.status_code} from {url}",
+                status=response.status_code,
+                retry_after=parse_retry_after(response.headers.get('Retry-After'))
+            )
         response.raise_for_status()
-        return response.json()
+        data = response.json()
+        usage = response_usage(data)
+        return data
+    except requests.exceptions.Timeout as e:
+        error = 'timeout'
+        raise RetryableAPIError(f"API request failed: {e}") from e
+    except requests.exceptions.ConnectionError as e:
+        error = 'connection'
+        raise RetryableAPIError(f"API request failed: {e}") from e
     except requests.exceptions.RequestException as e:
+        error = error or 'request'
         logging.error(f"API request failed: {e}")
         return None
+    finally:
+        if metrics is not None:
+            metrics.request_finished(time.perf_counter() - start, usage, error)
+
+def stream_api_request(config: dict, messages: list, max_tokens: int = 2048, session: requests.Session = None,
+                       base_url: str = None, metrics=None):
+    """
+    Потоковый запрос к LM Studio API (Server-Sent Events).
+    Отдает фрагменты текста по мере их генерации.
+    """
+    url = f"{base_url or config['api']['base_url']}/chat/completions"
+    payload = build_payload(config, messages, max_tokens, stream=True)
+    http = session if session is not None else requests
+    headers = None if session is not None else {
+        "Content-Type": "application/json",
+        "Authorization": f"Bearer {config['api']['api_key']}"
+    }
+    
+    if metrics is not None:
+        metrics.request_started()
+    start = time.perf_counter()
+    error = 'interrupted'
+    usage = None
+    chunks = 0
+    finish_reason = None
+    try:
+        with http.post(url, headers=headers, json=payload, timeout=get_timeout(config), stream=True) as response:
+            if response.status_code >= 400:
+                error = f"http_{response.status_code}"
+            response.raise_for_status()
+            for line in profile_iter('network_wait', response.iter_lines(chunk_size=None)):
+                if not line or not line.startswith(b"data:"):
+                    continue
+                
+                data = line[len(b"data:"):].strip()
+                if data == b"[DONE]":
+                    break
+                
+                chunk = json.loads(data)
+                usage = chunk.get('usage') or usage
+                for choice in chunk.get('choices', []):
+                    finish_reason = choice.get('finish_reason') or finish_reason
+                    content = choice.get('delta', {}).get('content')
+                    if content:
+                        chunks += 1
+                        yield content
+        error = None
+    except GeneratorExit:
+        # Потребитель сам прекратил чтение - это не ошибка запроса
+        error = None
+        raise
+    except requests.exceptions.Timeout:
+        error = 'timeout'
+        raise
+    except requests.exceptions.ConnectionError:
+        error = 'connection'
+        raise
+    finally:
+        if metrics is not None:
+            # Без usage в потоке считаем каждый фрагмент одним токеном
+            metrics.request_finished(time.perf_counter() - start, usage or {'completion_tokens': chunks}, error)
+            if finish_reason is not None:
+                metrics.record_finish_reasons([finish_reason])
 
-def generate_with_retry(config: dict, prompt: str, max_retries: int = 3):
-    """Генерация текста с повторными попытками"""
+def generate_with_retry(config: dict, prompt: str, max_retries: int = 3, session: requests.Session = None,
+                        limiter=None, endpoints=None, metrics=None, system: str = None, n: int = 1,
+                        max_tokens: int = 2048):
+    """
+    Генерация текста с повторными попытками.
+    Повторяются только временные ошибки (RetryableAPIError); ответ 4xx,
+    ответ без вариантов и прочие ошибки сразу дают None.
+    Между попытками - экспоненциальная задержка с джиттером или Retry-After
+    сервера; limiter (AdaptiveLimiter) получает задержку и исход каждого запроса.
+    endpoints (EndpointPool) выбирает сервер для каждой попытки, поэтому
+    повтор после ошибки уходит на другой исправный сервер.
+    metrics (APIMetrics) учитывает каждый HTTP-запрос, число повторов и
+    причины завершения ответов (finish_reason).
+    system - общий префикс, отправляемый отдельным system-сообщением.
+    При n > 1 у сервера запрашивается n вариантов ответа и возвращается
+    список полученных (сервер без поддержки n может вернуть меньше).
+    """
+    rate_config = config.get('rate_limit', {})
+    backoff_base = rate_config.get('backoff_base', 1.0)
+    backoff_max = rate_config.get('backoff_max', 30.0)
+    multiple_endpoints = endpoints is not None and len(endpoints) > 1
+    failed_endpoints = []
+    
     for attempt in range(max_retries):
+        if attempt and metrics is not None:
+            metrics.record_retry()
+        delay = backoff_delay(attempt, backoff_base, backoff_max)
+        success = False
+        overloaded = False
+        server_failure = False
+        retryable = False
+        endpoint = None
+        
+        if limiter is not None:
+            with phase('rate_limit_wait'):
+                limiter.acquire()
+        start = time.perf_counter()
+        latency = None
         try:
-            messages = [{"role": "user", "content": prompt}]
-            response = make_api_request(config, messages)
+            if endpoints is not None:
+                endpoint = endpoints.acquire(exclude=failed_endpoints)
+            
+            messages = build_messages(prompt, system)
+            response = make_api_request(config, messages, max_tokens, session=session,
+                                        base_url=endpoint.url if endpoint is not None else None,
+                                        metrics=metrics, n=n)
+            latency = time.perf_counter() - start
             
             if response and 'choices' in response and len(response['choices']) > 0:
-                return response['choices'][0]['message']['content']
+                success = True
+                # Длина ответов сильно различается, поэтому сравниваем время на токен
+                completion_tokens = (response.get('usage') or {}).get('completion_tokens')
+                if completion_tokens:
+                    latency /= completion_tokens
+                if metrics is not None:
+                    metrics.record_finish_reasons([choice.get('finish_reason') for choice in response['choices']])
+                contents = [choice['message']['content'] for choice in response['choices']]
+                return contents[0] if n == 1 else contents
+            if response is not None:
+                logging.warning("API response has no choices")
             
+        except RetryableAPIError as e:
+            retryable = True
+            overloaded = e.overloaded
+            server_failure = endpoint is not None
+            if server_failure:
+                failed_endpoints.append(endpoint)
+            if multiple_endpoints and endpoint is not None and attempt == 0:
+                # Первый повтор сразу уходит на другой сервер пула
+                delay = 0
+            elif e.retry_after is not None:
+                delay = min(e.retry_after, backoff_max)
+                if limiter is not None and not multiple_endpoints:
+                    limiter.pause(delay)
+            logging.warning(f"Attempt {attempt + 1} failed: {e}")
         except Exception as e:
             logging.warning(f"Attempt {attempt + 1} failed: {e}")
-            time.sleep(2)
+        finally:
+            if endpoint is not None:
+                endpoints.release(endpoint, latency, success, server_failure)
+            if limiter is not None:
+                limiter.release(latency, success, overloaded)
+        
+        if not retryable:
+            # Повтор того же запроса дал бы тот же ответ
+            return None
+        if attempt + 1 < max_retries and delay:
+            with phase('retry_backoff'):
+                time.sleep(delay)
     
     return None
 
+def iter_json_array(filepath: str, chunk_size: int = 1 << 20):
+    """
+    Потоковое чтение JSON-массива (в том числе сжатого .gz/.zst) по одному
+    элементу: файл читается блоками по chunk_size символов, в памяти только
+    текущий блок и недочитанный элемент. Элемент, не поместившийся в буфер,
+    дочитывается блоком не меньше уже прочитанной его части, так что
+    повторные попытки разбора длинного элемента в сумме линейны по его длине.
+    Пустые и висячие элементы ([1,,2], [1,]) - ошибка, как и в json.load.
+    """
+    decoder = json.JSONDecoder()
+    with open_text(filepath, 'r') as f:
+        buffer, pos, eof = '', 0, False
+        # Ожидается: '[' (start), значение или ']' (first), значение (value),
+        # ',' или ']' (separator), только пробелы до конца файла (end)
+        state = 'start'
+
+        def skip(pos):
+            while pos < len(buffer) and buffer[pos] in ' \t\r\n':
+                pos += 1
+            return pos
+
+        def fill():
+            nonlocal buffer, pos, eof
+            pending = buffer[pos:]
+            chunk = f.read(max(chunk_size, len(pending)))
+            eof = not chunk
+            buffer, pos = pending + chunk, 0
+
+        while True:
+            pos = skip(pos)
+            # Дочитываем, пока в буфере не окажется следующий значащий символ
+            if pos >= len(buffer):
+                if eof:
+                    if state == 'end':
+                        return
+                    raise ValueError(f"Unexpected end of JSON array in {filepath}")
+                fill()
+                continue
+
+            char = buffer[pos]
+            if state == 'start':
+                if char != '[':
+                    raise ValueError(f"{filepath} is not a JSON array")
+                state = 'first'
+                pos += 1
+                continue
+            if state == 'end':
+                raise ValueError(f"Extra data after JSON array in {filepath}")
+            if state == 'separator':
+                if char not in ',]':
+                    raise ValueError(f"Expected ',' or ']' in JSON array in {filepath}")
+                state = 'value' if char == ',' else 'end'
+                pos += 1
+                continue
+            if state == 'first' and char == ']':
+                state = 'end'
+                pos += 1
+                continue
+
+            try:
+                item, end = decoder.raw_decode(buffer, pos)
+                # Элемент может быть обрезан концом блока (число - незаметно:
+                # "12" из "123"), поэтому за ним в буфере должен быть еще символ
+                complete = skip(end) < len(buffer)
+            except json.JSONDecodeError:
+                complete = False
+            if not complete:
+                if eof:
+                    raise ValueError(f"Malformed JSON array element in {filepath}")
+                fill()
+                continue
+            yield item
+            pos = end
+            state = 'separator'
+
 def save_checkpoint(data: list, filepath: str):
     """Сохранение чекпоинта"""
-    with open(filepath, 'w', encoding='utf-8') as f:
-        for item in data:
-            f.write(json.dumps(item, ensure_ascii=False) + '\n')
+    write_jsonl(filepath, data)
 
-def load_checkpoint(filepath: str) -> list:
-    """Загрузка чекпоинта"""
-    data = []
+def iter_checkpoint(filepath: str):
+    """Построчное чтение чекпоинта (в том числе сжатого .gz/.zst)"""
     try:
-        with open(filepath, 'r', encoding='utf-8') as f:
-            for line in f:
-                data.append(json.loads(line.strip()))
+        # Недописанные строки после аварийного завершения пропускаются
+        yield from iter_jsonl(filepath, skip_errors=True)
     except FileNotFoundError:
         pass
-    return data
\ No newline at end of file
+    except (EOFError, OSError) as e:
+        # Сжатый поток оборван аварийным завершением: все целые строки уже прочитаны
+        logging.warning(f"Checkpoint {filepath} ends with a truncated block: {e}")
+
+def load_checkpoint(filepath: str) -> list:
+    """Загрузка чекпоинта"""
+    return list(iter_checkpoint(filepath))
+
+def checkpoint_progress(data) -> dict:
+    """Последний завершенный индекс для каждой эпохи из чекпоинта"""
+    progress = {}
+    for item in data:
+        epoch = item.get('epoch')
+        index = item.get('index')
+        if epoch is None or index is None:
+            continue
+        progress[epoch] = max(progress.get(epoch, -1), index)
+    return progress
+
+# Начало записи чекпоинта APITrainer: эпоха и индекс - первые поля
+_CHECKPOINT_HEAD_RE = re.compile(rb'\{\s*"epoch"\s*:\s*(-?\d+)\s*,\s*"index"\s*:\s*(-?\d+)\s*[,}]')
+
+def seek_checkpoint_progress(filepath: str) -> tuple:
+    """
+    То же, что checkpoint_progress, без разбора записей целиком: эпоха и
+    индекс читаются из начала каждой строки по индексу строк (JSONLIndex),
+    строки другого вида разбираются полностью. Порядок записей не важен
+    (после продолжения обучения записи эпох могут чередоваться).
+    Возвращает (число записей, прогресс). Только для несжатого чекпоинта.
+    """
+    if not os.path.exists(filepath):
+        return 0, {}
+    
+    with JSONLIndex(filepath) as index:
+        # Недописанная последняя строка после аварийного завершения
+        count = len(index)
+        while count:
+            try:
+                index[count - 1]
+                break
+            except json.JSONDecodeError:
+                count -= 1
+        
+        progress = {}
+        match = _CHECKPOINT_HEAD_RE.match
+        for i in range(count):
+            head = match(index.line(i, limit=64))
+            if head is not None:
+                epoch, item_index = int(head.group(1)), int(head.group(2))
+            else:
+                try:
+                    item = index[i]
+                except json.JSONDecodeError:
+                    continue
+                epoch, item_index = item.get('epoch'), item.get('index')
+                if epoch is None or item_index is None:
+                    continue
+            if item_index > progress.get(epoch, -1):
+                progress[epoch] = item_index
+    return count, progress
+
+class CheckpointWriter:
+    """
+    Дописывание результатов в чекпоинт по одному.
+    Каждая запись сразу сбрасывается в файл, fsync выполняется пачками.
+    Чекпоинт с расширением .gz/.zst пишется сжатым.
+    """
+    
+    def __init__(self, filepath: str, fsync_every: int = 50):
+        self.filepath = filepath
+        self.fsync_every = max(1, fsync_every)
+        self._pending = 0
+        
+        directory = os.path.dirname(filepath)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        
+        if compression_of(filepath):
+            self._recover_compressed()
+        else:
+            self._truncate_partial_line()
+        self._sink = JSONLSink(filepath, append=True)
+    
+    def _recover_compressed(self):
+        """
+        Сжатый поток, оборванный аварийным завершением, нельзя продолжить
+        дописыванием, а обрыв zstd при чтении не всегда заметен. Поэтому при
+        продолжении целые записи переписываются в новый файл.
+        """
+        if not os.path.exists(self.filepath) or os.path.getsize(self.filepath) == 0:
+            return
+        
+        base, extension = os.path.splitext(self.filepath)
+        tmp_path = f"{base}.recover{extension}"
+        with JSONLSink(tmp_path) as sink:
+            for item in iter_checkpoint(self.filepath):
+                sink.write(item)
+        os.replace(tmp_path, self.filepath)
+    
+    def _truncate_partial_line(self):
+        """Обрезка недописанной последней строки, чтобы новые записи не склеились с ней"""
+        try:
+            with open(self.filepath, 'rb+') as f:
+                size = f.seek(0, os.SEEK_END)
+                if size == 0:
+                    return
+                
+                f.seek(size - 1)
+                if f.read(1) == b'\n':
+                    return
+                
+                # Ищем последний перевод строки блоками с конца файла
+                position = size
+                while position > 0:
+                    block_start = max(0, position - 65536)
+                    f.seek(block_start)
+                    block = f.read(position - block_start)
+                    newline = block.rfind(b'\n')
+                    if newline != -1:
+                        f.truncate(block_start + newline + 1)
+                        return
+                    position = block_start
+                f.truncate(0)
+        except FileNotFoundError:
+            pass
+    
+    def write(self, item: dict):
+        with phase('checkpoint_io'):
+            self._sink.write(item)
+            self._sink.flush()
+            self._pending += 1
+            if self._pending >= self.fsync_every:
+                self.sync()
+    
+    def sync(self):
+        with phase('checkpoint_io'):
+            fileno = self._sink.fileno()
+            if fileno is not None:
+                os.fsync(fileno)
+            self._pending = 0
+    
+    def close(self):
+        if self._sink is None:
+            return
+        self._sink.flush()
+        if self._pending:
+            self.sync()
+        self._sink.close()
+        self._sink = None
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
\ No newline at end of file
@@ -0,0 +1,101 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import cache as cache_module
+from src.cache import ResponseCache, create_cache
+from src.model_utils import LMStudioClient
+
+@pytest.fixture
+def cache(tmp_path):
+    cache = ResponseCache(str(tmp_path / 'cache' / 'responses.sqlite'))
+    yield cache
+    cache.close()
+
+def test_get_set_and_stats(cache):
+    assert cache.get('k') is None
+    cache.set('k', 'ответ')
+    cache.set('none', None)
+
+    assert cache.get('k') == 'ответ'
+    assert cache.get('none') is None
+    assert cache.stats() == {"hits": 1, "misses": 2, "hit_rate": pytest.approx(1 / 3)}
+
+def test_persists_between_instances(tmp_path):
+    path = str(tmp_path / 'responses.sqlite')
+    first = ResponseCache(path)
+    first.set('k', ['a', 'b'])
+    first.close()
+
+    second = ResponseCache(path)
+    try:
+        assert second.get('k') == ['a', 'b']
+    finally:
+        second.close()
+
+def test_expired_entries_are_misses(cache, monkeypatch):
+    cache.set('k', 'old')
+    now = cache_module.time.time()
+    monkeypatch.setattr(cache_module.time, 'time', lambda: now + cache.max_age + 1)
+
+    assert cache.get('k') is None
+    cache.evict()
+    assert cache._conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0] == 0
+
+def test_evicts_least_recently_used(tmp_path, monkeypatch):
+    clock = [1000.0]
+    monkeypatch.setattr(cache_module.time, 'time', lambda: clock[0])
+    cache = ResponseCache(str(tmp_path / 'responses.sqlite'), max_entries=2, max_age_days=None)
+    try:
+        for key in ('a', 'b', 'c'):
+            clock[0] += 1
+            cache.set(key, key)
+        clock[0] += 1
+        assert cache.get('a') == 'a'
+        cache.evict()
+
+        assert cache.get('b') is None
+        assert cache.get('a') == 'a'
+        assert cache.get('c') == 'c'
+    finally:
+        cache.close()
+
+def test_make_key_depends_on_every_input():
+    messages = [{"role": "user", "content": "hi"}]
+    key = ResponseCache.make_key('m', messages, temperature=0.7, max_tokens=8)
+
+    assert key == ResponseCache.make_key('m', messages, max_tokens=8, temperature=0.7)
+    assert key != ResponseCache.make_key('m2', messages, temperature=0.7, max_tokens=8)
+    assert key != ResponseCache.make_key('m', messages, temperature=0.7, max_tokens=9)
+    assert key != ResponseCache.make_key('m', [{"role": "user", "content": "hi!"}], temperature=0.7, max_tokens=8)
+
+def _client_config(tmp_path, **generation) -> dict:
+    return {
+        'api': {'base_url': 'http://127.0.0.1:9/v1', 'model_name': 'm', 'api_key': 'k'},
+        'model': {'temperature': 0.7, 'top_p': 0.9},
+        'training': {'max_concurrency': 2, 'output_dir': str(tmp_path)},
+        'rate_limit': {'enabled': False},
+        'metrics': {'enabled': False},
+        'generation': generation
+    }
+
+def test_client_cache_key_includes_sample_and_stop(tmp_path):
+    with LMStudioClient(_client_config(tmp_path)) as client:
+        key = client._cache_key('p', 8)
+        assert client.cache is None
+        assert key == client._cache_key('p', 8, sample=0)
+        assert key != client._cache_key('p', 8, sample=1)
+        assert key != client._cache_key('p', 8, system='s')
+    with LMStudioClient(_client_config(tmp_path, stop=['\n\n'])) as client:
+        assert client._cache_key('p', 8) != key
+
+def test_create_cache_is_disabled_by_default(tmp_path):
+    assert create_cache({}) is None
+    cache = create_cache({'cache': {'enabled': True}, 'training': {'output_dir': str(tmp_path)}})
+    try:
+        assert cache.path == f"{tmp_path}/response_cache.sqlite"
+    finally:
+        cache.close()
@@ -0,0 +1,47 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.data_loader import DataProcessor
+
+def _config(tmp_path, dedup: bool = True) -> dict:
+    return {
+        'data': {'max_samples': None, 'max_tokens_per_sample': 40, 'overflow': 'truncate', 'chars_per_token': 3.0},
+        'dedup': {'enabled': dedup, 'threshold': 0.85, 'num_perm': 128, 'shingle_size': 5,
+                  'report_path': str(tmp_path / 'dedup_report.jsonl')}
+    }
+
+def _write_dataset(path, records):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+
+def test_stream_dataset_dedup_counts_budget_once(tmp_path):
+    long_input = 'очень длинный вход ' * 20
+    records = [
+        {'instruction': f'Задача номер {i} про совершенно разные вещи {i * 7919}', 'input': long_input, 'output': str(i)}
+        for i in range(6)
+    ]
+    records.append(dict(records[0]))
+    path = tmp_path / 'data.jsonl'
+    _write_dataset(path, records)
+
+    processor = DataProcessor(_config(tmp_path))
+    dataset = processor.stream_dataset(str(path))
+
+    assert len(dataset) == 6
+    # Статистика - одного полного прохода подготовки, а не суммы вложенных
+    assert processor.budget.stats['records_truncated'] == len(records)
+    assert [item['output'] for item in dataset] == [str(i) for i in range(6)]
+    assert processor.budget.stats['records_truncated'] == len(records)
+
+def test_stream_dataset_without_dedup(tmp_path):
+    records = [{'instruction': 'a', 'input': '', 'output': '1'}, {'instruction': 'a', 'input': '', 'output': '1'}]
+    path = tmp_path / 'data.jsonl'
+    _write_dataset(path, records)
+
+    processor = DataProcessor(_config(tmp_path, dedup=False))
+
+    assert len(processor.stream_dataset(str(path))) == 2
@@ -0,0 +1,55 @@
+import os
+import sys
+
+import numpy as np
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.dedup import MinHashDeduplicator
+
+class _FixedSignatures(MinHashDeduplicator):
+    """Дедупликатор с заранее заданными подписями записей (item - номер подписи)"""
+
+    def __init__(self, signatures: list, **kwargs):
+        super().__init__(**kwargs)
+        self.signatures = signatures
+
+    def signature(self, item) -> np.ndarray:
+        return self.signatures[item]
+
+def test_similar_pair_behind_unrelated_bucket_member():
+    dedup = _FixedSignatures([], threshold=0.85, num_perm=128)
+    rng = np.random.default_rng(0)
+    rows = dedup.rows
+
+    second = rng.integers(0, 2 ** 32, 128, dtype=np.uint64).astype(np.uint32)
+    # Третья запись похожа на вторую, но совпадает с ней только в полосе 0
+    third = second.copy()
+    for band in range(1, dedup.bands):
+        third[band * rows] ^= 0xFFFF
+    # Первая запись попадает в ту же группу полосы 0, в остальном не похожа
+    first = rng.integers(0, 2 ** 32, 128, dtype=np.uint64).astype(np.uint32)
+    first[:rows] = second[:rows]
+    dedup.signatures = [first, second, third]
+
+    duplicates = dedup.find_duplicates([0, 1, 2])
+
+    assert list(duplicates) == [2]
+    kept, similarity = duplicates[2]
+    assert kept == 1
+    assert similarity >= 0.85
+
+def test_duplicate_chain_keeps_first_record():
+    dedup = MinHashDeduplicator(threshold=0.8)
+    text = "Напиши функцию на Python, которая сортирует список чисел по возрастанию"
+    items = [
+        {"instruction": "Объясни, как работает сборщик мусора в CPython"},
+        {"instruction": text},
+        {"instruction": text + "."},
+        {"instruction": text + "!"}
+    ]
+
+    duplicates = dedup.find_duplicates(items)
+
+    assert sorted(duplicates) == [2, 3]
+    assert all(kept == 1 for kept, _ in duplicates.values())
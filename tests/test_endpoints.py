@@ -0,0 +1,135 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.endpoints import CircuitBreaker, EndpointPool
+from src.rate_limit import RetryableAPIError
+
+def _tripped_breaker(now: float = 100.0) -> CircuitBreaker:
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0)
+    breaker.record_failure(now)
+    assert breaker.record_failure(now)
+    return breaker
+
+def test_breaker_opens_after_threshold_and_half_opens_after_timeout():
+    breaker = _tripped_breaker()
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available(105.0)
+    assert breaker.available(110.0)
+
+    breaker.on_acquire(110.0)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    # Пока идет проба, второй запрос на сервер не пускается
+    assert not breaker.available(110.0)
+
+def test_breaker_probe_success_closes():
+    breaker = _tripped_breaker()
+    breaker.on_acquire(110.0)
+    breaker.record_success()
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 0
+    assert breaker.available(110.0)
+
+def test_breaker_probe_failure_reopens():
+    breaker = _tripped_breaker()
+    breaker.on_acquire(110.0)
+
+    assert breaker.record_failure(111.0)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available(115.0)
+    assert breaker.available(121.0)
+
+def test_breaker_inconclusive_probe_reopens():
+    breaker = _tripped_breaker()
+    breaker.on_acquire(110.0)
+    breaker.record_inconclusive(111.0)
+
+    assert breaker.state == CircuitBreaker.OPEN
+    assert not breaker.available(115.0)
+    assert breaker.available(121.0)
+
+def test_breaker_inconclusive_ignored_when_closed():
+    breaker = CircuitBreaker(failure_threshold=2, reset_timeout=10.0)
+    breaker.record_failure(100.0)
+    breaker.record_inconclusive(100.0)
+
+    assert breaker.state == CircuitBreaker.CLOSED
+    assert breaker.failures == 1
+
+def _open_pool(monkeypatch, clock: list, urls=('http://a', 'http://b')) -> EndpointPool:
+    monkeypatch.setattr('src.endpoints.time.monotonic', lambda: clock[0])
+    pool = EndpointPool(list(urls), failure_threshold=1, reset_timeout=10.0)
+    for endpoint in pool.endpoints:
+        pool.release(pool.acquire(exclude=tuple(e for e in pool.endpoints if e is not endpoint)),
+                     success=False, failure=True)
+    return pool
+
+def test_pool_raises_with_retry_after_when_all_open(monkeypatch):
+    clock = [100.0]
+    pool = _open_pool(monkeypatch, clock)
+
+    clock[0] = 104.0
+    with pytest.raises(RetryableAPIError) as error:
+        pool.acquire()
+    assert error.value.retry_after == pytest.approx(6.0)
+
+@pytest.mark.parametrize('outcome', [
+    dict(success=False, failure=False),  # 4xx, пустой ответ, прерванный поток
+    dict(success=False, failure=True)
+])
+def test_pool_probe_without_success_does_not_stick_half_open(monkeypatch, outcome):
+    clock = [100.0]
+    pool = _open_pool(monkeypatch, clock, urls=('http://a',))
+
+    clock[0] = 110.0
+    probe = pool.acquire()
+    assert probe.breaker.state == CircuitBreaker.HALF_OPEN
+    pool.release(probe, **outcome)
+
+    assert probe.outstanding == 0
+    assert probe.breaker.state == CircuitBreaker.OPEN
+    # Следующая проба возможна после reset_timeout, а до тех пор клиент ждет retry_after
+    with pytest.raises(RetryableAPIError) as error:
+        pool.acquire()
+    assert error.value.retry_after == pytest.approx(10.0)
+    clock[0] = 120.0
+    assert pool.acquire() is probe
+
+def test_pool_probe_success_restores_endpoint(monkeypatch):
+    clock = [100.0]
+    pool = _open_pool(monkeypatch, clock, urls=('http://a',))
+
+    clock[0] = 110.0
+    probe = pool.acquire()
+    pool.release(probe, latency=0.5, success=True)
+
+    assert probe.breaker.state == CircuitBreaker.CLOSED
+    assert probe.latency == 0.5
+    assert pool.acquire() is probe
+
+def test_pool_least_outstanding_and_exclude():
+    pool = EndpointPool(['http://a', 'http://b'])
+    first = pool.acquire()
+    second = pool.acquire()
+
+    assert first is not second
+    pool.release(first)
+    assert pool.acquire() is first
+    # Сервер из exclude выбирается, только если других нет
+    assert pool.acquire(exclude=(first,)) is second
+    assert pool.acquire(exclude=(first, second)) in (first, second)
+
+def test_pool_lowest_latency_prefers_unmeasured_then_fastest():
+    pool = EndpointPool(['http://a', 'http://b', 'http://c'], strategy='lowest_latency')
+    a, b, c = pool.endpoints
+    for endpoint, latency in ((a, 0.3), (b, 0.1)):
+        pool.release(pool.acquire(exclude=tuple(e for e in pool.endpoints if e is not endpoint)), latency)
+
+    assert pool.acquire() is c
+    pool.release(c, 0.5)
+    assert pool.acquire() is b
@@ -0,0 +1,61 @@
+import json
+import math
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import jsonl
+from src.jsonl import CODECS, iter_jsonl, write_jsonl, JSONLIndex
+
+CODEC_NAMES = [name for name in CODECS if name == 'json' or jsonl.orjson is not None]
+
+@pytest.fixture(params=CODEC_NAMES)
+def codec(request):
+    previous = jsonl.get_codec()
+    jsonl.set_codec(request.param)
+    yield request.param
+    jsonl._codec = previous
+
+RECORDS = [
+    {"instruction": "Что такое Python?", "input": "", "output": "Язык программирования"},
+    {"epoch": 1, "index": 2, "score": 0.5, "tags": ["a", "б"], "extra": None}
+]
+
+def test_write_jsonl_matches_json_dumps(tmp_path, codec):
+    path = tmp_path / 'data.jsonl'
+    assert write_jsonl(str(path), RECORDS, batch_size=1) == len(RECORDS)
+
+    expected = ''.join(json.dumps(record, ensure_ascii=False) + '\n' for record in RECORDS)
+    assert path.read_text(encoding='utf-8') == expected
+    assert list(iter_jsonl(str(path))) == RECORDS
+
+def test_nan_round_trip(tmp_path, codec):
+    path = tmp_path / 'data.jsonl'
+    write_jsonl(str(path), [{"loss": float('nan')}])
+
+    (record,) = iter_jsonl(str(path))
+    assert math.isnan(record["loss"])
+
+def test_iter_jsonl_skip_errors(tmp_path, codec):
+    path = tmp_path / 'data.jsonl'
+    path.write_text('{"a": 1}\n{"a": \n\n{"a": 2}\n', encoding='utf-8')
+
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_jsonl(str(path)))
+    assert list(iter_jsonl(str(path), skip_errors=True)) == [{"a": 1}, {"a": 2}]
+
+def test_jsonl_index_random_access(tmp_path, codec):
+    path = tmp_path / 'data.jsonl'
+    records = [{"i": i, "text": "x" * i} for i in range(50)]
+    write_jsonl(str(path), records)
+
+    index = JSONLIndex(str(path))
+    try:
+        assert len(index) == len(records)
+        assert index[37] == records[37]
+        assert index.line(3, limit=4) == b'{"i"'
+    finally:
+        index.close()
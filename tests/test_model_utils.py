@@ -0,0 +1,41 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.model_utils import GenerationClient
+
+CONFIG = {'metrics': {'enabled': False}}
+
+class _EchoClient(GenerationClient):
+    max_concurrency = 2
+
+    def _generate(self, prompt, max_tokens, system=None, sample=0):
+        return f"{prompt}:{sample}"
+
+    def generate_samples(self, prompt, n, max_tokens=None, system=None, sample_ids=None):
+        return [self._generate(prompt, max_tokens, system, k) for k in (sample_ids or range(n))]
+
+    def generate_stream(self, prompt, max_tokens=None):
+        yield from prompt
+
+def test_subclass_missing_transport_fails_on_creation():
+    class Incomplete(GenerationClient):
+        max_concurrency = 1
+
+        def _generate(self, prompt, max_tokens, system=None, sample=0):
+            return prompt
+
+    with pytest.raises(TypeError):
+        Incomplete(CONFIG)
+
+def test_shared_methods_use_subclass_transport():
+    with _EchoClient(CONFIG) as client:
+        assert client.cache is None
+        assert client.generate('a', 8, sample=1) == 'a:1'
+        results = client.evaluate(['x', 'y'], ['rx', 'ry'], sample=2)
+
+    assert [r['generated_response'] for r in results] == ['x:2', 'y:2']
+    assert [r['reference'] for r in results] == ['rx', 'ry']
@@ -0,0 +1,53 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.prompts import PromptTemplate, PromptLibrary
+
+def test_record_template_matches_legacy_format():
+    record = PromptLibrary().record
+
+    assert record.render({'instruction': 'Сложи', 'input': '2 2'}) == "Instruction: Сложи\nInput: 2 2\nResponse:"
+    assert record.render({'instruction': 'Привет', 'system': 'S'}) == "System: S\nInstruction: Привет\nResponse:"
+    assert record.render_many([{'instruction': 'a'}, {'instruction': 'b', 'input': 'x'}]) == [
+        "Instruction: a\nResponse:", "Instruction: b\nInput: x\nResponse:"
+    ]
+
+def test_template_escaped_braces_and_format_spec():
+    template = PromptTemplate(["{{literal}} {n:>3}|", {'text': "{x!r}", 'if': 'x'}], params=('n',))
+
+    assert template.render({'x': 'v'}, n=7) == "{literal}   7|'v'"
+    assert template.render({}, n=1) == "{literal}   1|"
+
+@pytest.mark.parametrize('segments', [
+    ["{item.__class__}"],
+    ["{item[0]}"],
+    ["{n:{width}}"],
+    [{'text': "x", 'if': "a.b"}],
+    ["{__import__('os').system('true')}"]
+])
+def test_template_rejects_non_identifier_fields(segments):
+    with pytest.raises(ValueError):
+        PromptTemplate(segments)
+
+def test_few_shot_parts_and_example_block_cache():
+    training = PromptLibrary().training
+    examples = [{'instruction': 'i1', 'output': 'o1'}, {'instruction': 'i2', 'input': 'x', 'output': 'o2'}]
+    prefix, query = training.render_parts(examples, {'instruction': 'q'})
+
+    assert prefix.startswith(training.header)
+    assert "Пример 1:\nИнструкция: i1\nОжидаемый ответ: o1\n\n" in prefix
+    assert "Пример 2:\nИнструкция: i2\nВходные данные: x\n" in prefix
+    assert query == "Новый запрос для обучения:\nИнструкция: q\nТвой ответ должен быть:"
+    assert training.render(examples, {'instruction': 'q'}) == prefix + query
+    # Повторный рендер тех же объектов примеров берется из кэша
+    assert training.render_examples(examples) is training.render_examples(examples)
+
+def test_library_overrides_from_config():
+    library = PromptLibrary({'prompts': {'eval': ["Q: {instruction}\nA:"], 'training': {'header': "H\n"}}})
+
+    assert library.eval.render({'instruction': 'x'}) == "Q: x\nA:"
+    assert library.training.render([], {'instruction': 'x'}).startswith("H\nНовый запрос")
@@ -0,0 +1,81 @@
+import os
+import sys
+import threading
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.rate_limit import AdaptiveLimiter, RetryableAPIError, backoff_delay, parse_retry_after
+
+def test_limiter_grows_additively_up_to_max():
+    limiter = AdaptiveLimiter(initial=2, max_limit=3, cooldown=0.0)
+    for _ in range(20):
+        limiter.acquire()
+        limiter.release(latency=1.0)
+
+    assert limiter.limit == 3.0
+    assert limiter.in_flight == 0
+
+def test_limiter_decreases_on_overload_and_slow_responses():
+    limiter = AdaptiveLimiter(initial=8, min_limit=1, max_limit=16, decrease_factor=0.5,
+                              latency_tolerance=2.0, cooldown=0.0)
+    limiter.acquire()
+    limiter.release(latency=1.0)
+    limit = limiter.limit
+
+    limiter.acquire()
+    limiter.release(overloaded=True)
+    assert limiter.limit == pytest.approx(limit / 2)
+
+    limiter.acquire()
+    limiter.release(latency=2.5)
+    assert limiter.limit == pytest.approx(limit / 4)
+
+    for _ in range(5):
+        limiter.acquire()
+        limiter.release(overloaded=True)
+    assert limiter.limit == 1.0
+
+def test_limiter_decrease_respects_cooldown():
+    limiter = AdaptiveLimiter(initial=8, cooldown=3600.0)
+    for _ in range(3):
+        limiter.acquire()
+        limiter.release(overloaded=True)
+
+    assert limiter.limit == 4.0
+
+def test_limiter_blocks_at_limit_until_release():
+    limiter = AdaptiveLimiter(initial=1, max_limit=1)
+    limiter.acquire()
+    acquired = threading.Event()
+
+    def worker():
+        limiter.acquire()
+        acquired.set()
+
+    thread = threading.Thread(target=worker, daemon=True)
+    thread.start()
+    assert not acquired.wait(0.1)
+    limiter.release()
+    assert acquired.wait(1.0)
+    thread.join(1.0)
+
+def test_limiter_from_config_scales_by_endpoints():
+    config = {'training': {'max_concurrency': 4},
+              'rate_limit': {'enabled': True, 'initial_concurrency': 2, 'max_concurrency': 6}}
+
+    limiter = AdaptiveLimiter.from_config(config, endpoints=3)
+    assert limiter.limit == 6.0
+    assert limiter.max_limit == 18.0
+    assert AdaptiveLimiter.from_config({'training': {}, 'rate_limit': {'enabled': False}}) is None
+
+def test_retryable_error_overload_statuses():
+    assert RetryableAPIError('timeout').overloaded
+    assert RetryableAPIError('429', status=429).overloaded
+    assert not RetryableAPIError('500', status=500).overloaded
+
+def test_backoff_and_retry_after():
+    assert all(0 <= backoff_delay(attempt, 1.0, 4.0) <= 4.0 for attempt in range(10))
+    assert parse_retry_after('2') == 2.0
+    assert parse_retry_after(None) is None
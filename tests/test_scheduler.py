@@ -0,0 +1,60 @@
+import os
+import random
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.scheduler import PrefixScheduler
+
+def _identity(element):
+    return element
+
+def test_schedule_groups_prefixes_within_window():
+    scheduler = PrefixScheduler(window=4)
+    order = list(scheduler.schedule(['a', 'b', 'a', 'c', 'b', 'b', 'd', 'c'], _identity))
+
+    # Во втором окне первой идет группа c, продолжающая конец первого окна
+    assert [seq for seq, _, _ in order] == [0, 2, 1, 3, 7, 4, 5, 6]
+    assert [hit for _, hit, _ in order] == [False, True, False, False, True, False, True, False]
+    assert scheduler.stats['requests'] == 8
+    assert scheduler.stats['groups'] == 5
+
+def test_schedule_continues_previous_window_group_first():
+    scheduler = PrefixScheduler(window=2)
+    order = [element for _, _, element in scheduler.schedule(['a', 'b', 'c', 'b'], _identity)]
+
+    assert order == ['a', 'b', 'b', 'c']
+
+def test_schedule_disabled_keeps_dataset_order():
+    scheduler = PrefixScheduler(window=4, enabled=False)
+    order = list(scheduler.schedule(['a', 'b', 'a', None], _identity))
+
+    assert [seq for seq, _, _ in order] == [0, 1, 2, 3]
+    assert not any(hit for _, hit, _ in order)
+
+def test_ordered_restores_input_order():
+    scheduler = PrefixScheduler(window=8)
+    scheduled = list(scheduler.schedule([f"p{i % 3}" for i in range(12)], _identity))
+    completed = list(enumerate(scheduled))
+    random.Random(0).shuffle(completed)
+
+    seen = []
+    on_result = scheduler.ordered(lambda seq, item, result: seen.append((seq, result)))
+    for i, item in completed:
+        on_result(i, item, f"r{item[0]}")
+
+    assert seen == [(seq, f"r{seq}") for seq in range(12)]
+
+def test_report_mentions_prefill_savings():
+    scheduler = PrefixScheduler(window=4)
+    list(scheduler.schedule(['a', 'a'], _identity))
+    scheduler.add_prompt_tokens(100)
+    scheduler.observe(False, 0.4)
+    scheduler.observe(True, 0.1)
+
+    report = scheduler.report(cached_tokens=50)
+    assert "2 requests in 1 prefix groups" in report
+    assert "prefill saved" in report
+    assert "50 cached prompt tokens" in report
+    scheduler.reset()
+    assert scheduler.report() == "Prefix scheduling: no requests"
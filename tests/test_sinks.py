@@ -0,0 +1,57 @@
+import gzip
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.sinks import ResultSink, JSONArraySink, JSONLSink, open_sink
+
+RECORDS = [
+    {"prompt": "Что такое Python?", "generated_response": "Язык", "reference": None},
+    {"prompt": "2 + 2", "generated_response": "4", "reference": "4", "metrics": {"exact_match": 1.0}}
+]
+
+def test_result_sink_requires_write():
+    class NoWrite(ResultSink):
+        pass
+
+    with pytest.raises(TypeError):
+        NoWrite()
+
+@pytest.mark.parametrize('records', [[], RECORDS])
+def test_json_array_sink_matches_json_dump(tmp_path, records):
+    path = tmp_path / 'results.json'
+    with JSONArraySink(str(path)) as sink:
+        for record in records:
+            sink.write(record)
+
+    assert path.read_text(encoding='utf-8') == json.dumps(records, ensure_ascii=False, indent=2)
+
+def test_jsonl_sink_append_and_gzip(tmp_path):
+    path = tmp_path / 'results.jsonl.gz'
+    with open_sink(str(path)) as sink:
+        assert isinstance(sink, JSONLSink)
+        sink.write(RECORDS[0])
+    with JSONLSink(str(path), append=True) as sink:
+        sink.write(RECORDS[1])
+
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        assert [json.loads(line) for line in f] == RECORDS
+
+def test_open_sink_picks_format_by_extension(tmp_path):
+    with open_sink(str(tmp_path / 'a.json')) as sink:
+        assert isinstance(sink, JSONArraySink)
+    with pytest.raises(ValueError):
+        open_sink(str(tmp_path / 'a.csv'))
+
+def test_parquet_sink_round_trip(tmp_path):
+    pq = pytest.importorskip('pyarrow.parquet')
+    path = tmp_path / 'results.parquet'
+    with open_sink(str(path)) as sink:
+        for record in RECORDS:
+            sink.write({key: value for key, value in record.items() if key != 'metrics'})
+
+    assert pq.read_table(str(path)).column('generated_response').to_pylist() == ["Язык", "4"]
@@ -0,0 +1,93 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.daemon import _RequestEvents, replay_events
+from src.telemetry import APIMetrics, LatencyHistogram, create_metrics
+
+def test_daemon_events_carry_in_flight_peak():
+    daemon_metrics = APIMetrics()
+    events = _RequestEvents(daemon_metrics)
+
+    # Запрос другого клиента уже в работе
+    events.request_started()
+    events.begin()
+    events.request_started()
+    events.request_finished(0.5, {'completion_tokens': 10})
+    client_events = events.end()
+    events.request_finished(0.5)
+
+    metrics = APIMetrics()
+    replay_events(metrics, client_events)
+    snapshot = metrics.snapshot()
+
+    assert snapshot['requests_total'] == 1
+    assert snapshot['completion_tokens_total'] == 10
+    assert snapshot['in_flight'] == 0
+    assert snapshot['max_in_flight'] == 2
+    assert 'max in-flight 2' in metrics.summary()
+    assert events.in_flight == 0
+
+def test_histogram_quantiles_within_bucket_width():
+    histogram = LatencyHistogram()
+    for i in range(1, 101):
+        histogram.observe(i / 100)
+
+    assert histogram.count == 100
+    assert histogram.sum == pytest.approx(50.5)
+    assert histogram.max == 1.0
+    assert histogram.quantile(0.5) == pytest.approx(0.5, rel=0.05)
+    assert histogram.quantile(0.99) == pytest.approx(0.99, rel=0.05)
+    assert LatencyHistogram().quantile(0.5) == 0.0
+
+def test_api_metrics_counts_requests_tokens_and_errors():
+    metrics = APIMetrics()
+    metrics.request_started()
+    metrics.request_started()
+    assert metrics.snapshot()['in_flight'] == 2
+    metrics.request_finished(1.0, {'prompt_tokens': 5, 'completion_tokens': 20,
+                                   'prompt_tokens_details': {'cached_tokens': 3}})
+    metrics.request_finished(0.5, error='http_503')
+    metrics.record_retry()
+    metrics.record_finish_reasons(['stop', 'length', None])
+    metrics.record_generation(1.2)
+    metrics.record_generation(0.1, success=False)
+
+    data = metrics.snapshot()
+    assert data['requests_total'] == 2
+    assert data['errors'] == {'http_503': 1}
+    assert data['retries_total'] == 1
+    assert data['in_flight'] == 0
+    assert data['max_in_flight'] == 2
+    assert data['prompt_tokens_total'] == 5
+    assert data['cached_prompt_tokens_total'] == 3
+    assert data['completion_tokens_total'] == 20
+    assert data['decode_tokens_per_second'] == pytest.approx(20.0)
+    assert data['finish_reasons'] == {'stop': 1, 'length': 1, 'unknown': 1}
+    assert data['truncated_total'] == 1
+    assert data['generations_total'] == 2
+    assert data['failed_generations_total'] == 1
+
+    text = metrics.to_prometheus()
+    assert 'lmstudio_requests_total 2' in text
+    assert 'lmstudio_errors_total{kind="http_503"} 1' in text
+    assert 'lmstudio_completions_total{reason="length"} 1' in text
+    assert '(33.3% truncated)' in metrics.summary()
+
+@pytest.mark.parametrize('fmt', ['prometheus', 'json'])
+def test_create_metrics_flushes_on_close(tmp_path, fmt):
+    path = tmp_path / 'out' / f'metrics.{fmt}'
+    metrics, flusher = create_metrics({'metrics': {'path': str(path), 'format': fmt, 'flush_interval': 3600}})
+    metrics.record_retry()
+    flusher.close()
+
+    text = path.read_text(encoding='utf-8')
+    if fmt == 'json':
+        assert json.loads(text)['retries_total'] == 1
+    else:
+        assert 'lmstudio_retries_total 1' in text
+    assert create_metrics({'metrics': {'enabled': False}}) == (None, None)
@@ -0,0 +1,85 @@
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.prompts import PromptLibrary
+from src.tokens import TokenBudget, TokenBudgetError, TokenCounter, LengthPolicy
+
+def _budget(max_tokens: int, overflow: str = 'truncate') -> TokenBudget:
+    return TokenBudget({'data': {'max_tokens_per_sample': max_tokens, 'overflow': overflow, 'chars_per_token': 1.0}})
+
+def _render(item):
+    return f"{item.get('instruction', '')}|{item.get('input', '')}"
+
+def test_counter_approximation_and_truncate():
+    counter = TokenCounter(chars_per_token=3.0)
+
+    assert counter.approximate
+    assert counter.count('') == 0
+    assert counter.count('abcd') == 2
+    assert counter.truncate('abcdefghij', 2) == 'abcdef'
+    assert counter.truncate('abc', 5) == 'abc'
+
+def test_fit_record_keeps_short_records_untouched():
+    budget = _budget(20)
+    item = {'instruction': 'short', 'input': 'x'}
+
+    assert budget.fit_record(item, _render) is item
+    assert budget.stats['records_truncated'] == 0
+
+def test_fit_record_truncates_input_first():
+    budget = _budget(20)
+    item = {'instruction': 'keep me', 'input': 'x' * 50}
+    fitted = budget.fit_record(item, _render)
+
+    assert fitted['instruction'] == 'keep me'
+    assert len(_render(fitted)) <= 20
+    assert item['input'] == 'x' * 50
+    assert budget.stats['records_truncated'] == 1
+    assert budget.stats['tokens_saved'] == len(_render(item)) - len(_render(fitted))
+
+def test_fit_record_drop_policy():
+    budget = _budget(10, overflow='drop')
+
+    assert budget.fit_record({'instruction': 'y' * 30}, _render) is None
+    assert budget.stats['records_dropped'] == 1
+    budget.reset()
+    assert budget.stats['records_dropped'] == 0
+
+def test_fit_examples_removes_examples_from_the_end():
+    template = PromptLibrary().training
+    examples = [{'instruction': f'пример {i}', 'output': 'o' * 40} for i in range(3)]
+    item = {'instruction': 'запрос'}
+    full = len(template.render(examples, item))
+    budget = _budget(full - 1)
+
+    kept = budget.fit_examples(examples, item, template)
+    assert kept == examples[:2]
+    assert budget.stats['examples_dropped'] == 1
+
+    with pytest.raises(TokenBudgetError):
+        _budget(5).fit_examples(examples, item, template)
+
+def test_length_policy_reference():
+    policy = LengthPolicy(max_tokens=100, policy='reference', quantile=0.5, factor=2.0, min_tokens=4,
+                          counter=TokenCounter(chars_per_token=1.0))
+    assert policy.limit() == 100
+
+    assert policy.fit(['a' * 10, 'a' * 20, '', 'a' * 30]) == 40
+    assert policy.fitted
+    assert policy.limit() == 40
+    # Длинный эталон поднимает лимит, но не выше max_tokens
+    assert policy.limit('a' * 30) == 60
+    assert policy.limit('a' * 80) == 100
+    assert "1 of 4 completions truncated" in policy.report({'length': 1, 'stop': 3})
+
+def test_length_policy_fixed_and_validation():
+    policy = LengthPolicy(max_tokens=64)
+
+    assert policy.fit(['a' * 1000]) == 64
+    assert policy.limit('a' * 1000) == 64
+    with pytest.raises(ValueError):
+        LengthPolicy(policy='unknown')
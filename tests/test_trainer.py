@@ -0,0 +1,39 @@
+import json
+import os
+import sys
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src.metrics import METRIC_NAMES
+from src.trainer import APITrainer
+
+def _config(tmp_path) -> dict:
+    return {
+        'api': {'base_url': 'http://127.0.0.1:9/v1', 'model_name': 'm', 'api_key': 'k'},
+        'model': {'temperature': 0.7, 'top_p': 0.9},
+        'training': {'max_concurrency': 2, 'output_dir': str(tmp_path), 'num_train_epochs': 2},
+        'rate_limit': {'enabled': False},
+        'metrics': {'enabled': False},
+        'data': {'max_tokens_per_sample': 512}
+    }
+
+def _summary(value: float, count: int) -> dict:
+    return {**{name: value for name in METRIC_NAMES}, 'count': count}
+
+def test_eval_without_epoch_keeps_epoch_summary_untouched(tmp_path):
+    trainer = APITrainer(_config(tmp_path))
+    try:
+        assert trainer._eval_path(1) == f"{tmp_path}/eval_results_epoch1.json"
+        assert trainer._eval_path() == f"{tmp_path}/eval_results.json"
+
+        trainer._save_eval_summary(1, _summary(1.0, 2))
+        trainer._save_eval_summary(None, _summary(0.0, 4))
+    finally:
+        trainer.client.close()
+
+    assert sorted(os.listdir(tmp_path)) == ['eval_summary.json', 'eval_summary_epoch1.json', 'eval_summary_latest.json']
+    overall = json.loads((tmp_path / 'eval_summary.json').read_text(encoding='utf-8'))
+    assert list(overall['epochs']) == ['1']
+    assert overall['overall']['count'] == 2
+    assert overall['overall']['exact_match'] == 1.0
+    assert json.loads((tmp_path / 'eval_summary_latest.json').read_text(encoding='utf-8'))['count'] == 4
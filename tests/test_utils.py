@@ -0,0 +1,117 @@
+import json
+import os
+import sys
+
+import pytest
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from src import utils
+from src.rate_limit import RetryableAPIError
+from src.utils import iter_json_array, checkpoint_progress, seek_checkpoint_progress
+
+@pytest.mark.parametrize('chunk_size', [1, 2, 3, 7, 1 << 20])
+@pytest.mark.parametrize('text', [
+    '[]',
+    ' [ ]\n',
+    '[1, 2, 3]',
+    '[123456, 7]',
+    '[{"a": [1, 2.5, "ü"]}, null, true, "x"]'
+])
+def test_iter_json_array_matches_json_load(tmp_path, text, chunk_size):
+    path = tmp_path / 'data.json'
+    path.write_text(text, encoding='utf-8')
+
+    assert list(iter_json_array(str(path), chunk_size)) == json.loads(text)
+
+@pytest.mark.parametrize('text', ['[,,1]', '[1,,2]', '[{"a":1},]', '[ , ]', '[1 2]', '[1', '[1]]', '{"a": 1}', ''])
+def test_iter_json_array_rejects_malformed_arrays(tmp_path, text):
+    path = tmp_path / 'data.json'
+    path.write_text(text, encoding='utf-8')
+
+    with pytest.raises(ValueError):
+        list(iter_json_array(str(path), 3))
+
+def test_iter_json_array_long_element_spanning_chunks(tmp_path):
+    element = 'a' * (1 << 20)
+    path = tmp_path / 'data.json'
+    path.write_text(json.dumps([element, 1, element]), encoding='utf-8')
+
+    assert list(iter_json_array(str(path), 64)) == [element, 1, element]
+
+def _write_checkpoint(path, records, tail: str = ''):
+    with open(path, 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record, ensure_ascii=False) + '\n')
+        f.write(tail)
+
+def _records(epoch, indices):
+    return [{"epoch": epoch, "index": i, "generated_response": f"ответ {i}"} for i in indices]
+
+def test_seek_checkpoint_progress_after_resume_with_failed_tail(tmp_path):
+    # Последние записи эпохи 1 не удались и были дописаны при продолжении после записей эпохи 2
+    records = (_records(1, range(98)) + _records(2, range(50)) +
+               _records(1, [98, 99]) + _records(2, range(50, 100)))
+    path = tmp_path / 'checkpoint.jsonl'
+    _write_checkpoint(path, records)
+
+    count, progress = seek_checkpoint_progress(str(path))
+
+    assert count == len(records)
+    assert progress == {1: 99, 2: 99}
+    assert progress == checkpoint_progress(records)
+
+def test_seek_checkpoint_progress_interleaved_epochs(tmp_path):
+    records = [record for i in range(40) for epoch in (1, 2, 3) for record in _records(epoch, [i])]
+    path = tmp_path / 'checkpoint.jsonl'
+    _write_checkpoint(path, records[:-2])
+
+    count, progress = seek_checkpoint_progress(str(path))
+
+    assert count == len(records) - 2
+    assert progress == {1: 39, 2: 38, 3: 38}
+
+def test_seek_checkpoint_progress_other_key_order_and_partial_line(tmp_path):
+    records = _records(1, range(5)) + [{"index": 5, "epoch": 1}, {"note": "no epoch"}]
+    path = tmp_path / 'checkpoint.jsonl'
+    _write_checkpoint(path, records, tail='{"epoch": 1, "index": 6, "generated_resp')
+
+    count, progress = seek_checkpoint_progress(str(path))
+
+    assert count == len(records)
+    assert progress == {1: 5}
+
+CONFIG = {'api': {'base_url': 'http://localhost:1234/v1', 'model_name': 'm', 'api_key': 'k'},
+          'rate_limit': {'backoff_base': 1.0, 'backoff_max': 1.0}}
+
+def _scripted_requests(monkeypatch, outcomes: list) -> list:
+    calls = []
+    def make_api_request(*args, **kwargs):
+        calls.append(kwargs)
+        outcome = outcomes[len(calls) - 1]
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+    monkeypatch.setattr(utils, 'make_api_request', make_api_request)
+    monkeypatch.setattr(utils.time, 'sleep', lambda delay: None)
+    return calls
+
+@pytest.mark.parametrize('outcome', [None, {'choices': []}, {}, ValueError('bad body')])
+def test_generate_with_retry_does_not_repeat_non_retryable(monkeypatch, outcome):
+    calls = _scripted_requests(monkeypatch, [outcome, {'choices': [{'message': {'content': 'late'}}]}])
+
+    assert utils.generate_with_retry(CONFIG, 'prompt', max_retries=3) is None
+    assert len(calls) == 1
+
+def test_generate_with_retry_repeats_retryable(monkeypatch):
+    calls = _scripted_requests(monkeypatch, [RetryableAPIError('503', status=503),
+                                             {'choices': [{'message': {'content': 'ok'}}]}])
+
+    assert utils.generate_with_retry(CONFIG, 'prompt', max_retries=3) == 'ok'
+    assert len(calls) == 2
+
+def test_generate_with_retry_gives_up_after_max_retries(monkeypatch):
+    calls = _scripted_requests(monkeypatch, [RetryableAPIError('timeout')] * 3)
+
+    assert utils.generate_with_retry(CONFIG, 'prompt', max_retries=3) is None
+    assert len(calls) == 3